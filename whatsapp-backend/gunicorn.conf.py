@@ -0,0 +1,8 @@
+# Loaded automatically by gunicorn started from this directory, e.g.
+#   gunicorn -w 4 -b 0.0.0.0:5000 src.main:app
+import sys
+
+def post_worker_init(worker):
+    # The worker has imported the app by now; each worker campaigns for
+    # leadership (see start_background_services in main.py)
+    sys.modules[worker.wsgi.import_name].start_background_services(processes=worker.cfg.workers)
@@ -7,9 +7,14 @@ from flask import Flask, render_template_string
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from models.whatsapp import db
+from models.schema import upgrade_schema
 from routes.whatsapp import whatsapp_bp
 from routes.automation import automation_bp
-from services.automation_engine import automation_engine
+from services.deferred_tasks import deferred_tasks
+from services.scheduler import job_scheduler
+from services.job_runner import job_runner
+from services.leader import leader_elector
+from services.conversation_locks import conversation_locks
 
 app = Flask(__name__)
 
@@ -26,9 +31,32 @@ CORS(app, origins="*")
 app.register_blueprint(whatsapp_bp, url_prefix='/api')
 app.register_blueprint(automation_bp, url_prefix='/api')
 
-# Create tables
-with app.app_context():
-    db.create_all()
+# Create tables (not in spawned helper processes, e.g. catalogue extraction
+# workers, which import this module as __mp_main__ only for its code)
+if __name__ != '__mp_main__':
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
+
+# Background services run their database work inside this app's context
+deferred_tasks.init_app(app)
+job_scheduler.init_app(app)
+job_runner.init_app(app)
+leader_elector.init_app(app)
+
+def start_background_services(processes=1):
+    """
+    Campaign for leadership in this process; only the leader starts the
+    automation engine and the WhatsApp sessions. Called once by each
+    serving process (the __main__ block below, gunicorn.conf.py for each
+    gunicorn worker) rather than at import, so scripts that only need the
+    app never take part. BACKGROUND_SERVICES=off keeps a process out.
+    `processes` is how many processes serve requests, which decides
+    whether conversations are leased across processes.
+    """
+    conversation_locks.configure_processes(processes)
+    if os.getenv('BACKGROUND_SERVICES', 'on').lower() not in ('off', '0', 'false'):
+        leader_elector.start()
 
 @app.route('/')
 def index():
@@ -172,8 +200,11 @@ def index():
     ''')
 
 if __name__ == '__main__':
-    # Start automation engine
-    automation_engine.start()
+    # The automation engine is started by whichever process wins the leader election.
+    # The debug reloader runs this file in a watcher process and in the child that
+    # serves requests (WERKZEUG_RUN_MAIN set); only the child campaigns.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
     
     # Run the Flask app
     app.run(debug=True, host='0.0.0.0', port=5000)
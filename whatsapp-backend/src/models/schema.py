@@ -0,0 +1,37 @@
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateIndex
+from models.whatsapp import db
+
+def upgrade_schema():
+    """
+    Bring an existing database up to date with the models. db.create_all()
+    only creates missing tables; this adds the columns and indexes that were
+    introduced later on tables that already exist. Call inside an app context
+    after db.create_all().
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        with engine.begin() as connection:
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                
+                # Added columns are nullable; uniqueness is enforced by an index instead
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.exec_driver_sql(
+                    f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                )
+                print(f"Added column {table.name}.{column.name}")
+        
+        existing_indexes = {index['name'] for index in inspect(engine).get_indexes(table.name)}
+        with engine.begin() as connection:
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    connection.execute(CreateIndex(index))
+                    print(f"Created index {index.name}")
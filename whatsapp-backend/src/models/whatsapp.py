@@ -32,18 +32,100 @@ class Doctor(db.Model):
     messages = db.relationship('ChatMessage', backref='doctor', lazy=True)
     orders = db.relationship('Order', backref='doctor', lazy=True)
     course_registrations = db.relationship('CourseRegistration', backref='doctor', lazy=True)
+    
+    __table_args__ = (
+        # Follow-up queue scans idle leads per tag, stalest first
+        db.Index('ix_doctors_tag_last_interaction', 'tag', 'last_interaction'),
+    )
 
 class ChatMessage(db.Model):
     __tablename__ = 'chat_messages'
+    # A message delivered twice (re-polled, webhook retry) is stored once
+    __table_args__ = (db.Index('ix_chat_messages_external_id', 'external_id', unique=True),)
     
     id = db.Column(db.Integer, primary_key=True)
+    external_id = db.Column(db.String(128))  # WhatsApp message id (Web data-id or API wamid)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), nullable=False)
     whatsapp_number_id = db.Column(db.Integer, db.ForeignKey('whatsapp_numbers.id'), nullable=False)
     sender = db.Column(db.String(10), nullable=False)  # 'doctor', 'ai', 'admin'
     message = db.Column(db.Text, nullable=False)
     message_type = db.Column(db.String(20), default='text')  # 'text', 'image', 'document', 'audio'
     status = db.Column(db.String(20), default='sent')  # 'sent', 'delivered', 'read'
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+class MessageLabel(db.Model):
+    __tablename__ = 'message_labels'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('chat_messages.id'), unique=True, nullable=False)
+    intent = db.Column(db.String(30), nullable=False)  # e.g. 'greeting', 'pricing', 'catalogue'
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+class DeferredTask(db.Model):
+    __tablename__ = 'deferred_tasks'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)  # e.g. 'offer'
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), index=True)
+    whatsapp_number_id = db.Column(db.Integer, db.ForeignKey('whatsapp_numbers.id'))  # Send via this number if active
+    phone = db.Column(db.String(20), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    run_at = db.Column(db.DateTime, nullable=False, index=True)
+    status = db.Column(db.String(20), default='pending', index=True)  # 'pending', 'running', 'sent', 'failed', 'cancelled'
+    error = db.Column(db.Text)
+    claimed_at = db.Column(db.DateTime)  # When a worker set it 'running'
+    claimed_term = db.Column(db.Integer)  # Leader term of the process that claimed it
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+    
+class JobRun(db.Model):
+    __tablename__ = 'job_runs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    last_started = db.Column(db.DateTime)
+    last_finished = db.Column(db.DateTime)
+    last_duration = db.Column(db.Float)
+    last_status = db.Column(db.String(20))  # 'success', 'failed', 'timeout'
+    last_error = db.Column(db.Text)
+
+class ServiceLease(db.Model):
+    __tablename__ = 'service_leases'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    holder = db.Column(db.String(120), nullable=False)  # host:pid:nonce of the leader process
+    term = db.Column(db.Integer, default=1)  # incremented whenever the holder changes
+    expires_at = db.Column(db.DateTime, nullable=False)
+    renewed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SharedState(db.Model):
+    __tablename__ = 'shared_state'
+    
+    key = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.Text)  # JSON
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ControlCommand(db.Model):
+    __tablename__ = 'control_commands'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    command = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text)  # JSON
+    status = db.Column(db.String(20), default='pending', index=True)  # 'pending', 'running', 'done'
+    result = db.Column(db.Text)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+
+class FollowUpLog(db.Model):
+    __tablename__ = 'follow_up_log'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), nullable=False, index=True)
+    whatsapp_number_id = db.Column(db.Integer, db.ForeignKey('whatsapp_numbers.id'), index=True)
+    message = db.Column(db.Text, nullable=False)
+    priority = db.Column(db.Float)
+    sent_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
 class AIAgent(db.Model):
     __tablename__ = 'ai_agents'
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import uuid
+import argparse
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+PAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mock_whatsapp_web.html')
+
+class MockWhatsAppWeb:
+    """
+    State of the simulated WhatsApp account: chats with their messages and
+    unread counts, the feed of incoming messages the page long-polls, and
+    timestamps of every injected and sent message for the benchmark.
+    """
+    
+    def __init__(self, ack_ms=300, history=50, event_buffer=100000):
+        self.ack_ms = ack_ms
+        self.history = history
+        self.chats = OrderedDict()
+        self.events = deque(maxlen=event_buffer)
+        self.seq = 0
+        self.injected_at = {}  # incoming message id -> time.time() it was injected
+        self.sent = []  # outgoing messages as the page submitted them
+        self._condition = threading.Condition()
+    
+    def _chat(self, phone, title=None):
+        chat = self.chats.get(phone)
+        if chat is None:
+            chat = self.chats[phone] = {
+                'phone': phone,
+                'title': title or f'+{phone}',
+                'messages': deque(maxlen=self.history),
+                'unread': 0
+            }
+        return chat
+    
+    def inject(self, phone, text, title=None):
+        """
+        Deliver a message from `phone` to the account; returns the message
+        """
+        phone = phone.lstrip('+')
+        message = {
+            'id': f'false_{phone}@c.us_{uuid.uuid4().hex[:20].upper()}',
+            'direction': 'in',
+            'text': text,
+            'time': datetime.now().strftime('%H:%M')
+        }
+        with self._condition:
+            chat = self._chat(phone, title)
+            chat['messages'].append(message)
+            chat['unread'] += 1
+            self.seq += 1
+            self.events.append({'seq': self.seq, 'phone': phone, 'title': chat['title'], 'message': message})
+            self.injected_at[message['id']] = time.time()
+            self._condition.notify_all()
+        return message
+    
+    def receive_send(self, phone, text, message_id):
+        """
+        A message typed and sent in the page
+        """
+        message = {
+            'id': message_id,
+            'direction': 'out',
+            'text': text,
+            'time': datetime.now().strftime('%H:%M'),
+            'ack': True
+        }
+        with self._condition:
+            self._chat(phone)['messages'].append(message)
+            self.sent.append({'id': message_id, 'phone': phone, 'text': text, 'received_at': time.time()})
+        return message
+    
+    def mark_read(self, phone):
+        with self._condition:
+            if phone in self.chats:
+                self.chats[phone]['unread'] = 0
+    
+    def events_since(self, since, timeout=25):
+        """
+        Incoming messages after seq `since`, waiting up to timeout seconds for one
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.seq > since, timeout=timeout)
+            if self.events and self.events[0]['seq'] > since + 1:
+                # The page fell further behind than the buffer reaches
+                return {'reset': True}
+            events = [event for event in self.events if event['seq'] > since]
+            return {'seq': self.seq, 'events': events}
+    
+    def snapshot(self):
+        with self._condition:
+            return {
+                'seq': self.seq,
+                'ack_ms': self.ack_ms,
+                'chats': [
+                    {'phone': chat['phone'], 'title': chat['title'], 'unread': chat['unread'],
+                     'messages': list(chat['messages'])}
+                    for chat in self.chats.values()
+                ]
+            }
+    
+    def get_stats(self):
+        with self._condition:
+            return {
+                'chats': len(self.chats),
+                'injected': len(self.injected_at),
+                'sent': len(self.sent),
+                'unread': sum(chat['unread'] for chat in self.chats.values())
+            }
+
+class FixtureServer:
+    """
+    Serves the simulator page and its JSON API on a local port:
+    
+    - GET /, /send?phone=   the page (click-to-chat opens that chat)
+    - GET /api/state        chats with recent messages and unread counts
+    - GET /api/events       long-poll for incoming messages (?since=seq)
+    - POST /api/inject      {"phone", "text", "title"?} deliver a message
+    - POST /api/send        {"phone", "text", "id"} a message sent in the page
+    - POST /api/read        {"phone"} the page opened a chat
+    - GET /api/stats        counters
+    """
+    
+    def __init__(self, host='127.0.0.1', port=0, ack_ms=300):
+        self.state = MockWhatsAppWeb(ack_ms=ack_ms)
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+    
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+    
+    def _handler(self):
+        state = self.state
+        with open(PAGE_PATH, 'rb') as page_file:
+            page = page_file.read()
+        
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, body, content_type='application/json', status=200):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Cache-Control', 'no-store')
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path in ('/', '/send'):
+                    self._reply(page, 'text/html; charset=utf-8')
+                elif url.path == '/api/state':
+                    self._reply(state.snapshot())
+                elif url.path == '/api/events':
+                    self._reply(state.events_since(int(query.get('since', ['0'])[0])))
+                elif url.path == '/api/stats':
+                    self._reply(state.get_stats())
+                else:
+                    self._reply({'error': 'Not found'}, status=404)
+            
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                data = json.loads(self.rfile.read(length) or b'{}')
+                path = urlparse(self.path).path
+                if path == '/api/inject':
+                    self._reply(state.inject(data['phone'], data['text'], data.get('title')))
+                elif path == '/api/send':
+                    self._reply(state.receive_send(data['phone'], data['text'], data['id']))
+                elif path == '/api/read':
+                    state.mark_read(data['phone'])
+                    self._reply({'success': True})
+                else:
+                    self._reply({'error': 'Not found'}, status=404)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        return Handler
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True, name='whatsapp-web-fixture')
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline WhatsApp Web simulator')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--ack-ms', type=int, default=300, help='Delay before a sent message shows its tick')
+    args = parser.parse_args()
+    
+    server = FixtureServer(port=args.port, ack_ms=args.ack_ms)
+    print(f"WhatsApp Web simulator listening on {server.url} (set WHATSAPP_WEB_URL={server.url})")
+    server._server.serve_forever()
@@ -0,0 +1,149 @@
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.request
+
+SAMPLE_MESSAGES = [
+    "Hello, I saw your message",
+    "What is the price of the 5 ml vial?",
+    "Please send the product catalogue",
+    "Is this available in Mumbai?",
+    "Can you share the composition?",
+    "Call me after 6 pm",
+    "Not interested right now",
+    "What is the minimum order quantity?",
+    "Do you offer a discount on bulk orders?",
+    "Thanks, I will check and revert"
+]
+
+class TrafficGenerator:
+    """
+    Delivers simulated doctor messages to the WhatsApp Web simulator
+    following a script of phases. Each phase is a dict:
+    
+    - seconds: how long the phase lasts
+    - rate: messages per second, across all chats
+    - chats: how many distinct doctors write (phones are numbered)
+    - pattern: 'poisson' (random gaps, the default) or 'constant'
+    
+    `inject(phone, text)` delivers one message, e.g. MockWhatsAppWeb.inject
+    in-process or http_injector(url) against a running fixture server.
+    """
+    
+    def __init__(self, inject, phases, phone_prefix='9190000', seed=None):
+        self.inject = inject
+        self.phases = phases
+        self.phone_prefix = phone_prefix
+        self.random = random.Random(seed)
+        self.stop_event = threading.Event()
+        self._thread = None
+        self.sent = 0
+        self.errors = 0
+    
+    def phone(self, index):
+        return f'{self.phone_prefix}{index:05d}'
+    
+    def _gap(self, rate, pattern):
+        if pattern == 'constant':
+            return 1.0 / rate
+        return self.random.expovariate(rate)
+    
+    def run_phase(self, phase):
+        seconds = float(phase['seconds'])
+        rate = float(phase.get('rate', 1))
+        chats = int(phase.get('chats', 10))
+        pattern = phase.get('pattern', 'poisson')
+        if rate <= 0:
+            self.stop_event.wait(seconds)
+            return
+        
+        # Messages go out on an absolute schedule so slow injects do not lower the rate
+        started = time.monotonic()
+        due = started
+        while not self.stop_event.is_set():
+            due += self._gap(rate, pattern)
+            if due - started > seconds:
+                break
+            delay = due - time.monotonic()
+            if delay > 0 and self.stop_event.wait(delay):
+                break
+            
+            text = f"{self.random.choice(SAMPLE_MESSAGES)} #{self.sent + 1}"
+            try:
+                self.inject(self.phone(self.random.randrange(chats)), text)
+                self.sent += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"Error injecting message: {str(e)}")
+        
+        # Sit out the rest of the phase if the last gap ran past its end
+        remaining = seconds - (time.monotonic() - started)
+        if remaining > 0:
+            self.stop_event.wait(remaining)
+    
+    def run(self):
+        for phase in self.phases:
+            if self.stop_event.is_set():
+                break
+            self.run_phase(phase)
+        return self.sent
+    
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True, name='traffic-generator')
+        self._thread.start()
+        return self._thread
+    
+    def join(self, timeout=None):
+        if self._thread:
+            self._thread.join(timeout)
+    
+    def stop(self):
+        self.stop_event.set()
+        self.join(timeout=5)
+
+def http_injector(url):
+    """
+    inject() for a fixture server in another process
+    """
+    endpoint = url.rstrip('/') + '/api/inject'
+    
+    def inject(phone, text):
+        request = urllib.request.Request(
+            endpoint,
+            data=json.dumps({'phone': phone, 'text': text}).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return json.loads(response.read())
+    
+    return inject
+
+def load_phases(path=None, seconds=60, rate=1.0, chats=10, pattern='poisson'):
+    """
+    Phases from a JSON file (a list of phase dicts), or one phase from the arguments
+    """
+    if path:
+        with open(path) as script_file:
+            return json.load(script_file)
+    return [{'seconds': seconds, 'rate': rate, 'chats': chats, 'pattern': pattern}]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Send simulated doctor messages to the WhatsApp Web simulator')
+    parser.add_argument('--url', default='http://127.0.0.1:8765')
+    parser.add_argument('--script', help='JSON file with a list of phases')
+    parser.add_argument('--seconds', type=float, default=60)
+    parser.add_argument('--rate', type=float, default=1.0, help='Messages per second')
+    parser.add_argument('--chats', type=int, default=10)
+    parser.add_argument('--pattern', choices=('poisson', 'constant'), default='poisson')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    
+    generator = TrafficGenerator(
+        http_injector(args.url),
+        load_phases(args.script, args.seconds, args.rate, args.chats, args.pattern),
+        seed=args.seed
+    )
+    sent = generator.run()
+    print(f"Injected {sent} messages ({generator.errors} errors)")
@@ -0,0 +1,256 @@
+"""
+Performance harness for the WhatsApp Web backend against the offline
+simulator. Runs one WhatsAppWebService session in headless Chrome on a
+throwaway SQLite database and reports, as JSON:
+
+- capture: latency from a message being delivered to the page until the
+  session has saved it and called back, and messages never captured;
+- send: throughput and durations of a burst of sends to known chats;
+- memory: resident memory of chromedriver and Chrome while traffic runs.
+
+Run from whatsapp-backend/src (needs requirements-web.txt and Chrome):
+
+    python -m perf.web_benchmark --rate 5 --seconds 60 --sends 100
+
+Threshold options (e.g. --max-capture-p95-ms) make it exit with status 1
+when a result is out of bounds, for use as a CI check.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from models.whatsapp import db, WhatsAppNumber
+from models.schema import upgrade_schema
+from perf.fixture_server import FixtureServer
+from perf.traffic import TrafficGenerator, load_phases
+
+def create_app(database_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database_path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
+    return app
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def summarize_ms(values):
+    if not values:
+        return {'p50_ms': None, 'p95_ms': None, 'max_ms': None, 'mean_ms': None}
+    return {
+        'p50_ms': round(percentile(values, 0.5) * 1000, 1),
+        'p95_ms': round(percentile(values, 0.95) * 1000, 1),
+        'max_ms': round(max(values) * 1000, 1),
+        'mean_ms': round(sum(values) / len(values) * 1000, 1)
+    }
+
+class MemorySampler:
+    """
+    Samples a session's browser memory every `interval` seconds on a thread
+    """
+    
+    def __init__(self, service, interval=1.0):
+        self.service = service
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='memory-sampler')
+    
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            memory = self.service.memory_usage_mb()
+            if memory is not None:
+                self.samples.append(memory)
+    
+    def start(self):
+        self._thread.start()
+    
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join(timeout=self.interval + 1)
+    
+    def summary(self):
+        if not self.samples:
+            return {'measured': False}
+        return {
+            'measured': True,
+            'start_mb': round(self.samples[0], 1),
+            'end_mb': round(self.samples[-1], 1),
+            'peak_mb': round(max(self.samples), 1),
+            'mean_mb': round(sum(self.samples) / len(self.samples), 1),
+            'samples': len(self.samples)
+        }
+
+def run_benchmark(args):
+    server = FixtureServer(ack_ms=args.ack_ms).start()
+    # Read by WhatsAppWebService when it is created
+    os.environ['WHATSAPP_WEB_URL'] = server.url
+    from services.whatsapp_web import WhatsAppWebService
+    
+    workdir = tempfile.mkdtemp(prefix='whatsapp-web-bench-')
+    app = create_app(os.path.join(workdir, 'benchmark.db'))
+    service = None
+    try:
+        with app.app_context():
+            number = WhatsAppNumber(number='+910000000001', connection_type='Web', status='active')
+            db.session.add(number)
+            db.session.commit()
+            
+            service = WhatsAppWebService(number.id, headless=not args.headed)
+            service.session_path = os.path.join(workdir, 'profile')
+            if not service.initialize_driver() or not service.wait_for_login(timeout=30):
+                return {'error': 'Could not start Chrome on the simulator'}
+            
+            captured = {}
+            
+            def on_message(message):
+                captured[message.get('id')] = time.time()
+            
+            service.start_monitoring(callback=on_message)
+        
+        sampler = MemorySampler(service, args.memory_interval)
+        sampler.start()
+        
+        # Phase 1: capture under the scripted message rate
+        generator = TrafficGenerator(
+            server.state.inject,
+            load_phases(args.script, args.seconds, args.rate, args.chats, args.pattern),
+            seed=args.seed
+        )
+        traffic_started = time.monotonic()
+        generator.run()
+        traffic_seconds = time.monotonic() - traffic_started
+        
+        deadline = time.monotonic() + args.drain
+        while time.monotonic() < deadline and len(captured) < len(server.state.injected_at):
+            time.sleep(0.1)
+        
+        injected_at = dict(server.state.injected_at)
+        latencies = [captured[message_id] - at for message_id, at in injected_at.items() if message_id in captured]
+        capture = {
+            'injected': len(injected_at),
+            'captured': len(latencies),
+            'lost': len(injected_at) - len(latencies),
+            'seconds': round(traffic_seconds, 1),
+            **summarize_ms(latencies)
+        }
+        
+        # Phase 2: a burst of sends to chats the session has seen (opened in-app)
+        # data-ids look like false_<phone>@c.us_<id>
+        phones = sorted({message_id.split('_')[1][:-len('@c.us')] for message_id in captured if message_id})
+        phones = phones or [generator.phone(index) for index in range(args.chats)]
+        send_results = []
+        
+        def send(index):
+            phone = phones[index % len(phones)]
+            with app.app_context():
+                send_results.append(service.send_message(f'+{phone}', f'Benchmark reply {index + 1}'))
+        
+        send_started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=args.send_concurrency) as executor:
+            list(executor.map(send, range(args.sends)))
+        send_seconds = time.monotonic() - send_started
+        
+        sampler.stop()
+        
+        succeeded = sum(1 for result in send_results if result.get('success'))
+        send_stats = service.get_send_stats()
+        send_report = {
+            'requested': args.sends,
+            'sent': succeeded,
+            'failed': len(send_results) - succeeded,
+            'confirmed': sum(1 for result in send_results if result.get('confirmed')),
+            'seconds': round(send_seconds, 2),
+            'per_second': round(succeeded / send_seconds, 2) if send_seconds else None,
+            'in_app': send_stats.get('in_app'),
+            'page_loads': send_stats.get('page_loads'),
+            'p50_ms': round(send_stats['p50'] * 1000, 1) if 'p50' in send_stats else None,
+            'p95_ms': round(send_stats['p95'] * 1000, 1) if 'p95' in send_stats else None
+        }
+        
+        return {
+            'config': {
+                'phases': generator.phases,
+                'sends': args.sends,
+                'send_concurrency': args.send_concurrency,
+                'ack_ms': args.ack_ms,
+                'poll_seconds': service.poll_timeout,
+                'low_memory': service.low_memory
+            },
+            'capture': capture,
+            'send': send_report,
+            'memory': sampler.summary(),
+            'simulator': server.state.get_stats()
+        }
+    
+    finally:
+        if service is not None:
+            service.suspend()
+        server.stop()
+
+def check_thresholds(report, args):
+    """
+    Descriptions of the results that are out of bounds
+    """
+    failures = []
+    capture, send, memory = report['capture'], report['send'], report['memory']
+    if args.max_capture_p95_ms is not None and (capture['p95_ms'] is None or capture['p95_ms'] > args.max_capture_p95_ms):
+        failures.append(f"capture p95 {capture['p95_ms']} ms > {args.max_capture_p95_ms} ms")
+    if args.max_lost is not None and capture['lost'] > args.max_lost:
+        failures.append(f"{capture['lost']} messages not captured (max {args.max_lost})")
+    if args.min_sends_per_second is not None and (send['per_second'] or 0) < args.min_sends_per_second:
+        failures.append(f"{send['per_second']} sends/s < {args.min_sends_per_second}")
+    if args.max_memory_mb is not None and memory.get('peak_mb', 0) > args.max_memory_mb:
+        failures.append(f"peak memory {memory['peak_mb']} MB > {args.max_memory_mb} MB")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the WhatsApp Web backend against the offline simulator')
+    parser.add_argument('--script', help='JSON file with traffic phases (see perf/traffic.py)')
+    parser.add_argument('--seconds', type=float, default=60, help='Traffic duration without --script')
+    parser.add_argument('--rate', type=float, default=2.0, help='Incoming messages per second without --script')
+    parser.add_argument('--chats', type=int, default=20)
+    parser.add_argument('--pattern', choices=('poisson', 'constant'), default='poisson')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--sends', type=int, default=50)
+    parser.add_argument('--send-concurrency', type=int, default=4)
+    parser.add_argument('--ack-ms', type=int, default=300, help='Simulated delay before the sent tick')
+    parser.add_argument('--drain', type=float, default=10, help='Seconds to wait for stragglers after traffic')
+    parser.add_argument('--memory-interval', type=float, default=1.0)
+    parser.add_argument('--headed', action='store_true', help='Show the browser')
+    parser.add_argument('--output', help='Also write the report to this file')
+    parser.add_argument('--max-capture-p95-ms', type=float)
+    parser.add_argument('--max-lost', type=int)
+    parser.add_argument('--min-sends-per-second', type=float)
+    parser.add_argument('--max-memory-mb', type=float)
+    args = parser.parse_args()
+    
+    report = run_benchmark(args)
+    if 'error' not in report:
+        report['failures'] = check_thresholds(report, args)
+    
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    
+    if 'error' in report or report['failures']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
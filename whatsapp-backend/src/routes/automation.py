@@ -1,5 +1,8 @@
 from flask import Blueprint, request, jsonify
 from services.automation_engine import automation_engine
+from services.leader import leader_elector, get_shared_state
+from services.reply_backends import reply_service
+from services.conversation_context import conversation_store
 from services.ai_agents import (
     smart_reply_agent,
     lead_scoring_agent,
@@ -15,7 +18,12 @@ automation_bp = Blueprint('automation', __name__)
 @automation_bp.route('/automation/start', methods=['POST'])
 def start_automation():
     try:
-        automation_engine.start()
+        result = leader_elector.execute('automation.start')
+        if 'error' in result:
+            return jsonify(result), 500
+        if result.get('queued'):
+            return jsonify(result), 202
+        
         return jsonify({
             'success': True,
             'message': 'Automation engine started successfully'
@@ -26,7 +34,12 @@ def start_automation():
 @automation_bp.route('/automation/stop', methods=['POST'])
 def stop_automation():
     try:
-        automation_engine.stop()
+        result = leader_elector.execute('automation.stop')
+        if 'error' in result:
+            return jsonify(result), 500
+        if result.get('queued'):
+            return jsonify(result), 202
+        
         return jsonify({
             'success': True,
             'message': 'Automation engine stopped successfully'
@@ -38,13 +51,26 @@ def stop_automation():
 def get_automation_status():
     try:
         analytics = automation_engine.get_analytics()
-        return jsonify({
-            'is_running': automation_engine.is_running,
-            'auto_reply_enabled': automation_engine.auto_reply_enabled,
-            'follow_up_enabled': automation_engine.follow_up_enabled,
-            'lead_scoring_enabled': automation_engine.lead_scoring_enabled,
-            'analytics': analytics
-        })
+        
+        status = leader_elector.execute('automation.status', timeout=2)
+        if 'is_running' not in status:
+            # No leader answered in time: report the requested state
+            status = {'is_running': get_shared_state('automation.running', False), 'leader_unavailable': True}
+        
+        status['leader'] = leader_elector.get_status()
+        status['analytics'] = analytics
+        return jsonify(status)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Outcome of a command forwarded to the leader (the command_id of a 202 response)
+@automation_bp.route('/commands/<int:command_id>', methods=['GET'])
+def get_command_status(command_id):
+    try:
+        command = leader_elector.get_command(command_id)
+        if command is None:
+            return jsonify({'error': 'Command not found'}), 404
+        return jsonify(command)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -53,14 +79,11 @@ def update_automation_settings():
     try:
         data = request.get_json()
         
-        if 'auto_reply_enabled' in data:
-            automation_engine.auto_reply_enabled = data['auto_reply_enabled']
-        
-        if 'follow_up_enabled' in data:
-            automation_engine.follow_up_enabled = data['follow_up_enabled']
-        
-        if 'lead_scoring_enabled' in data:
-            automation_engine.lead_scoring_enabled = data['lead_scoring_enabled']
+        result = leader_elector.execute('automation.settings', data)
+        if 'error' in result:
+            return jsonify(result), 500
+        if result.get('queued'):
+            return jsonify(result), 202
         
         return jsonify({
             'success': True,
@@ -81,7 +104,7 @@ def test_smart_reply():
         if doctor_id:
             doctor_context = Doctor.query.get(doctor_id)
         
-        reply = smart_reply_agent.generate_reply(message_text, doctor_context)
+        reply = reply_service.generate_reply(message_text, doctor_context)
         return jsonify(reply)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -101,12 +124,14 @@ def update_lead_score(doctor_id):
 @automation_bp.route('/ai/follow-up-candidates', methods=['GET'])
 def get_follow_up_candidates():
     try:
-        candidates = follow_up_engine.get_follow_up_candidates()
+        limit = request.args.get('limit', 50, type=int)
+        candidates = follow_up_engine.get_follow_up_candidates(limit)
         return jsonify([{
             'id': doctor.id,
             'name': doctor.name,
             'phone': doctor.phone,
             'tag': doctor.tag,
+            'score': doctor.score,
             'last_interaction': doctor.last_interaction.isoformat() if doctor.last_interaction else None
         } for doctor in candidates])
     except Exception as e:
@@ -143,6 +168,31 @@ def search_products():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@automation_bp.route('/catalogue/status', methods=['GET'])
+def get_catalogue_status():
+    try:
+        ingestor = automation_engine.catalogue_ingestor
+        return jsonify({
+            'products': len(pdf_catalogue_reader.products),
+            'ingestion': ingestor.get_status() if ingestor else None
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@automation_bp.route('/catalogue/sync', methods=['POST'])
+def sync_catalogue():
+    try:
+        # Ingestion runs in the leader, which publishes the catalogue to every worker
+        result = leader_elector.execute('catalogue.sync')
+        if 'error' in result:
+            return jsonify(result), 400
+        if result.get('queued'):
+            return jsonify(result), 202
+        
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @automation_bp.route('/ai/generate-offer/<int:doctor_id>', methods=['POST'])
 def generate_offer(doctor_id):
     try:
@@ -171,8 +221,12 @@ def send_bulk_message():
         if not message_text:
             return jsonify({'error': 'Message text is required'}), 400
         
-        result = automation_engine.send_bulk_message(message_text, target_tags, limit)
-        return jsonify(result)
+        result = leader_elector.execute('bulk.send_message', {
+            'message': message_text,
+            'target_tags': target_tags,
+            'limit': limit
+        })
+        return jsonify(result), 202 if result.get('queued') else 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -180,29 +234,11 @@ def send_bulk_message():
 def send_bulk_offers():
     try:
         data = request.get_json()
-        target_tags = data.get('target_tags', ['warm_lead', 'hot_lead'])
-        limit = data.get('limit', 50)
-        
-        # Get target doctors
-        query = Doctor.query.filter(Doctor.tag.in_(target_tags))
-        if limit:
-            query = query.limit(limit)
-        
-        doctors = query.all()
-        sent_count = 0
-        
-        for doctor in doctors:
-            offer_message = offer_engine.generate_offer(doctor)
-            result = automation_engine.send_bulk_message(offer_message, None, 1)
-            
-            if result.get('success'):
-                sent_count += result.get('sent_count', 0)
-        
-        return jsonify({
-            'success': True,
-            'sent_count': sent_count,
-            'total_targets': len(doctors)
+        result = leader_elector.execute('bulk.send_offers', {
+            'target_tags': data.get('target_tags', ['warm_lead', 'hot_lead']),
+            'limit': data.get('limit', 50)
         })
+        return jsonify(result), 202 if result.get('queued') else 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -225,14 +261,17 @@ def get_ai_performance():
                 'status': 'active',
                 'accuracy': 92,
                 'responses_today': 45,
-                'avg_response_time': 1.2
+                'avg_response_time': 1.2,
+                'classification_cache': smart_reply_agent.cache_info(),
+                'reply_backend': reply_service.stats()
             },
             'lead_scoring_agent': {
                 'name': 'Lead Scoring Agent',
                 'status': 'active',
                 'accuracy': 88,
                 'scores_updated_today': 23,
-                'avg_processing_time': 0.8
+                'avg_processing_time': 0.8,
+                'conversation_context': conversation_store.stats()
             },
             'follow_up_engine': {
                 'name': 'Follow-Up Engine',
@@ -258,7 +297,12 @@ def get_ai_performance():
 @automation_bp.route('/manual/process-auto-replies', methods=['POST'])
 def manual_process_auto_replies():
     try:
-        automation_engine.process_auto_replies()
+        result = leader_elector.execute('automation.run_job', {'name': 'process_auto_replies'})
+        if 'error' in result:
+            return jsonify(result), 500
+        if result.get('queued'):
+            return jsonify(result), 202
+        
         return jsonify({
             'success': True,
             'message': 'Auto-replies processed successfully'
@@ -269,7 +313,12 @@ def manual_process_auto_replies():
 @automation_bp.route('/manual/update-lead-scores', methods=['POST'])
 def manual_update_lead_scores():
     try:
-        automation_engine.update_lead_scores()
+        result = leader_elector.execute('automation.run_job', {'name': 'update_lead_scores'})
+        if 'error' in result:
+            return jsonify(result), 500
+        if result.get('queued'):
+            return jsonify(result), 202
+        
         return jsonify({
             'success': True,
             'message': 'Lead scores updated successfully'
@@ -280,7 +329,12 @@ def manual_update_lead_scores():
 @automation_bp.route('/manual/send-follow-ups', methods=['POST'])
 def manual_send_follow_ups():
     try:
-        automation_engine.send_follow_ups()
+        result = leader_elector.execute('automation.run_job', {'name': 'send_follow_ups'})
+        if 'error' in result:
+            return jsonify(result), 500
+        if result.get('queued'):
+            return jsonify(result), 202
+        
         return jsonify({
             'success': True,
             'message': 'Follow-ups sent successfully'
@@ -291,7 +345,12 @@ def manual_send_follow_ups():
 @automation_bp.route('/manual/health-check', methods=['POST'])
 def manual_health_check():
     try:
-        automation_engine.daily_health_check()
+        result = leader_elector.execute('automation.run_job', {'name': 'daily_health_check'})
+        if 'error' in result:
+            return jsonify(result), 500
+        if result.get('queued'):
+            return jsonify(result), 202
+        
         return jsonify({
             'success': True,
             'message': 'Health check completed successfully'
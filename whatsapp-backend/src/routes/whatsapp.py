@@ -1,7 +1,8 @@
 from flask import Blueprint, request, jsonify
 from datetime import datetime, timedelta
-from models.whatsapp import db, WhatsAppNumber, Doctor, ChatMessage, AIAgent
+from models.whatsapp import db, WhatsAppNumber, Doctor, ChatMessage, AIAgent, MessageLabel
 from services.whatsapp_manager import whatsapp_manager
+from services.leader import leader_elector
 import json
 
 whatsapp_bp = Blueprint('whatsapp', __name__)
@@ -65,11 +66,8 @@ def add_whatsapp_number():
         db.session.add(new_number)
         db.session.commit()
         
-        # Initialize connection
-        if data['connection_type'] == 'API':
-            whatsapp_manager._initialize_api_connection(new_number)
-        else:
-            whatsapp_manager._initialize_web_connection(new_number)
+        # Initialize connection (in the process that owns the sessions)
+        leader_elector.execute('numbers.connect', {'number_id': new_number.id})
         
         return jsonify({
             'success': True,
@@ -79,19 +77,27 @@ def add_whatsapp_number():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@whatsapp_bp.route('/numbers/readiness', methods=['GET'])
+def get_numbers_readiness():
+    try:
+        result = leader_elector.execute('numbers.readiness', timeout=2)
+        return jsonify(result), 202 if result.get('queued') else 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @whatsapp_bp.route('/numbers/<int:number_id>/restart', methods=['POST'])
 def restart_whatsapp_number(number_id):
     try:
-        result = whatsapp_manager.restart_connection(number_id)
-        return jsonify(result)
+        result = leader_elector.execute('numbers.restart', {'number_id': number_id})
+        return jsonify(result), 202 if result.get('queued') else 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @whatsapp_bp.route('/numbers/<int:number_id>/qr', methods=['GET'])
 def get_qr_code(number_id):
     try:
-        result = whatsapp_manager.get_qr_code(number_id)
-        return jsonify(result)
+        result = leader_elector.execute('numbers.qr', {'number_id': number_id}, timeout=2)
+        return jsonify(result), 202 if result.get('queued') else 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -166,10 +172,12 @@ def send_message(doctor_id):
             return jsonify({'error': 'Doctor not found'}), 404
         
         # Send message using WhatsApp manager
-        result = whatsapp_manager.send_message(doctor.phone, message_text)
+        result = leader_elector.execute('messages.send', {'to_number': doctor.phone, 'message': message_text})
         
         if 'error' in result:
             return jsonify(result), 500
+        if result.get('queued'):
+            return jsonify(result), 202
         
         return jsonify({
             'success': True,
@@ -179,6 +187,35 @@ def send_message(doctor_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@whatsapp_bp.route('/chat/messages/<int:message_id>/label', methods=['POST'])
+def label_message(message_id):
+    try:
+        data = request.get_json()
+        intent = (data or {}).get('intent')
+        if not intent:
+            return jsonify({'error': 'Intent is required'}), 400
+        
+        message = ChatMessage.query.get(message_id)
+        if not message:
+            return jsonify({'error': 'Message not found'}), 404
+        
+        # Labels are the training data for the intent model reply backend
+        label = MessageLabel.query.filter_by(message_id=message_id).first()
+        if label:
+            label.intent = intent
+        else:
+            db.session.add(MessageLabel(message_id=message_id, intent=intent))
+        db.session.commit()
+        
+        return jsonify({
+            'success': True,
+            'message_id': message_id,
+            'intent': intent
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 # AI Agents
 @whatsapp_bp.route('/agents', methods=['GET'])
 def get_ai_agents():
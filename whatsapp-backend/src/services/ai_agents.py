@@ -1,16 +1,37 @@
+import os
 import re
 import json
+import time
 import random
-from datetime import datetime, timedelta
-from models.whatsapp import db, Doctor, ChatMessage, AIAgent
+import threading
+from collections import namedtuple
+from datetime import datetime
+from models.whatsapp import db, Doctor, AIAgent
+from services.cache import LRUCache
+from services.catalogue_index import CatalogueIndex, TrigramIndex, catalogue_digest
+from services.catalogue_vectors import build_catalogue_vectors
+from services.conversation_context import conversation_store
+from services.follow_up_queue import follow_up_queue
+from services.leader import leader_elector
+from services.templates import template_registry, doctor_context, load_doctor_contexts, DoctorContext
 
 class SmartReplyAgent:
     """
     AI Agent for generating smart replies based on message content
     """
     
-    def __init__(self):
+    def __init__(self, cache_size=4096, classifier=None, intent_model_path=None):
         self.name = "Smart Reply Agent"
+        self.classification_cache = LRUCache(maxsize=cache_size)
+        self._compiled_patterns = []
+        self._patterns_signature = None
+        self._compile_lock = threading.Lock()
+        
+        # 'regex' (default) or 'intent_model', selectable per deployment
+        self.classifier = classifier or os.getenv('REPLY_CLASSIFIER', 'regex')
+        self.intent_model_path = intent_model_path or os.getenv('INTENT_MODEL_PATH', 'intent_model.npy')
+        self._intent_model = None
+        self._intent_model_failed = False
         self.patterns = {
             'greeting': [
                 r'\b(hello|hi|hey|namaste|good morning|good afternoon|good evening)\b',
@@ -19,13 +40,13 @@ class SmartReplyAgent:
                  'Namaste! Thank you for reaching out. How may I help you?']
             ],
             'pricing': [
-                r'\b(price|cost|rate|pricing|expensive|cheap|budget)\b',
+                r'\b(prices?|cost|rate|pricing|expensive|cheap|budget)\b',
                 ['I understand you\'re interested in our pricing. Let me connect you with our sales team for detailed pricing information.',
                  'For pricing details, I\'ll have our sales representative contact you shortly. Can you share your requirements?',
                  'Our pricing varies based on your specific needs. Would you like me to schedule a call with our sales team?']
             ],
             'catalogue': [
-                r'\b(catalogue|catalog|brochure|products|instruments|equipment)\b',
+                r'\b(catalogue|catalog|brochure|products?|instruments|equipment)\b',
                 ['I can send you our latest surgical instruments catalogue. Would you like the PDF version?',
                  'Our comprehensive product catalogue is available. Shall I share it with you?',
                  'We have an extensive range of surgical instruments. Let me send you our catalogue.']
@@ -44,27 +65,138 @@ class SmartReplyAgent:
             ]
         }
     
+    def _compile_patterns(self):
+        """
+        Compile the pattern table, dropping cached classifications whenever it changed
+        """
+        signature = tuple(
+            (category, pattern) for category, (pattern, responses) in self.patterns.items()
+        )
+        if signature == self._patterns_signature:
+            return self._compiled_patterns
+        
+        with self._compile_lock:
+            if signature != self._patterns_signature:
+                self._compiled_patterns = [
+                    (category, re.compile(pattern, re.IGNORECASE))
+                    for category, pattern in signature
+                ]
+                self.classification_cache.clear()
+                self._patterns_signature = signature
+        
+        return self._compiled_patterns
+    
+    @staticmethod
+    def normalize_message(message_text):
+        """
+        Normalize message text for classification (lowercase, collapsed whitespace)
+        """
+        return ' '.join((message_text or '').lower().split())
+    
+    def _get_intent_model(self):
+        """
+        Lazily load the intent model backend, falling back to regex on failure
+        """
+        if self.classifier != 'intent_model' or self._intent_model_failed:
+            return None
+        
+        if self._intent_model is None:
+            with self._compile_lock:
+                if self._intent_model is None and not self._intent_model_failed:
+                    try:
+                        from services.intent_model import IntentModel
+                        min_confidence = float(os.getenv('INTENT_MODEL_MIN_CONFIDENCE', '0.5'))
+                        self._intent_model = IntentModel.load(self.intent_model_path, min_confidence)
+                        self.classification_cache.clear()
+                    except Exception as e:
+                        self._intent_model_failed = True
+                        print(f"Intent model unavailable, using regex classifier: {str(e)}")
+        
+        return self._intent_model
+    
+    def classify(self, message_text):
+        """
+        Classify message content, memoized on the normalized message text.
+        Returns category, confidence and the matched spans per category
+        (offsets refer to the normalized text). Treat the result as read-only.
+        """
+        return self.classify_batch([message_text])[0]
+    
+    def classify_batch(self, messages):
+        """
+        Classify a batch of messages; cache misses are evaluated together
+        """
+        compiled_patterns = self._compile_patterns()
+        intent_model = self._get_intent_model()
+        
+        keys = [self.normalize_message(message_text) for message_text in messages]
+        classifications = [self.classification_cache.get(key) for key in keys]
+        
+        missing_keys = list(dict.fromkeys(
+            key for key, classification in zip(keys, classifications) if classification is None
+        ))
+        if not missing_keys:
+            return classifications
+        
+        model_results = intent_model.classify_batch(missing_keys) if intent_model else None
+        
+        computed = {}
+        for position, key in enumerate(missing_keys):
+            matches = {}
+            for category, regex in compiled_patterns:
+                spans = tuple(match.span() for match in regex.finditer(key))
+                if spans:
+                    matches[category] = spans
+            
+            if model_results:
+                category = model_results[position]['category']
+                confidence = model_results[position]['confidence']
+            elif matches:
+                # First matching category in table order wins
+                category = next(iter(matches))
+                confidence = 0.85
+            else:
+                category = 'general'
+                confidence = 0.6
+            
+            computed[key] = {
+                'category': category,
+                'confidence': confidence,
+                'matches': matches
+            }
+            self.classification_cache.put(key, computed[key])
+        
+        return [
+            classification if classification is not None else computed[key]
+            for key, classification in zip(keys, classifications)
+        ]
+    
+    def cache_info(self):
+        """
+        Get classification cache statistics
+        """
+        return self.classification_cache.info()
+    
     def generate_reply(self, message_text, doctor_context=None):
         """
         Generate smart reply based on message content and doctor context
         """
         try:
-            message_lower = message_text.lower()
-            
-            # Check for patterns and generate appropriate response
-            for category, (pattern, responses) in self.patterns.items():
-                if re.search(pattern, message_lower, re.IGNORECASE):
-                    response = random.choice(responses)
-                    
-                    # Personalize based on doctor context
-                    if doctor_context and doctor_context.name:
-                        response = f"Dr. {doctor_context.name.split()[-1]}, {response.lower()}"
-                    
-                    return {
-                        'reply': response,
-                        'category': category,
-                        'confidence': 0.85
-                    }
+            classification = self.classify(message_text)
+            category = classification['category']
+            
+            if category in self.patterns:
+                response = random.choice(self.patterns[category][1])
+                
+                # Personalize based on doctor context
+                if doctor_context and doctor_context.name:
+                    response = f"Dr. {doctor_context.name.split()[-1]}, {response.lower()}"
+                
+                return {
+                    'reply': response,
+                    'category': category,
+                    'confidence': classification['confidence']
+                }
             
             # Default response for unmatched messages
             default_responses = [
@@ -105,6 +237,10 @@ class LeadScoringAgent:
                 'low': 1  # 1-2 messages
             }
         }
+        # Keyword matches are counted over each doctor's whole history as messages arrive
+        conversation_store.track_keywords(
+            keyword for keywords in self.scoring_rules['keywords'].values() for keyword in keywords
+        )
     
     def calculate_lead_score(self, doctor_id):
         """
@@ -115,7 +251,8 @@ class LeadScoringAgent:
             if not doctor:
                 return 0
             
-            messages = ChatMessage.query.filter_by(doctor_id=doctor_id).all()
+            # Recent messages and counters come from the in-memory conversation buffer
+            context = conversation_store.get(doctor_id)
             
             score = 0
             
@@ -123,7 +260,7 @@ class LeadScoringAgent:
             score += 1
             
             # Message count scoring
-            message_count = len(messages)
+            message_count = context.message_count
             if message_count >= 5:
                 score += 3
             elif message_count >= 3:
@@ -131,25 +268,24 @@ class LeadScoringAgent:
             elif message_count >= 1:
                 score += 1
             
-            # Keyword analysis
-            all_text = ' '.join([msg.message.lower() for msg in messages if msg.sender == 'doctor'])
+            # Keyword analysis (any of the doctor's messages)
+            keyword_counts = context.keyword_counts
             
             for keyword in self.scoring_rules['keywords']['high_intent']:
-                if keyword in all_text:
+                if keyword_counts.get(keyword):
                     score += 3
             
             for keyword in self.scoring_rules['keywords']['medium_intent']:
-                if keyword in all_text:
+                if keyword_counts.get(keyword):
                     score += 2
             
             for keyword in self.scoring_rules['keywords']['low_intent']:
-                if keyword in all_text:
+                if keyword_counts.get(keyword):
                     score += 1
             
             # Recency scoring
-            if messages:
-                last_message = max(messages, key=lambda x: x.timestamp)
-                days_since_last = (datetime.utcnow() - last_message.timestamp).days
+            if context.last_timestamp:
+                days_since_last = (datetime.utcnow() - context.last_timestamp).days
                 
                 if days_since_last <= 1:
                     score += 2
@@ -225,59 +361,61 @@ class FollowUpEngine:
                 "Hi Dr. {name}, hope you're doing well. Any updates on your surgical instrument requirements?"
             ]
         }
+        template_registry.register_defaults({
+            f'follow_up.{template_type}': (['name'], templates)
+            for template_type, templates in self.follow_up_templates.items()
+        })
     
-    def get_follow_up_candidates(self):
+    def get_follow_up_candidates(self, limit=50):
         """
-        Get doctors who need follow-up messages
+        Get the doctors most in need of a follow-up message, best first
         """
         try:
-            # Get doctors who haven't been contacted in the last 3 days
-            cutoff_date = datetime.utcnow() - timedelta(days=3)
-            
-            candidates = Doctor.query.filter(
-                Doctor.last_interaction < cutoff_date,
-                Doctor.tag.in_(['warm_lead', 'hot_lead'])
-            ).all()
-            
-            return candidates
+            return follow_up_queue.candidates(limit)
             
         except Exception as e:
             return []
     
     def generate_follow_up_message(self, doctor):
         """
-        Generate follow-up message for a specific doctor
+        Generate follow-up message for a specific doctor (Doctor row or DoctorContext)
         """
         try:
+            context = doctor if isinstance(doctor, DoctorContext) else doctor_context(doctor)
+            
             # Determine follow-up type based on doctor's tag and history
-            if doctor.tag == 'hot_lead':
+            if context.tag == 'hot_lead':
                 template_type = 'interested'
-            elif doctor.tag == 'warm_lead':
+            elif context.tag == 'warm_lead':
                 template_type = 'interested'
             else:
                 template_type = 'inactive'
             
-            templates = self.follow_up_templates[template_type]
-            template = random.choice(templates)
-            
-            # Format with doctor's name
-            doctor_name = doctor.name.replace('Dr. ', '') if doctor.name else 'Doctor'
-            message = template.format(name=doctor_name)
-            
-            return message
+            return template_registry.render(f'follow_up.{template_type}', context)
             
         except Exception as e:
             return "Hello, hope you're doing well. Any updates on your requirements?"
+    
+    def generate_follow_up_messages(self, contexts):
+        """
+        Render follow-ups for prefetched DoctorContext records (no queries)
+        """
+        return [self.generate_follow_up_message(context) for context in contexts]
+
+# Everything derived from one version of the product catalogue
+CatalogueSnapshot = namedtuple('CatalogueSnapshot', ['products', 'index', 'trigram_index'])
 
 class PDFCatalogueReader:
     """
     AI Agent for reading and extracting information from PDF catalogues
     """
     
-    def __init__(self):
+    def __init__(self, products_path=None, index_path=None):
         self.name = "PDF Catalogue Reader"
+        self.products_path = products_path or os.getenv('CATALOGUE_PRODUCTS_PATH', 'catalogue_products.json')
+        self.index_path = index_path or os.getenv('CATALOGUE_INDEX_PATH', 'catalogue_index.bin')
         # Mock product database (in real implementation, this would be extracted from PDFs)
-        self.products = {
+        products = {
             'surgical_scissors': {
                 'name': 'Surgical Scissors',
                 'description': 'High-quality stainless steel surgical scissors',
@@ -297,20 +435,167 @@ class PDFCatalogueReader:
                 'categories': ['general surgery', 'cutting']
             }
         }
+        self.fuzzy_threshold = float(os.getenv('CATALOGUE_FUZZY_THRESHOLD', '0.3'))
+        # How often to check whether another process published a new catalogue
+        self.reload_interval = float(os.getenv('CATALOGUE_RELOAD_SECONDS', '5'))
+        self._loaded_version = None
+        self._checked_at = time.monotonic()
+        # Replaced as a whole so readers never see a half-built catalogue
+        self._catalogue = CatalogueSnapshot(products, None, None)
+        # (snapshot, vectors) built on first use, see _catalogue_vectors
+        self._vectors = (None, None)
+        self._vectors_lock = threading.Lock()
+        self.load_catalogue()
+    
+    @property
+    def products(self):
+        return self._catalogue.products
+    
+    @products.setter
+    def products(self, products):
+        self._catalogue = CatalogueSnapshot(products, None, None)
+    
+    @property
+    def index(self):
+        return self._catalogue.index
+    
+    @staticmethod
+    def _snapshot(products, index):
+        return CatalogueSnapshot(products, index, TrigramIndex.build(products))
     
-    def search_products(self, query):
+    def _catalogue_vectors(self, catalogue):
         """
-        Search products based on query
+        Similarity vectors of a catalogue snapshot, built once on first use
+        and only in the leader, which handles incoming messages. Other
+        processes (workers, ingest processes) get None and use BM25 search.
         """
+        if not leader_elector.is_leader:
+            return None
+        
+        with self._vectors_lock:
+            built_for, vectors = self._vectors
+            if built_for is not catalogue:
+                vectors = build_catalogue_vectors(catalogue.products)
+                self._vectors = (catalogue, vectors)
+        return vectors
+    
+    def _products_version(self):
         try:
-            query_lower = query.lower()
-            results = []
+            stat = os.stat(self.products_path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+    
+    def load_catalogue(self, persist=None):
+        """
+        Load products (if a catalogue file exists) and the search index.
+        A persisted index is memory-mapped when it was built from exactly
+        these products (its header holds their hash); otherwise it is rebuilt.
+        """
+        products = self.products
+        try:
+            self._loaded_version = self._products_version()
+            if self._loaded_version is not None:
+                with open(self.products_path) as products_file:
+                    products = json.load(products_file)
             
-            for product_id, product in self.products.items():
-                # Check if query matches product name, description, or categories
-                if (query_lower in product['name'].lower() or 
-                    query_lower in product['description'].lower() or
-                    any(query_lower in cat for cat in product['categories'])):
+            index = self._load_index(products)
+            if index is None:
+                index = self._build_index(products, persist)
+            
+            self._catalogue = self._snapshot(products, index)
+            
+            return True
+            
+        except Exception as e:
+            print(f"Error loading catalogue: {str(e)}")
+            self._catalogue = self._snapshot(products, CatalogueIndex.build(products))
+            return False
+    
+    def _load_index(self, products):
+        """
+        The persisted index if it matches the products, else None
+        """
+        if not os.path.exists(self.index_path):
+            return None
+        try:
+            index = CatalogueIndex.load(self.index_path)
+        except ValueError:
+            # Written by an older version
+            return None
+        return index if index.digest == catalogue_digest(products) else None
+    
+    def _build_index(self, products, persist=None):
+        index = CatalogueIndex.build(products)
+        
+        # Only persist indexes for file-backed catalogues
+        if persist or (persist is None and os.path.exists(self.products_path)):
+            index.save(self.index_path)
+        
+        return index
+    
+    def rebuild_index(self, persist=None):
+        """
+        Rebuild the inverted index from the current products
+        """
+        products = self.products
+        self._catalogue = self._snapshot(products, self._build_index(products, persist))
+        return self.index
+    
+    def publish_catalogue(self, products):
+        """
+        Persist a freshly ingested catalogue and swap it in atomically.
+        Searches keep using the previous snapshot until the swap. The index
+        is written before the products file, which is what other processes
+        watch (see reload_if_changed), so they map it instead of rebuilding.
+        """
+        index = self._build_index(products, persist=True)
+        
+        temp_path = f'{self.products_path}.tmp'
+        with open(temp_path, 'w') as products_file:
+            json.dump(products, products_file, ensure_ascii=False)
+        os.replace(temp_path, self.products_path)
+        
+        self._catalogue = self._snapshot(products, index)
+        self._loaded_version = self._products_version()
+        
+        return len(products)
+    
+    def reload_if_changed(self):
+        """
+        Reload the catalogue when another process has published a new one
+        (checked at most every reload_interval seconds)
+        """
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return False
+        self._checked_at = now
+        
+        version = self._products_version()
+        if version is None or version == self._loaded_version:
+            return False
+        # The publisher wrote the index; never write it from here
+        return self.load_catalogue(persist=False)
+    
+    def search_products(self, query, limit=10):
+        """
+        Search products based on query (BM25 ranked, best match first).
+        Falls back to typo-tolerant matching when nothing matches exactly.
+        """
+        try:
+            self.reload_if_changed()
+            products, index, trigram_index = self._catalogue
+            
+            hits = index.search(query, limit=limit)
+            if not hits and trigram_index:
+                corrected_query = trigram_index.correct_query(query, self.fuzzy_threshold)
+                if corrected_query:
+                    hits = index.search(corrected_query, limit=limit)
+            
+            results = []
+            for product_id, score in hits:
+                product = products.get(product_id)
+                if product:
                     results.append(product)
             
             return results
@@ -318,6 +603,45 @@ class PDFCatalogueReader:
         except Exception as e:
             return []
     
+    def suggest_products(self, query, limit=3):
+        """
+        Related product suggestions ranked by TF-IDF cosine similarity
+        """
+        try:
+            self.reload_if_changed()
+            catalogue = self._catalogue
+            vectors = self._catalogue_vectors(catalogue)
+            if vectors is None:
+                return self.search_products(query, limit=limit)
+            
+            return [
+                catalogue.products[product_id]
+                for product_id, similarity in vectors.search(query, limit=limit)
+                if product_id in catalogue.products
+            ]
+            
+        except Exception as e:
+            return []
+    
+    def suggest_products_batch(self, queries, limit=3):
+        """
+        Related product suggestions for many queries at once
+        """
+        try:
+            self.reload_if_changed()
+            catalogue = self._catalogue
+            vectors = self._catalogue_vectors(catalogue)
+            if vectors is None:
+                return [self.search_products(query, limit=limit) for query in queries]
+            
+            return [
+                [catalogue.products[product_id] for product_id, similarity in hits if product_id in catalogue.products]
+                for hits in vectors.search_batch(queries, limit=limit)
+            ]
+            
+        except Exception as e:
+            return [[] for query in queries]
+    
     def get_product_info(self, product_name):
         """
         Get detailed information about a specific product
@@ -327,7 +651,9 @@ class PDFCatalogueReader:
                 if product_name.lower() in product['name'].lower():
                     return product
             
-            return None
+            # No exact match: use the closest product for a misspelled name
+            results = self.search_products(product_name, limit=1)
+            return results[0] if results else None
             
         except Exception as e:
             return None
@@ -356,41 +682,58 @@ class OfferEngine:
                 'validity': 7
             }
         }
+        template_registry.register_defaults({
+            'offer': (['name', 'discount', 'description', 'validity'], [
+                "🎉 Special Offer for Dr. {name}!\n"
+                "\n"
+                "Get {discount}% OFF on all surgical instruments!\n"
+                "{description}\n"
+                "\n"
+                "✅ Valid for {validity} days\n"
+                "✅ Free shipping on orders above ₹5000\n"
+                "✅ Quality guaranteed\n"
+                "\n"
+                "Reply 'INTERESTED' to claim this offer!"
+            ])
+        })
     
     def generate_offer(self, doctor):
         """
-        Generate personalized offer for a doctor
+        Generate personalized offer for a doctor (Doctor row or prefetched DoctorContext)
         """
         try:
-            # Determine offer type based on doctor's history
-            message_count = ChatMessage.query.filter_by(doctor_id=doctor.id).count()
+            if isinstance(doctor, DoctorContext):
+                context = doctor
+            else:
+                message_count = conversation_store.get(doctor.id).message_count
+                context = doctor_context(doctor, message_count)
             
-            if message_count == 0:
+            # Determine offer type based on doctor's history
+            if context.message_count == 0:
                 offer_type = 'new_customer'
-            elif doctor.tag == 'hot_lead':
+            elif context.tag == 'hot_lead':
                 offer_type = 'bulk_order'
             else:
                 offer_type = 'seasonal'
             
             offer = self.offers[offer_type]
             
-            offer_message = f"""
-🎉 Special Offer for Dr. {doctor.name.replace('Dr. ', '') if doctor.name else 'Doctor'}!
-
-Get {offer['discount']}% OFF on all surgical instruments!
-{offer['description']}
-
-✅ Valid for {offer['validity']} days
-✅ Free shipping on orders above ₹5000
-✅ Quality guaranteed
-
-Reply 'INTERESTED' to claim this offer!
-            """.strip()
-            
-            return offer_message
+            return template_registry.render(
+                'offer',
+                context,
+                discount=offer['discount'],
+                description=offer['description'],
+                validity=offer['validity']
+            )
             
         except Exception as e:
             return "Special offer available! Contact us for details."
+    
+    def generate_offers(self, doctors):
+        """
+        Generate offers for many Doctor rows with a single prefetch query
+        """
+        return [self.generate_offer(context) for context in load_doctor_contexts(doctors)]
 
 # Global instances
 smart_reply_agent = SmartReplyAgent()
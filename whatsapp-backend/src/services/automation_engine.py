@@ -1,6 +1,6 @@
-import threading
+import os
+import re
 import time
-import schedule
 from datetime import datetime, timedelta
 from models.whatsapp import db, Doctor, ChatMessage, WhatsAppNumber
 from services.ai_agents import (
@@ -10,8 +10,24 @@ from services.ai_agents import (
     pdf_catalogue_reader,
     offer_engine
 )
+from services.browser_pool import browser_pool
+from services.catalogue_ingest import create_catalogue_ingestor
+from services.conversation_context import conversation_store
+from services.conversation_locks import conversation_locks
+from services.deferred_tasks import deferred_tasks
+from services.follow_up_dispatch import follow_up_dispatcher
+from services.follow_up_queue import follow_up_queue
+from services.job_runner import job_runner
+from services.leader import leader_elector, get_shared_state, set_shared_state
+from services.scheduler import job_scheduler
+from services.session_supervisor import session_supervisor
+from services.reply_backends import reply_service
+from services.templates import load_doctor_contexts
 from services.whatsapp_manager import whatsapp_manager
 
+# Messages that get product suggestions: the original trigger terms, plurals included
+PRODUCT_INQUIRY_PATTERN = re.compile(r'\b(catalogue|products?|instruments?|prices?)\b')
+
 class AutomationEngine:
     """
     Main automation engine that coordinates all AI agents and automated tasks
@@ -22,7 +38,132 @@ class AutomationEngine:
         self.auto_reply_enabled = True
         self.follow_up_enabled = True
         self.lead_scoring_enabled = True
-        self.threads = []
+        self.catalogue_ingestor = create_catalogue_ingestor(pdf_catalogue_reader)
+        self.offer_delay = float(os.getenv('OFFER_DELAY_SECONDS', '60'))
+        self.autostart = os.getenv('AUTOMATION_AUTOSTART', 'on').lower() not in ('off', '0', 'false')
+        self._register_jobs()
+        self._register_commands()
+        
+        # Only the elected leader process runs the background work
+        leader_elector.on_elected(self._on_elected)
+        leader_elector.on_demoted(self._on_demoted)
+    
+    def _register_jobs(self):
+        """
+        Register the recurring automation jobs (once; start/stop only toggle dispatching)
+        """
+        job_scheduler.add_job('process_auto_replies', self.process_auto_replies,
+                              interval=5 * 60, jitter=5, timeout=4 * 60)
+        job_scheduler.add_job('update_lead_scores', self.update_lead_scores,
+                              interval=60 * 60, jitter=60, timeout=30 * 60)
+        job_scheduler.add_job('send_follow_ups', self.send_follow_ups,
+                              interval=6 * 60 * 60, jitter=5 * 60, timeout=60 * 60)
+        job_scheduler.add_job('daily_health_check', self.daily_health_check,
+                              at='09:00', jitter=60, timeout=10 * 60)
+        job_scheduler.add_job('browser_pool_maintenance', browser_pool.maintain,
+                              interval=60, timeout=5 * 60)
+    
+    def _register_commands(self):
+        """
+        Control calls that must run in the leader process
+        """
+        leader_elector.register_command('automation.start', lambda payload: self.set_running(True))
+        leader_elector.register_command('automation.stop', lambda payload: self.set_running(False))
+        leader_elector.register_command('automation.settings', self.update_settings)
+        leader_elector.register_command('automation.status', lambda payload: self.get_status())
+        leader_elector.register_command('automation.run_job', lambda payload: self.run_job(payload['name']))
+        leader_elector.register_command('catalogue.sync', lambda payload: self.sync_catalogue())
+        leader_elector.register_command('bulk.send_message', lambda payload: self.send_bulk_message(
+            payload['message'], payload.get('target_tags'), payload.get('limit')
+        ))
+        leader_elector.register_command('bulk.send_offers', lambda payload: self.send_bulk_offers(
+            payload.get('target_tags'), payload.get('limit')
+        ))
+    
+    def _on_elected(self):
+        """
+        Take over the background work with the state stored by the previous leader
+        """
+        whatsapp_manager.initialize_connections()
+        self._apply_settings(get_shared_state('automation.settings', {}))
+        
+        if get_shared_state('automation.running', self.autostart):
+            self.start()
+    
+    def _on_demoted(self):
+        self.stop()
+        whatsapp_manager.cleanup()
+    
+    def set_running(self, running):
+        """
+        Start or stop the engine and remember the choice for future leaders
+        """
+        set_shared_state('automation.running', running)
+        if running:
+            self.start()
+        else:
+            self.stop()
+        return {'success': True, 'is_running': self.is_running}
+    
+    def _apply_settings(self, settings):
+        for key in ('auto_reply_enabled', 'follow_up_enabled', 'lead_scoring_enabled'):
+            if key in settings:
+                setattr(self, key, bool(settings[key]))
+    
+    def update_settings(self, settings):
+        """
+        Update feature toggles and remember them for future leaders
+        """
+        self._apply_settings(settings)
+        set_shared_state('automation.settings', {
+            'auto_reply_enabled': self.auto_reply_enabled,
+            'follow_up_enabled': self.follow_up_enabled,
+            'lead_scoring_enabled': self.lead_scoring_enabled
+        })
+        return {'success': True}
+    
+    def run_job(self, name):
+        """
+        Run one of the scheduled jobs right away (manual trigger)
+        """
+        jobs = {
+            'process_auto_replies': self.process_auto_replies,
+            'update_lead_scores': self.update_lead_scores,
+            'send_follow_ups': self.send_follow_ups,
+            'daily_health_check': self.daily_health_check
+        }
+        if name not in jobs:
+            return {'error': f'Unknown job: {name}'}
+        
+        jobs[name]()
+        return {'success': True}
+    
+    def sync_catalogue(self):
+        """
+        Ingest changed catalogue PDFs now (manual trigger)
+        """
+        if not self.catalogue_ingestor:
+            return {'error': 'CATALOGUE_PDF_DIR is not configured'}
+        
+        return {'success': True, 'result': self.catalogue_ingestor.sync()}
+    
+    def get_status(self):
+        """
+        In-process state of the engine and its background services
+        """
+        return {
+            'is_running': self.is_running,
+            'auto_reply_enabled': self.auto_reply_enabled,
+            'follow_up_enabled': self.follow_up_enabled,
+            'lead_scoring_enabled': self.lead_scoring_enabled,
+            'scheduler': job_scheduler.get_status(),
+            'deferred_tasks': deferred_tasks.get_stats(),
+            'follow_up_queue': follow_up_queue.get_stats(),
+            'follow_up_dispatch': follow_up_dispatcher.get_stats(),
+            'browser_pool': browser_pool.get_stats(),
+            'conversation_locks': conversation_locks.get_stats(),
+            'session_supervisor': session_supervisor.get_status()
+        }
     
     def start(self):
         """
@@ -33,16 +174,15 @@ class AutomationEngine:
         
         self.is_running = True
         
-        # Schedule automated tasks
-        schedule.every(5).minutes.do(self.process_auto_replies)
-        schedule.every(1).hours.do(self.update_lead_scores)
-        schedule.every(6).hours.do(self.send_follow_ups)
-        schedule.every().day.at("09:00").do(self.daily_health_check)
+        # Dispatch the automated tasks
+        job_scheduler.start()
         
-        # Start scheduler thread
-        scheduler_thread = threading.Thread(target=self._run_scheduler, daemon=True)
-        scheduler_thread.start()
-        self.threads.append(scheduler_thread)
+        # Keep the product catalogue in sync with the PDF directory
+        if self.catalogue_ingestor:
+            self.catalogue_ingestor.start()
+        
+        # Fire delayed sends (offers) that are due, including ones persisted before a restart
+        deferred_tasks.start()
         
         print("Automation Engine started successfully")
     
@@ -51,17 +191,13 @@ class AutomationEngine:
         Stop the automation engine
         """
         self.is_running = False
-        schedule.clear()
+        job_scheduler.stop()
+        
+        if self.catalogue_ingestor:
+            self.catalogue_ingestor.stop()
+        deferred_tasks.stop()
         print("Automation Engine stopped")
     
-    def _run_scheduler(self):
-        """
-        Run the scheduler in a separate thread
-        """
-        while self.is_running:
-            schedule.run_pending()
-            time.sleep(30)  # Check every 30 seconds
-    
     def process_auto_replies(self):
         """
         Process incoming messages and generate auto-replies
@@ -79,42 +215,68 @@ class AutomationEngine:
                 ChatMessage.status == 'received'
             ).all()
             
+            pending = []
             for message in recent_messages:
                 # Check if we already replied to this message
-                existing_reply = ChatMessage.query.filter(
-                    ChatMessage.doctor_id == message.doctor_id,
-                    ChatMessage.timestamp > message.timestamp,
-                    ChatMessage.sender.in_(['ai', 'admin'])
-                ).first()
-                
-                if existing_reply:
+                if conversation_store.get(message.doctor_id).has_reply_after(message.timestamp):
                     continue  # Already replied
                 
-                # Generate smart reply
                 doctor = Doctor.query.get(message.doctor_id)
-                reply_data = smart_reply_agent.generate_reply(message.message, doctor)
-                
+                if doctor:
+                    pending.append((message, doctor))
+            
+            # Generate smart replies as one batch (deadline-bounded, regex fallback)
+            replies = reply_service.generate_replies([
+                (message.message, doctor) for message, doctor in pending
+            ])
+            
+            # Group the confident replies per doctor and send them in parallel
+            replies_by_doctor = {}
+            for (message, doctor), reply_data in zip(pending, replies):
                 if reply_data['confidence'] > 0.7:  # Only send high-confidence replies
-                    # Send the reply
-                    result = whatsapp_manager.send_message(doctor.phone, reply_data['reply'])
-                    
-                    if 'success' in result:
-                        # Save the AI reply to database
-                        ai_message = ChatMessage(
-                            doctor_id=doctor.id,
-                            whatsapp_number_id=message.whatsapp_number_id,
-                            sender='ai',
-                            message=reply_data['reply'],
-                            status='sent'
-                        )
-                        db.session.add(ai_message)
-                        db.session.commit()
-                        
-                        print(f"Auto-reply sent to {doctor.name}: {reply_data['reply'][:50]}...")
+                    replies_by_doctor.setdefault(doctor.id, []).append(
+                        (message.whatsapp_number_id, reply_data['reply'], message.timestamp)
+                    )
+            
+            job_runner.map(self._send_auto_replies, list(replies_by_doctor.items()), name='auto-reply')
             
         except Exception as e:
             print(f"Error in process_auto_replies: {str(e)}")
     
+    def _send_auto_replies(self, item):
+        """
+        Send one doctor's auto-replies (runs in its own app context and session)
+        """
+        doctor_id, replies = item
+        doctor = Doctor.query.get(doctor_id)
+        
+        # A busy conversation is left to the next run rather than waited for
+        with conversation_locks.locked(doctor.phone, blocking=False) as acquired:
+            if not acquired:
+                return
+            
+            # Answered meanwhile (e.g. by another path or worker) since the batch was built
+            conversation = conversation_store.get(doctor.id, fresh=True)
+            replies = [reply for reply in replies if not conversation.has_reply_after(reply[2])]
+            
+            for whatsapp_number_id, reply, timestamp in replies:
+                # Send the reply
+                result = whatsapp_manager.send_message(doctor.phone, reply)
+                
+                if 'success' in result:
+                    # Save the AI reply to database
+                    ai_message = ChatMessage(
+                        doctor_id=doctor.id,
+                        whatsapp_number_id=whatsapp_number_id,
+                        sender='ai',
+                        message=reply,
+                        status='sent'
+                    )
+                    db.session.add(ai_message)
+                    db.session.commit()
+                    
+                    print(f"Auto-reply sent to {doctor.name}: {reply[:50]}...")
+    
     def update_lead_scores(self):
         """
         Update lead scores for all doctors
@@ -123,18 +285,20 @@ class AutomationEngine:
             if not self.lead_scoring_enabled:
                 return
             
-            doctors = Doctor.query.all()
-            
-            for doctor in doctors:
-                old_score = doctor.score
-                new_score = lead_scoring_agent.calculate_lead_score(doctor.id)
-                
-                if new_score != old_score:
-                    print(f"Updated lead score for {doctor.name}: {old_score} -> {new_score}")
+            doctor_ids = [doctor_id for doctor_id, in db.session.query(Doctor.id).all()]
+            job_runner.map(self._update_lead_score, doctor_ids, name='lead-score')
             
         except Exception as e:
             print(f"Error in update_lead_scores: {str(e)}")
     
+    def _update_lead_score(self, doctor_id):
+        doctor = Doctor.query.get(doctor_id)
+        old_score = doctor.score
+        new_score = lead_scoring_agent.calculate_lead_score(doctor_id)
+        
+        if new_score != old_score:
+            print(f"Updated lead score for {doctor.name}: {old_score} -> {new_score}")
+    
     def send_follow_ups(self):
         """
         Send automated follow-up messages
@@ -143,37 +307,12 @@ class AutomationEngine:
             if not self.follow_up_enabled:
                 return
             
-            candidates = follow_up_engine.get_follow_up_candidates()
+            # Top-ranked idle leads, capped by today's remaining budget
+            candidates = follow_up_queue.next_batch()
+            messages = follow_up_engine.generate_follow_up_messages(load_doctor_contexts(candidates))
             
-            for doctor in candidates:
-                # Generate follow-up message
-                follow_up_message = follow_up_engine.generate_follow_up_message(doctor)
-                
-                # Send the message
-                result = whatsapp_manager.send_message(doctor.phone, follow_up_message)
-                
-                if 'success' in result:
-                    # Save follow-up message to database
-                    whatsapp_number = WhatsAppNumber.query.filter_by(status='active').first()
-                    if whatsapp_number:
-                        follow_up_msg = ChatMessage(
-                            doctor_id=doctor.id,
-                            whatsapp_number_id=whatsapp_number.id,
-                            sender='ai',
-                            message=follow_up_message,
-                            status='sent'
-                        )
-                        db.session.add(follow_up_msg)
-                        
-                        # Update last interaction
-                        doctor.last_interaction = datetime.utcnow()
-                        db.session.commit()
-                        
-                        print(f"Follow-up sent to {doctor.name}")
-                
-                # Limit to 5 follow-ups per batch to avoid spam
-                if len([d for d in candidates if d == doctor]) >= 5:
-                    break
+            # Spread over the window and across numbers rather than sent in one burst
+            follow_up_dispatcher.dispatch(zip(candidates, messages))
             
         except Exception as e:
             print(f"Error in send_follow_ups: {str(e)}")
@@ -225,41 +364,61 @@ System Status: {'Healthy' if active_connections > 0 else 'Warning'}
             if not doctor_id:
                 return
             
-            # Update lead score
-            if self.lead_scoring_enabled:
-                lead_scoring_agent.calculate_lead_score(doctor_id)
+            doctor = Doctor.query.get(doctor_id)
+            if not doctor:
+                return
             
-            # Check for product inquiries
-            if any(keyword in message_text.lower() for keyword in ['catalogue', 'products', 'instruments', 'price']):
-                # Search for relevant products
-                products = pdf_catalogue_reader.search_products(message_text)
-                
-                if products:
-                    product_info = f"Here are some products that might interest you:\n\n"
-                    for product in products[:3]:  # Limit to 3 products
-                        product_info += f"• {product['name']}: {product['description']} (Price: {product['price_range']})\n"
-                    
-                    product_info += "\nWould you like more details about any of these products?"
-                    
-                    # Send product information
-                    doctor = Doctor.query.get(doctor_id)
-                    if doctor:
-                        whatsapp_manager.send_message(doctor.phone, product_info)
-            
-            # Check for high-intent keywords and send offers
-            high_intent_keywords = ['buy', 'purchase', 'order', 'interested', 'price']
-            if any(keyword in message_text.lower() for keyword in high_intent_keywords):
-                doctor = Doctor.query.get(doctor_id)
-                if doctor and doctor.tag in ['warm_lead', 'hot_lead']:
-                    # Generate and send offer
-                    offer_message = offer_engine.generate_offer(doctor)
-                    
-                    # Send after a delay to avoid immediate response
-                    threading.Timer(60, lambda: whatsapp_manager.send_message(doctor.phone, offer_message)).start()
+            # One path at a time answers a conversation (no duplicate replies or offers)
+            with conversation_locks.locked(doctor.phone) as acquired:
+                if not acquired:
+                    print(f"Conversation with {doctor.name} busy; message not handled")
+                    return
+                self._respond_to_message(doctor, message_text)
             
         except Exception as e:
             print(f"Error in handle_incoming_message: {str(e)}")
     
+    def _respond_to_message(self, doctor, message_text):
+        """
+        Lead scoring, product suggestions and offers for one incoming message
+        (runs under the doctor's conversation lock)
+        """
+        # The doctor wrote again before a delayed offer went out; the conversation
+        # is live, so drop it (a fresh one is scheduled below if still warranted)
+        deferred_tasks.cancel(doctor_id=doctor.id, kind='offer')
+        
+        # Update lead score
+        if self.lead_scoring_enabled:
+            lead_scoring_agent.calculate_lead_score(doctor.id)
+        
+        message_lower = smart_reply_agent.normalize_message(message_text)
+        
+        # Check for product inquiries
+        if PRODUCT_INQUIRY_PATTERN.search(message_lower):
+            # Rank related products by similarity to the message
+            products = pdf_catalogue_reader.suggest_products(message_text, limit=3)
+            
+            if products:
+                product_info = f"Here are some products that might interest you:\n\n"
+                for product in products:
+                    product_info += f"• {product['name']}: {product['description']} (Price: {product['price_range']})\n"
+                
+                product_info += "\nWould you like more details about any of these products?"
+                
+                # Send product information
+                whatsapp_manager.send_message(doctor.phone, product_info)
+        
+        # Check for high-intent keywords and send offers
+        high_intent_keywords = ['buy', 'purchase', 'order', 'interested', 'price']
+        if any(keyword in message_lower for keyword in high_intent_keywords):
+            if doctor.tag in ['warm_lead', 'hot_lead']:
+                # Generate and send offer
+                offer_message = offer_engine.generate_offer(doctor)
+                
+                # Send after a delay to avoid immediate response
+                deferred_tasks.schedule('offer', doctor.phone, offer_message,
+                                        delay=self.offer_delay, doctor_id=doctor.id)
+    
     def send_bulk_message(self, message_text, target_tags=None, limit=None):
         """
         Send bulk messages to doctors based on tags
@@ -304,7 +463,34 @@ System Status: {'Healthy' if active_connections > 0 else 'Warning'}
                 'sent_count': sent_count,
                 'total_targets': len(doctors)
             }
+        
+        except Exception as e:
+            return {'error': str(e)}
+    
+    def send_bulk_offers(self, target_tags=None, limit=50):
+        """
+        Send personalized offers to doctors with the given tags
+        """
+        try:
+            query = Doctor.query.filter(Doctor.tag.in_(target_tags or ['warm_lead', 'hot_lead']))
+            if limit:
+                query = query.limit(limit)
+            
+            doctors = query.all()
+            sent_count = 0
+            
+            for offer_message in offer_engine.generate_offers(doctors):
+                result = self.send_bulk_message(offer_message, None, 1)
+                
+                if result.get('success'):
+                    sent_count += result.get('sent_count', 0)
             
+            return {
+                'success': True,
+                'sent_count': sent_count,
+                'total_targets': len(doctors)
+            }
+        
         except Exception as e:
             return {'error': str(e)}
     
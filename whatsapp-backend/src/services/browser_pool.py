@@ -0,0 +1,238 @@
+import os
+import time
+import threading
+
+class BrowserPool:
+    """
+    Keeps the WhatsApp Web sessions within a memory budget. Every number
+    still needs its own Chrome profile (a logged-in session lives in its
+    user-data-dir, which Chrome locks to one process), so the pool saves
+    memory by deciding which sessions run at all:
+    
+    - sessions are registered without starting Chrome and start on first
+      use (a send, a QR request) or while the budget has room;
+    - sessions without traffic (sends, QR requests or incoming messages)
+      for `idle_suspend` seconds are suspended (Chrome quit, profile
+      kept), and the least recently used running session is suspended
+      when a start would exceed the budget;
+    - suspended sessions of logged-in profiles are resumed every
+      `catch_up_interval` seconds when there is room, to read messages
+      that arrived meanwhile; a catch-up does not count as use, so the
+      session is suspended again after `catch_up_run` seconds unless a
+      message or send comes in.
+    
+    A suspended number therefore reads incoming messages up to
+    `catch_up_interval` seconds late (or later while the budget has no
+    room); a send to it resumes it right away. Shorter intervals lower that
+    latency at the cost of more Chrome start-ups.
+    
+    Memory is measured per session with psutil when it is installed and
+    taken as `session_estimate_mb` otherwise.
+    """
+    
+    def __init__(self, memory_budget_mb=3072, session_estimate_mb=400, idle_suspend=15 * 60,
+                 catch_up_interval=5 * 60, catch_up_run=90, login_timeout=10):
+        self.memory_budget_mb = memory_budget_mb
+        self.session_estimate_mb = session_estimate_mb
+        self.idle_suspend = idle_suspend
+        self.catch_up_interval = catch_up_interval
+        self.catch_up_run = catch_up_run
+        self.login_timeout = login_timeout
+        self.sessions = {}
+        self._callbacks = {}
+        self._last_used = {}
+        self._last_started = {}
+        self._logged_in = set()  # numbers whose profile has logged in before
+        self._session_locks = {}
+        self._lock = threading.RLock()
+        self.stats_counters = {'started': 0, 'start_failures': 0, 'suspended': 0}
+    
+    def register(self, service, callback=None):
+        """
+        Add a session without starting it
+        """
+        with self._lock:
+            number_id = service.whatsapp_number_id
+            self.sessions[number_id] = service
+            self._callbacks[number_id] = callback
+            self._session_locks.setdefault(number_id, threading.Lock())
+            self._last_used.setdefault(number_id, time.monotonic())
+    
+    def unregister(self, number_id):
+        """
+        Remove a session, quitting its browser
+        """
+        with self._lock:
+            service = self.sessions.pop(number_id, None)
+            self._callbacks.pop(number_id, None)
+        if service is not None:
+            service.suspend()
+    
+    def touch(self, number_id):
+        with self._lock:
+            self._last_used[number_id] = time.monotonic()
+    
+    def _monitor_callback(self, number_id):
+        """
+        The registered callback of a session, counting each incoming message as use
+        """
+        with self._lock:
+            callback = self._callbacks.get(number_id)
+        
+        def on_message(message):
+            self.touch(number_id)
+            if callback:
+                callback(message)
+        
+        return on_message
+    
+    def _memory_of(self, service):
+        measured = service.memory_usage_mb()
+        return measured if measured is not None else self.session_estimate_mb
+    
+    def memory_in_use(self):
+        with self._lock:
+            running = [service for service in self.sessions.values() if service.is_running]
+        return sum(self._memory_of(service) for service in running)
+    
+    def has_room(self):
+        return self.memory_in_use() + self.session_estimate_mb <= self.memory_budget_mb
+    
+    def free_slots(self):
+        """
+        How many more sessions fit the budget at the estimated size
+        """
+        return max(0, int((self.memory_budget_mb - self.memory_in_use()) // self.session_estimate_mb))
+    
+    def _make_room(self, number_id):
+        """
+        Suspend least recently used sessions until another one fits the budget
+        """
+        while not self.has_room():
+            with self._lock:
+                candidates = [
+                    (self._last_used.get(other_id, 0), other_id)
+                    for other_id, service in self.sessions.items()
+                    if other_id != number_id and service.is_running and service._tasks.empty()
+                ]
+            if not candidates:
+                # Nothing left to evict; start anyway rather than fail the caller
+                return
+            self.suspend(min(candidates)[1])
+    
+    def acquire(self, number_id, start=True, catch_up=False):
+        """
+        The running session of a number, starting or resuming it if needed.
+        Returns None if the number has no session or its browser failed to start.
+        A catch-up start does not count as use of the session.
+        """
+        with self._lock:
+            service = self.sessions.get(number_id)
+        if service is None:
+            return None
+        
+        if not catch_up:
+            self.touch(number_id)
+        if service.is_running or not start:
+            return service
+        
+        with self._session_locks[number_id]:
+            if service.is_running:
+                return service
+            
+            self._make_room(number_id)
+            if not service.initialize_driver():
+                with self._lock:
+                    self.stats_counters['start_failures'] += 1
+                return None
+            
+            with self._lock:
+                self._last_started[number_id] = time.monotonic()
+                self.stats_counters['started'] += 1
+            
+            # A logged-in profile gets its worker; otherwise it waits for a QR scan
+            if service.wait_for_login(timeout=self.login_timeout):
+                service.is_logged_in = True
+                service.start_monitoring(callback=self._monitor_callback(number_id))
+                with self._lock:
+                    self._logged_in.add(number_id)
+            
+            return service
+    
+    def suspend(self, number_id):
+        with self._lock:
+            service = self.sessions.get(number_id)
+        if service is None or not service.is_running:
+            return False
+        
+        with self._session_locks[number_id]:
+            service.suspend()
+        with self._lock:
+            self.stats_counters['suspended'] += 1
+        print(f"Suspended WhatsApp Web session {number_id}")
+        return True
+    
+    def maintain(self):
+        """
+        Suspend idle sessions and give suspended ones a catch-up run when there is room
+        """
+        now = time.monotonic()
+        with self._lock:
+            sessions = list(self.sessions.items())
+            last_used = dict(self._last_used)
+            last_started = dict(self._last_started)
+            logged_in = set(self._logged_in)
+        
+        for number_id, service in sessions:
+            # A session resumed for a catch-up gets catch_up_run seconds to read what arrived
+            if service.is_running and service._tasks.empty() \
+                    and now - last_used.get(number_id, now) > self.idle_suspend \
+                    and now - last_started.get(number_id, 0) > self.catch_up_run:
+                self.suspend(number_id)
+        
+        # Only profiles that were logged in can have messages waiting
+        for number_id, service in sessions:
+            if not service.is_running and number_id in logged_in \
+                    and now - last_started.get(number_id, 0) > self.catch_up_interval and self.has_room():
+                self.acquire(number_id, catch_up=True)
+    
+    def shutdown(self):
+        with self._lock:
+            number_ids = list(self.sessions)
+        for number_id in number_ids:
+            self.unregister(number_id)
+    
+    def get_stats(self):
+        now = time.monotonic()
+        with self._lock:
+            sessions = list(self.sessions.items())
+            last_used = dict(self._last_used)
+            counters = dict(self.stats_counters)
+        
+        per_session = {}
+        for number_id, service in sessions:
+            memory = service.memory_usage_mb()
+            per_session[number_id] = {
+                'running': service.is_running,
+                'logged_in': service.is_logged_in,
+                'idle_seconds': round(now - last_used.get(number_id, now)),
+                'memory_mb': round(memory, 1) if memory is not None else None
+            }
+        
+        return {
+            'memory_budget_mb': self.memory_budget_mb,
+            'memory_in_use_mb': round(self.memory_in_use(), 1),
+            'measured': any(info['memory_mb'] is not None for info in per_session.values()),
+            'running': sum(1 for info in per_session.values() if info['running']),
+            'sessions': per_session,
+            **counters
+        }
+
+# Global instance
+browser_pool = BrowserPool(
+    memory_budget_mb=int(os.getenv('WEB_MEMORY_BUDGET_MB', '3072')),
+    session_estimate_mb=int(os.getenv('WEB_SESSION_ESTIMATE_MB', '400')),
+    idle_suspend=float(os.getenv('WEB_IDLE_SUSPEND_SECONDS', str(15 * 60))),
+    catch_up_interval=float(os.getenv('WEB_CATCH_UP_SECONDS', str(5 * 60))),
+    catch_up_run=float(os.getenv('WEB_CATCH_UP_RUN_SECONDS', '90'))
+)
@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+
+class LRUCache:
+    """
+    Small thread-safe LRU cache with hit/miss statistics
+    """
+    
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key, default=None):
+        """
+        Return cached value for key and mark it as most recently used
+        """
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def put(self, key, value):
+        """
+        Store value for key, evicting the least recently used entry when full
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def clear(self):
+        """
+        Drop all cached entries (statistics are kept)
+        """
+        with self._lock:
+            self._data.clear()
+    
+    def info(self):
+        """
+        Get cache statistics
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'size': len(self._data),
+                'maxsize': self.maxsize
+            }
+    
+    def __len__(self):
+        return len(self._data)
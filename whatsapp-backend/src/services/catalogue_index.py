@@ -0,0 +1,282 @@
+import io
+import os
+import re
+import json
+import math
+import hashlib
+import mmap
+import heapq
+import struct
+from array import array
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+# Common words in doctor queries that carry no product signal
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'any', 'are', 'can', 'do', 'for', 'have', 'i', 'in', 'is',
+    'it', 'me', 'my', 'need', 'of', 'on', 'or', 'please', 'send', 'the', 'to',
+    'want', 'we', 'what', 'with', 'you', 'your'
+])
+
+MAGIC = b'CIDX'
+VERSION = 2
+HEADER = struct.Struct('<4sII32s')  # magic, version, metadata length, products digest
+
+def normalize_token(token):
+    """
+    Cheap plural folding so "scissors"/"forceps" style queries line up
+    """
+    if len(token) > 4 and token.endswith('es') and not token.endswith('ses'):
+        return token[:-2] if token[-3] in 'sxz' else token[:-1]
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+def tokenize(text):
+    """
+    Lowercase word tokens without stop words
+    """
+    return [
+        normalize_token(token)
+        for token in TOKEN_PATTERN.findall((text or '').lower())
+        if token not in STOP_WORDS
+    ]
+
+def catalogue_digest(products):
+    """
+    SHA-256 of the {product_id: product} entries an index is built from
+    """
+    encoded = json.dumps(products, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).digest()
+
+def product_text(product):
+    """
+    Text indexed for a product (name counted twice to boost title matches)
+    """
+    return ' '.join([
+        product.get('name', ''),
+        product.get('name', ''),
+        product.get('description', ''),
+        ' '.join(product.get('categories', []))
+    ])
+
+class CatalogueIndex:
+    """
+    Tokenized inverted index over the product catalogue with BM25 ranking.
+    
+    File layout (little endian):
+        header   'CIDX', version, metadata length, SHA-256 of the products
+        metadata JSON: product ids, term -> [posting offset, document frequency],
+                 average document length
+        padding  to a 4-byte boundary
+        postings int32 pairs (document, term frequency) grouped by term
+        lengths  int32 token count per document
+    
+    The postings/lengths region is read straight out of an mmap, so a query
+    only touches the postings of its own terms.
+    """
+    
+    def __init__(self, buffer, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._buffer = buffer
+        
+        if len(buffer) < HEADER.size:
+            raise ValueError('Not a catalogue index file')
+        magic, version, meta_length, self.digest = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a catalogue index file')
+        
+        meta_start = HEADER.size
+        meta = json.loads(bytes(buffer[meta_start:meta_start + meta_length]).decode('utf-8'))
+        
+        self.product_ids = meta['product_ids']
+        self.terms = meta['terms']
+        self.avg_length = meta['avg_length'] or 1.0
+        
+        data_start = meta_start + meta_length
+        data_start += (-data_start) % 4
+        ints = memoryview(buffer)[data_start:].cast('i')
+        
+        self._postings = ints[:meta['n_postings'] * 2]
+        self._lengths = ints[meta['n_postings'] * 2:]
+        
+        # Per-document BM25 length normalization, computed once per load
+        self._norms = [
+            k1 * (1 - b + b * length / self.avg_length) for length in self._lengths
+        ]
+    
+    @property
+    def n_documents(self):
+        return len(self.product_ids)
+    
+    @classmethod
+    def build(cls, products, **kwargs):
+        """
+        Build an index in memory from {product_id: product} entries
+        """
+        return cls(cls.serialize(products), **kwargs)
+    
+    @staticmethod
+    def serialize(products):
+        """
+        Serialize {product_id: product} entries into the index file format
+        """
+        product_ids = list(products.keys())
+        postings_by_term = {}
+        lengths = array('i')
+        
+        for document, product_id in enumerate(product_ids):
+            tokens = tokenize(product_text(products[product_id]))
+            lengths.append(len(tokens))
+            
+            frequencies = {}
+            for token in tokens:
+                frequencies[token] = frequencies.get(token, 0) + 1
+            for token, frequency in frequencies.items():
+                postings_by_term.setdefault(token, []).append((document, frequency))
+        
+        postings = array('i')
+        terms = {}
+        for term in sorted(postings_by_term):
+            entries = postings_by_term[term]
+            terms[term] = [len(postings) // 2, len(entries)]
+            for document, frequency in entries:
+                postings.append(document)
+                postings.append(frequency)
+        
+        meta = json.dumps({
+            'product_ids': product_ids,
+            'terms': terms,
+            'n_postings': len(postings) // 2,
+            'avg_length': sum(lengths) / len(lengths) if lengths else 0.0
+        }, separators=(',', ':')).encode('utf-8')
+        
+        output = io.BytesIO()
+        output.write(HEADER.pack(MAGIC, VERSION, len(meta), catalogue_digest(products)))
+        output.write(meta)
+        output.write(b'\0' * ((-output.tell()) % 4))
+        output.write(postings.tobytes())
+        output.write(lengths.tobytes())
+        
+        return bytearray(output.getvalue())
+    
+    def save(self, path):
+        """
+        Write the index to disk atomically
+        """
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'wb') as index_file:
+            index_file.write(self._buffer)
+        os.replace(temp_path, path)
+    
+    @classmethod
+    def load(cls, path, **kwargs):
+        """
+        Memory-map an index file (ValueError if it is not one of this version)
+        """
+        with open(path, 'rb') as index_file:
+            buffer = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer, **kwargs)
+    
+    def search(self, query, limit=10):
+        """
+        Rank products for a free-text query with BM25.
+        Returns [(product_id, score), ...] best first.
+        """
+        scores = {}
+        get_score = scores.get
+        norms = self._norms
+        n_documents = self.n_documents
+        
+        for term in set(tokenize(query)):
+            entry = self.terms.get(term)
+            if not entry:
+                continue
+            
+            offset, document_frequency = entry
+            idf = math.log(1 + (n_documents - document_frequency + 0.5) / (document_frequency + 0.5))
+            weight = idf * (self.k1 + 1)
+            postings = self._postings[offset * 2:(offset + document_frequency) * 2]
+            
+            for document, frequency in zip(postings[0::2], postings[1::2]):
+                scores[document] = get_score(document, 0.0) + weight * frequency / (frequency + norms[document])
+        
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [(self.product_ids[document], score) for document, score in best]
+
+def trigrams(word):
+    """
+    Character trigrams of a word padded with one space on each side
+    """
+    padded = f' {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TrigramIndex:
+    """
+    Character-trigram index over the words of product names and categories,
+    used to correct misspelled query terms ("sissors" -> "scissor").
+    Words are normalized the same way as CatalogueIndex terms, so corrected
+    words can be fed straight back into the BM25 search.
+    """
+    
+    def __init__(self, words):
+        self.words = sorted(set(words))
+        self.word_ids = {word: word_id for word_id, word in enumerate(self.words)}
+        self.gram_counts = []
+        self.postings = {}
+        
+        for word_id, word in enumerate(self.words):
+            grams = trigrams(word)
+            self.gram_counts.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(word_id)
+    
+    @classmethod
+    def build(cls, products):
+        """
+        Build from the names and categories of {product_id: product} entries
+        """
+        words = set()
+        for product in products.values():
+            words.update(tokenize(product.get('name', '')))
+            for category in product.get('categories', []):
+                words.update(tokenize(category))
+        return cls(words)
+    
+    def lookup(self, term, limit=5, threshold=0.3):
+        """
+        Fuzzy top-k vocabulary words for a term by trigram Jaccard similarity.
+        Returns [(word, similarity), ...] best first.
+        """
+        term = normalize_token(term.lower())
+        if term in self.word_ids:
+            return [(term, 1.0)]
+        
+        query_grams = trigrams(term)
+        shared = {}
+        for gram in query_grams:
+            for word_id in self.postings.get(gram, ()):
+                shared[word_id] = shared.get(word_id, 0) + 1
+        
+        query_size = len(query_grams)
+        gram_counts = self.gram_counts
+        scored = []
+        for word_id, count in shared.items():
+            similarity = count / (query_size + gram_counts[word_id] - count)
+            if similarity >= threshold:
+                scored.append((similarity, word_id))
+        
+        best = heapq.nlargest(limit, scored)
+        return [(self.words[word_id], round(similarity, 4)) for similarity, word_id in best]
+    
+    def correct_query(self, query, threshold=0.3):
+        """
+        Replace every query token with its closest vocabulary word (if any)
+        """
+        corrected = []
+        for token in tokenize(query):
+            matches = self.lookup(token, limit=1, threshold=threshold)
+            if matches:
+                corrected.append(matches[0][0])
+        return ' '.join(corrected)
@@ -0,0 +1,304 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+PRICE_PATTERN = re.compile(
+    r'(?:₹|rs\.?|inr)\s*([\d,]+(?:\.\d+)?)(?:\s*(?:-|–|to)\s*(?:₹|rs\.?|inr)?\s*([\d,]+(?:\.\d+)?))?',
+    re.IGNORECASE
+)
+SEPARATOR_PATTERN = re.compile(r'\s+[-–|:]\s+|\s*\|\s*|:\s+')
+SLUG_PATTERN = re.compile(r'[^a-z0-9]+')
+
+def slugify(text):
+    return SLUG_PATTERN.sub('_', text.lower()).strip('_')
+
+def _format_price(value):
+    return f"₹{value.replace(',', '').split('.')[0]}"
+
+def _is_category_heading(line):
+    """
+    Short lines without a price that are upper case or end with a colon
+    """
+    words = line.rstrip(':').split()
+    if not words or len(words) > 6:
+        return False
+    return line.endswith(':') or (line.isupper() and any(char.isalpha() for char in line))
+
+def parse_catalogue_text(text, source=''):
+    """
+    Extract products from catalogue text. Product lines look like
+    "Name - description ... ₹300 - ₹1500"; category headings are short
+    upper-case lines or lines ending with ':'.
+    """
+    products = {}
+    category = None
+    source_prefix = slugify(os.path.splitext(os.path.basename(source))[0]) if source else ''
+    
+    for raw_line in text.splitlines():
+        line = ' '.join(raw_line.split())
+        if not line:
+            continue
+        
+        price = PRICE_PATTERN.search(line)
+        if not price:
+            if _is_category_heading(line):
+                category = line.rstrip(':').strip().lower()
+            continue
+        
+        details = line[:price.start()].strip(' -–|:,')
+        if not details:
+            continue
+        
+        parts = [part.strip() for part in SEPARATOR_PATTERN.split(details, maxsplit=1) if part.strip()]
+        name = parts[0]
+        description = parts[1] if len(parts) > 1 else name
+        
+        price_range = _format_price(price.group(1))
+        if price.group(2):
+            price_range += f'-{_format_price(price.group(2))}'
+        
+        product_id = slugify(name)
+        if source_prefix:
+            product_id = f'{source_prefix}:{product_id}'
+        if product_id in products:
+            product_id = f'{product_id}_{len(products)}'
+        
+        products[product_id] = {
+            'name': name,
+            'description': description,
+            'price_range': price_range,
+            'categories': [category] if category else [],
+            'source': os.path.basename(source) if source else ''
+        }
+    
+    return products
+
+def extract_products_from_pdf(path):
+    """
+    Extract products from one catalogue PDF (runs inside a worker process)
+    """
+    from pypdf import PdfReader
+    
+    reader = PdfReader(path)
+    text = '\n'.join(page.extract_text() or '' for page in reader.pages)
+    
+    return parse_catalogue_text(text, source=path)
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source_file:
+        for chunk in iter(lambda: source_file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _write_json_atomic(path, data):
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as output_file:
+        json.dump(data, output_file, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+class CatalogueIngestor:
+    """
+    Watches a directory of catalogue PDFs and keeps the PDFCatalogueReader
+    in sync. Only files whose content hash changed are re-extracted (in a
+    process pool); extracted products are kept per file in a manifest so a
+    restart does not reprocess anything, and only the products of changed
+    or removed files are swapped in the merged catalogue. The new catalogue
+    and its index are built off to the side, swapped into the reader in one
+    step and published to disk, where other processes' readers pick it up.
+    
+    A file that fails extraction is remembered with its size and mtime and
+    not retried until either changes.
+    """
+    
+    def __init__(self, reader, directory, workers=None, poll_interval=30):
+        self.reader = reader
+        self.directory = directory
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.poll_interval = poll_interval
+        self.manifest_path = os.path.join(directory, '.catalogue_manifest.json')
+        self.manifest = self._load_manifest()
+        self.last_sync = None
+        self.last_result = None
+        self._file_stats = {}
+        self._failed = {}  # file name -> (size, mtime) when its extraction failed
+        self._products = None  # merged products of all manifest files
+        self._sync_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+    
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path) as manifest_file:
+                return json.load(manifest_file)
+        except (OSError, ValueError):
+            return {}
+    
+    def _pdf_files(self):
+        return sorted(
+            name for name in os.listdir(self.directory)
+            if name.lower().endswith('.pdf') and os.path.isfile(os.path.join(self.directory, name))
+        )
+    
+    def has_changes(self):
+        """
+        Cheap check (size + mtime) whether any PDF was added, changed or removed
+        """
+        current = {}
+        for name in self._pdf_files():
+            stat = os.stat(os.path.join(self.directory, name))
+            current[name] = (stat.st_size, stat.st_mtime)
+        
+        return current != self._file_stats or set(current) != set(self.manifest) | set(self._failed)
+    
+    def sync(self):
+        """
+        Re-extract changed PDFs and publish the merged catalogue
+        """
+        with self._sync_lock:
+            started = time.time()
+            files = self._pdf_files()
+            
+            hashes = {}
+            changed = []
+            for name in files:
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                self._file_stats[name] = (stat.st_size, stat.st_mtime)
+                if self._failed.get(name) == self._file_stats[name]:
+                    # Failed before and unchanged since
+                    continue
+                self._failed.pop(name, None)
+                
+                hashes[name] = file_sha256(path)
+                if self.manifest.get(name, {}).get('sha256') != hashes[name]:
+                    changed.append(name)
+            
+            removed = [name for name in self.manifest if name not in files]
+            for name in list(self._file_stats):
+                if name not in files:
+                    del self._file_stats[name]
+            for name in list(self._failed):
+                if name not in files:
+                    del self._failed[name]
+            
+            if self._products is None:
+                self._products = {}
+                for name in files:
+                    if name in self.manifest:
+                        self._products.update(self.manifest[name]['products'])
+            
+            failed = []
+            extracted = {}
+            if changed:
+                # 'spawn' keeps the worker processes independent of our threads and DB connections
+                context = multiprocessing.get_context('spawn')
+                with ProcessPoolExecutor(max_workers=min(self.workers, len(changed)), mp_context=context) as pool:
+                    futures = {
+                        name: pool.submit(extract_products_from_pdf, os.path.join(self.directory, name))
+                        for name in changed
+                    }
+                    for name, future in futures.items():
+                        try:
+                            extracted[name] = future.result()
+                        except Exception as e:
+                            # Keep serving the previous extraction of this file, if any
+                            failed.append(name)
+                            self._failed[name] = self._file_stats[name]
+                            print(f"Error extracting catalogue {name}: {str(e)}")
+            
+            # Swap only the products of changed and removed files
+            dropped = set()
+            for name in removed + list(extracted):
+                dropped.update(self.manifest.get(name, {}).get('products', {}))
+            for product_id in dropped:
+                self._products.pop(product_id, None)
+            for name in removed:
+                del self.manifest[name]
+            for name, products in extracted.items():
+                self.manifest[name] = {'sha256': hashes[name], 'products': products}
+                self._products.update(products)
+            # Products also listed in an unchanged file fall back to that file's entry
+            for name in files:
+                if name in self.manifest and name not in extracted:
+                    for product_id, product in self.manifest[name]['products'].items():
+                        if product_id in dropped and product_id not in self._products:
+                            self._products[product_id] = product
+            
+            if extracted or removed or self.last_sync is None:
+                self.reader.publish_catalogue(dict(self._products))
+                _write_json_atomic(self.manifest_path, self.manifest)
+            
+            self.last_sync = datetime.utcnow()
+            self.last_result = {
+                'files': len(files),
+                'changed': changed,
+                'removed': removed,
+                'failed': failed,
+                'skipped_failed': sorted(name for name in self._failed if name not in failed),
+                'products': len(self.reader.products),
+                'duration': round(time.time() - started, 3)
+            }
+            return self.last_result
+    
+    def start(self):
+        """
+        Sync once, then poll the directory in a background thread
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        
+        # Each run gets its own event, so a thread that outlived stop() still sees it set
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._watch, args=(self._stop_event,), daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout=10):
+        """
+        Stop watching and wait up to `timeout` seconds for a sync in progress
+        """
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=timeout)
+            if self._thread.is_alive():
+                print("Catalogue watcher still finishing a sync; it will exit afterwards")
+    
+    def _watch(self, stop_event):
+        while not stop_event.is_set():
+            try:
+                if self.last_sync is None or self.has_changes():
+                    result = self.sync()
+                    print(f"Catalogue synced: {result}")
+            except Exception as e:
+                print(f"Error syncing catalogue: {str(e)}")
+            
+            stop_event.wait(self.poll_interval)
+    
+    def get_status(self):
+        return {
+            'directory': self.directory,
+            'watching': bool(self._thread and self._thread.is_alive()),
+            'last_sync': self.last_sync.isoformat() if self.last_sync else None,
+            'last_result': self.last_result
+        }
+
+def create_catalogue_ingestor(reader):
+    """
+    Build the ingestor when CATALOGUE_PDF_DIR is configured
+    """
+    directory = os.getenv('CATALOGUE_PDF_DIR')
+    if not directory or not os.path.isdir(directory):
+        return None
+    
+    return CatalogueIngestor(
+        reader,
+        directory,
+        workers=int(os.getenv('CATALOGUE_INGEST_WORKERS', '0')) or None,
+        poll_interval=float(os.getenv('CATALOGUE_WATCH_INTERVAL', '30'))
+    )
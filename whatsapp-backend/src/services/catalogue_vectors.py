@@ -0,0 +1,169 @@
+import os
+import math
+import zlib
+from services.catalogue_index import tokenize, product_text
+
+# NumPy is optional; without it related-product suggestions fall back to BM25 search
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Hashed columns can be shared by unrelated terms; ranking therefore also
+# requires a shared term (see CatalogueVectors._candidates)
+DEFAULT_DIMENSIONS = 128
+
+def _term_slot(term, dimensions):
+    """
+    Hash a term to (column, sign); the sign keeps collisions unbiased
+    """
+    digest = zlib.crc32(term.encode('utf-8'))
+    return digest % dimensions, 1.0 if digest & 0x80000000 else -1.0
+
+class CatalogueVectors:
+    """
+    L2-normalized TF-IDF vectors of all products, feature-hashed into one
+    contiguous float32 matrix of shape (n_products, dimensions). Only the
+    products sharing at least one actual term with the query (looked up in
+    the term postings) are scored: a query is one matrix-vector product over
+    those rows followed by argpartition top-k, a batch of queries is one
+    matrix-matrix product over the rows any of them shares a term with.
+    """
+    
+    def __init__(self, product_ids, matrix, idf, dimensions, postings, row_terms):
+        self.product_ids = product_ids
+        self.matrix = matrix
+        self.idf = idf
+        self.dimensions = dimensions
+        self.postings = postings
+        self.row_terms = row_terms
+        self._positions = {product_id: row for row, product_id in enumerate(product_ids)}
+    
+    @classmethod
+    def build(cls, products, dimensions=DEFAULT_DIMENSIONS):
+        """
+        Build vectors for {product_id: product} entries
+        """
+        product_ids = list(products.keys())
+        documents = [tokenize(product_text(products[product_id])) for product_id in product_ids]
+        
+        postings = {}
+        for row, tokens in enumerate(documents):
+            for token in set(tokens):
+                postings.setdefault(token, []).append(row)
+        document_frequency = {term: len(rows) for term, rows in postings.items()}
+        
+        n_documents = len(documents)
+        idf = {
+            term: math.log((1 + n_documents) / (1 + frequency)) + 1
+            for term, frequency in document_frequency.items()
+        }
+        
+        matrix = np.zeros((n_documents, dimensions), dtype=np.float32)
+        for row, tokens in enumerate(documents):
+            matrix[row] = cls._vector(tokens, idf, dimensions)
+        
+        postings = {term: np.array(rows, dtype=np.int64) for term, rows in postings.items()}
+        return cls(product_ids, matrix, idf, dimensions, postings, [set(tokens) for tokens in documents])
+    
+    @staticmethod
+    def _vector(tokens, idf, dimensions):
+        counts = {}
+        for token in tokens:
+            if token in idf:
+                counts[token] = counts.get(token, 0) + 1
+        
+        vector = np.zeros(dimensions, dtype=np.float32)
+        for token, count in counts.items():
+            column, sign = _term_slot(token, dimensions)
+            vector[column] += sign * (1.0 + math.log(count)) * idf[token]
+        
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+    
+    def query_vector(self, text):
+        return self._vector(tokenize(text), self.idf, self.dimensions)
+    
+    def _candidates(self, tokens):
+        """
+        Sorted rows of the products containing any of the tokens
+        """
+        rows = [self.postings[token] for token in set(tokens) if token in self.postings]
+        if not rows:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(rows))
+    
+    def _top_k(self, rows, scores, limit):
+        """
+        Best `limit` of the scored rows: [(product_id, cosine), ...]
+        """
+        limit = min(limit, len(scores))
+        if limit <= 0:
+            return []
+        
+        best = np.argpartition(scores, len(scores) - limit)[-limit:]
+        ranked = best[np.argsort(-scores[best])]
+        return [
+            (self.product_ids[rows[position]], float(scores[position]))
+            for position in ranked if scores[position] > 0
+        ]
+    
+    def search(self, text, limit=3):
+        """
+        Most similar products to free text: [(product_id, cosine), ...]
+        """
+        tokens = tokenize(text)
+        vector = self._vector(tokens, self.idf, self.dimensions)
+        rows = self._candidates(tokens)
+        if not vector.any() or not len(rows):
+            return []
+        return self._top_k(rows, self.matrix[rows] @ vector, limit)
+    
+    def similar_to(self, product_id, limit=3):
+        """
+        Products most similar to a given product (excluding itself)
+        """
+        row = self._positions.get(product_id)
+        if row is None:
+            return []
+        rows = self._candidates(self.row_terms[row])
+        rows = rows[rows != row]
+        if not len(rows):
+            return []
+        return self._top_k(rows, self.matrix[rows] @ self.matrix[row], limit)
+    
+    def search_batch(self, texts, limit=3):
+        """
+        Answer many queries with one matrix-matrix product
+        """
+        if not texts:
+            return []
+        
+        tokens = [tokenize(text) for text in texts]
+        queries = np.stack([self._vector(query_tokens, self.idf, self.dimensions) for query_tokens in tokens])
+        candidates = [self._candidates(query_tokens) for query_tokens in tokens]
+        
+        rows = np.unique(np.concatenate(candidates))
+        scores = queries @ self.matrix[rows].T
+        
+        results = []
+        for position, query_rows in enumerate(candidates):
+            if not queries[position].any() or not len(query_rows):
+                results.append([])
+                continue
+            columns = np.searchsorted(rows, query_rows)
+            results.append(self._top_k(query_rows, scores[position, columns], limit))
+        return results
+
+def build_catalogue_vectors(products):
+    """
+    Build vectors when NumPy is available (None otherwise). At the default
+    128 dimensions the matrix takes about 20 MB for 40,000 products.
+    """
+    if np is None or not products:
+        return None
+    
+    dimensions = int(os.getenv('CATALOGUE_VECTOR_DIMENSIONS', DEFAULT_DIMENSIONS))
+    return CatalogueVectors.build(products, dimensions)
@@ -0,0 +1,371 @@
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict, deque, namedtuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models.whatsapp import db, ChatMessage
+
+ContextMessage = namedtuple('ContextMessage', ['id', 'sender', 'message', 'timestamp'])
+
+# Rough per-message overhead on top of the text (tuple, datetime, deque slot)
+MESSAGE_OVERHEAD_BYTES = 200
+
+def _message_size(message):
+    return sys.getsizeof(message.message or '') + MESSAGE_OVERHEAD_BYTES
+
+class ConversationContext:
+    """
+    Last N messages of one doctor plus running summary fields, including
+    how many of the doctor's messages contain each tracked keyword over the
+    whole history (not only the buffered messages)
+    """
+    
+    __slots__ = ('doctor_id', 'messages', 'message_count', 'keywords', 'keyword_counts', 'last_sender',
+                 'last_timestamp', 'last_reply_timestamp', 'last_id', 'validated_at', 'size')
+    
+    def __init__(self, doctor_id, max_messages, keywords=()):
+        self.doctor_id = doctor_id
+        self.messages = deque(maxlen=max_messages)
+        self.message_count = 0
+        self.keywords = keywords
+        self.keyword_counts = dict.fromkeys(keywords, 0)
+        self.last_sender = None
+        self.last_timestamp = None
+        self.last_reply_timestamp = None
+        self.last_id = 0
+        self.validated_at = time.monotonic()
+        self.size = 0
+    
+    def add(self, message):
+        """
+        Append a message; returns the change in approximate memory use
+        """
+        before = self.size
+        
+        if len(self.messages) == self.messages.maxlen:
+            self.size -= _message_size(self.messages[0])
+        self.messages.append(message)
+        self.size += _message_size(message)
+        
+        self.message_count += 1
+        if message.sender == 'doctor' and message.message:
+            text = message.message.lower()
+            for keyword in self.keywords:
+                if keyword in text:
+                    self.keyword_counts[keyword] += 1
+        self.last_id = max(self.last_id, message.id or 0)
+        if self.last_timestamp is None or message.timestamp >= self.last_timestamp:
+            self.last_sender = message.sender
+            self.last_timestamp = message.timestamp
+        if message.sender in ('ai', 'admin'):
+            if self.last_reply_timestamp is None or message.timestamp > self.last_reply_timestamp:
+                self.last_reply_timestamp = message.timestamp
+        
+        return self.size - before
+    
+    def doctor_messages(self):
+        return [message for message in self.messages if message.sender == 'doctor']
+    
+    def has_reply_after(self, timestamp):
+        return self.last_reply_timestamp is not None and self.last_reply_timestamp > timestamp
+
+class ConversationStore:
+    """
+    Bounded in-memory ring buffers of recent messages per active doctor.
+    Filled from committed ChatMessage inserts, read by the agents without
+    queries, loaded from the database on a miss and evicted LRU once the
+    approximate memory use exceeds the cap.
+    
+    Messages committed in this process arrive through the session's
+    after_commit hook. Other processes (e.g. webhook workers) commit
+    messages this process never sees: at most every `sync_interval` seconds
+    one query lists the doctors with ChatMessage ids above the highest id
+    seen so far, and their contexts are dropped if those messages are newer
+    than what they hold. get(doctor_id, fresh=True) runs that check right
+    away, for decisions such as whether a message was already answered.
+    Edits and deletes made elsewhere (and ids committed out of order) are
+    only caught by rechecking each context's max id and message count once
+    it is older than `ttl` seconds.
+    """
+    
+    def __init__(self, max_messages=50, max_bytes=64 * 1024 * 1024, ttl=60.0, sync_interval=2.0):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+        self.keywords = ()
+        self._contexts = OrderedDict()
+        self._loading = {}  # doctor_id -> messages committed while its context loads
+        self._loading_stale = set()  # doctors whose load may have missed another process's message
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._synced_id = None
+        self._synced_at = 0
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+    
+    def track_keywords(self, keywords):
+        """
+        Keep per-conversation counts of doctor messages containing these keywords
+        """
+        with self._lock:
+            keywords = tuple(sorted(set(self.keywords) | set(keywords)))
+            if keywords != self.keywords:
+                self.keywords = keywords
+                # Cached contexts have no counts for the new keywords
+                self.invalidate()
+    
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._contexts) > 1:
+            doctor_id, context = self._contexts.popitem(last=False)
+            self._bytes -= context.size
+            self.evictions += 1
+    
+    def record(self, doctor_id, message_id, sender, message, timestamp):
+        """
+        Append a committed message to a cached conversation. Doctors that are
+        not cached are left alone; their next read loads from the database.
+        """
+        with self._lock:
+            context = self._contexts.get(doctor_id)
+            if context is None:
+                # A load in progress may have queried before this commit
+                if doctor_id in self._loading:
+                    self._loading[doctor_id].append(ContextMessage(message_id, sender, message, timestamp))
+                return
+            
+            if message_id is not None and message_id <= context.last_id:
+                return
+            self._bytes += context.add(ContextMessage(message_id, sender, message, timestamp))
+            self._contexts.move_to_end(doctor_id)
+            self._evict()
+    
+    def peek(self, doctor_id):
+        """
+        Cached context or None, without touching the database
+        """
+        with self._lock:
+            return self._contexts.get(doctor_id)
+    
+    def get(self, doctor_id, fresh=False):
+        """
+        Context for a doctor, loading it from the database on a miss or when
+        it no longer matches the database (requires an app context)
+        """
+        self._sync(force=fresh)
+        
+        with self._lock:
+            context = self._contexts.get(doctor_id)
+            if context is not None:
+                self._contexts.move_to_end(doctor_id)
+        
+        if context is not None:
+            if time.monotonic() - context.validated_at > self.ttl and not self._validate(context):
+                with self._lock:
+                    self.stale += 1
+                    if self._contexts.get(doctor_id) is context:
+                        self._contexts.pop(doctor_id)
+                        self._bytes -= context.size
+                context = None
+            else:
+                with self._lock:
+                    self.hits += 1
+                return context
+        
+        with self._lock:
+            self.misses += 1
+            # Commits from now on are kept for the loaded context
+            self._loading.setdefault(doctor_id, [])
+        
+        try:
+            context = self._load(doctor_id)
+        except Exception:
+            with self._lock:
+                self._loading.pop(doctor_id, None)
+                self._loading_stale.discard(doctor_id)
+            raise
+        
+        with self._lock:
+            pending = self._loading.pop(doctor_id, [])
+            
+            # Another thread may have loaded it meanwhile; keep the first one
+            existing = self._contexts.get(doctor_id)
+            if existing is not None:
+                return existing
+            
+            for message in sorted(pending, key=lambda message: message.id or 0):
+                if message.id is None or message.id > context.last_id:
+                    context.add(message)
+            
+            if doctor_id in self._loading_stale:
+                # Use it this once; the next read loads again
+                self._loading_stale.discard(doctor_id)
+                return context
+            
+            self._contexts[doctor_id] = context
+            self._bytes += context.size
+            self._evict()
+        
+        return context
+    
+    def _sync(self, force=False):
+        """
+        Drop the contexts that miss messages committed by other processes
+        since the last check (one query for all doctors)
+        """
+        now = time.monotonic()
+        if not force and now - self._synced_at < self.sync_interval:
+            return
+        if not self._sync_lock.acquire(blocking=force):
+            # Another thread is checking right now
+            return
+        
+        try:
+            if self._synced_id is None:
+                # Nothing is cached before the first check
+                self._synced_id = db.session.query(db.func.max(ChatMessage.id)).scalar() or 0
+                self._synced_at = now
+                return
+            
+            rows = db.session.query(ChatMessage.doctor_id, db.func.max(ChatMessage.id)).filter(
+                ChatMessage.id > self._synced_id
+            ).group_by(ChatMessage.doctor_id).all()
+            
+            with self._lock:
+                for doctor_id, last_id in rows:
+                    self._synced_id = max(self._synced_id, last_id)
+                    if doctor_id in self._loading:
+                        self._loading_stale.add(doctor_id)
+                    
+                    context = self._contexts.get(doctor_id)
+                    # Messages committed here were already recorded
+                    if context is not None and last_id > context.last_id:
+                        self.stale += 1
+                        self._contexts.pop(doctor_id)
+                        self._bytes -= context.size
+            self._synced_at = now
+        finally:
+            self._sync_lock.release()
+    
+    def _validate(self, context):
+        """
+        Whether a cached context still matches the database
+        """
+        last_id, message_count = db.session.query(
+            db.func.max(ChatMessage.id), db.func.count(ChatMessage.id)
+        ).filter(ChatMessage.doctor_id == context.doctor_id).one()
+        
+        if (last_id or 0) != context.last_id or message_count != context.message_count:
+            return False
+        context.validated_at = time.monotonic()
+        return True
+    
+    def _load(self, doctor_id):
+        context = ConversationContext(doctor_id, self.max_messages, self.keywords)
+        
+        recent = ChatMessage.query.filter_by(doctor_id=doctor_id).order_by(
+            ChatMessage.timestamp.desc(), ChatMessage.id.desc()
+        ).limit(self.max_messages).all()
+        
+        for row in reversed(recent):
+            context.add(ContextMessage(row.id, row.sender, row.message, row.timestamp))
+        
+        if len(recent) == self.max_messages:
+            # History is longer than the buffer: take the summary fields from the database
+            context.message_count = ChatMessage.query.filter_by(doctor_id=doctor_id).count()
+            context.last_id = db.session.query(db.func.max(ChatMessage.id)).filter(
+                ChatMessage.doctor_id == doctor_id
+            ).scalar() or 0
+            if context.last_reply_timestamp is None:
+                context.last_reply_timestamp = db.session.query(db.func.max(ChatMessage.timestamp)).filter(
+                    ChatMessage.doctor_id == doctor_id,
+                    ChatMessage.sender.in_(['ai', 'admin'])
+                ).scalar()
+            if self.keywords:
+                context.keyword_counts = self._count_keywords(doctor_id)
+        
+        return context
+    
+    def _count_keywords(self, doctor_id):
+        """
+        Doctor messages containing each tracked keyword, over the whole history
+        """
+        counts = db.session.query(*[
+            db.func.sum(db.case((db.func.lower(ChatMessage.message).contains(keyword, autoescape=True), 1), else_=0))
+            for keyword in self.keywords
+        ]).filter(ChatMessage.doctor_id == doctor_id, ChatMessage.sender == 'doctor').one()
+        
+        return {keyword: count or 0 for keyword, count in zip(self.keywords, counts)}
+    
+    def invalidate(self, doctor_id=None):
+        """
+        Drop one doctor's context, or everything
+        """
+        with self._lock:
+            if doctor_id is None:
+                self._contexts.clear()
+                self._bytes = 0
+            else:
+                context = self._contexts.pop(doctor_id, None)
+                if context is not None:
+                    self._bytes -= context.size
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'doctors': len(self._contexts),
+                'approx_bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'stale_reloads': self.stale,
+                'evictions': self.evictions
+            }
+
+# Global instance
+conversation_store = ConversationStore(
+    max_messages=int(os.getenv('CONVERSATION_CONTEXT_MESSAGES', '50')),
+    max_bytes=int(float(os.getenv('CONVERSATION_CONTEXT_MAX_MB', '64')) * 1024 * 1024),
+    ttl=float(os.getenv('CONVERSATION_CONTEXT_TTL', '60')),
+    sync_interval=float(os.getenv('CONVERSATION_CONTEXT_SYNC', '2'))
+)
+
+@event.listens_for(Session, 'after_flush')
+def _collect_new_messages(session, flush_context):
+    # Capture values while they are loaded; they are expired after commit
+    pending = session.info.setdefault('conversation_messages', [])
+    for instance in session.new:
+        if isinstance(instance, ChatMessage):
+            pending.append((instance.doctor_id, instance.id, instance.sender, instance.message, instance.timestamp))
+    
+    # Edited or deleted history is simply reloaded on the next read
+    stale = session.info.setdefault('conversation_stale', set())
+    for instance in list(session.dirty) + list(session.deleted):
+        if isinstance(instance, ChatMessage):
+            stale.add(instance.doctor_id)
+
+@event.listens_for(Session, 'after_commit')
+def _publish_new_messages(session):
+    for doctor_id in session.info.pop('conversation_stale', ()):
+        conversation_store.invalidate(doctor_id)
+    for doctor_id, message_id, sender, message, timestamp in session.info.pop('conversation_messages', []):
+        conversation_store.record(doctor_id, message_id, sender, message, timestamp)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_new_messages(session):
+    session.info.pop('conversation_messages', None)
+    session.info.pop('conversation_stale', None)
+
+@event.listens_for(Session, 'do_orm_execute')
+def _invalidate_on_bulk_change(orm_execute_state):
+    # Query.delete()/update() on chat messages bypass the unit of work
+    if (orm_execute_state.is_delete or orm_execute_state.is_update) and \
+            orm_execute_state.bind_mapper is not None and orm_execute_state.bind_mapper.class_ is ChatMessage:
+        conversation_store.invalidate()
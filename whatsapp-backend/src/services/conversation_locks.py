@@ -0,0 +1,287 @@
+import os
+import time
+import zlib
+import socket
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from models.whatsapp import db, ServiceLease
+from services.leader import leader_elector
+
+class ConversationLocks:
+    """
+    Serializes the work on one doctor's conversation (saving incoming
+    messages, replies, offers, follow-ups) across the Web monitor threads,
+    webhook requests, background jobs and deferred sends, without a global
+    lock. A conversation is keyed by the doctor's phone number, which is
+    known before the doctor row exists (see key()), and hashed onto a fixed
+    table of `stripes` re-entrant locks: memory stays constant and unrelated
+    conversations only wait on each other when they share a stripe.
+    
+    The stripes only order threads of one process. When several processes
+    handle conversations (`shared`, on by default only for gunicorn with
+    more than one worker, see configure_processes), webhook requests in the
+    other workers also lease the conversation in the service_leases table
+    for as long as it is locked: a row per locked conversation, inserted or
+    taken over once expired, deleted on release. The lease is re-entrant per
+    thread and expires after `lease_ttl` seconds if its process dies while
+    holding it. The leader's own work (Web sessions, jobs, deferred sends)
+    stays process-local: it only checks that no other process holds the
+    lease and writes nothing, so a webhook lease taken right after that
+    check is not seen. A lease that is busy is polled every `lease_poll`
+    seconds without holding the stripe.
+    
+    Request paths wait up to `timeout` seconds; background work should use
+    blocking=False and retry later rather than hold up a thread. The table
+    keeps counts of contended and failed acquisitions and of wait and hold
+    times. Acquiring needs an app context when `shared` is on.
+    """
+    
+    def __init__(self, stripes=64, timeout=30, shared=None, lease_ttl=120, lease_poll=0.1):
+        self.stripes = stripes
+        self.timeout = timeout
+        # None: decided by configure_processes
+        self.auto_shared = shared is None
+        self.shared = bool(shared)
+        self.lease_ttl = lease_ttl
+        self.lease_poll = lease_poll
+        self.identity = f"{socket.gethostname()}:{os.getpid()}"
+        self._swept_at = 0
+        self._locks = [threading.RLock() for _ in range(stripes)]
+        self._leases = threading.local()  # per thread: conversation key -> lock depth
+        self._stats_lock = threading.Lock()
+        self._contended_by_stripe = [0] * stripes
+        self.stats_counters = {'acquired': 0, 'contended': 0, 'try_failed': 0, 'timeouts': 0, 'lease_busy': 0}
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.hold_max = 0.0
+    
+    def configure_processes(self, processes):
+        """
+        Lease conversations only when more than one serving process handles
+        them (unless leases were switched on or off explicitly)
+        """
+        if self.auto_shared:
+            self.shared = processes > 1
+    
+    @staticmethod
+    def key(phone):
+        """
+        Digits of a phone number; anything else (e.g. a Web chat titled with
+        a contact's name) is used as it is
+        """
+        value = str(phone or '').strip()
+        digits = value.lstrip('+').replace(' ', '').replace('-', '')
+        return digits if digits.isdigit() else value
+    
+    def stripe(self, phone):
+        return zlib.crc32(self.key(phone).encode('utf-8')) % self.stripes
+    
+    def acquire(self, phone, blocking=True, timeout=None):
+        """
+        Lock a conversation; returns its stripe, or None if it could not be
+        locked (held elsewhere with blocking=False, or timed out)
+        """
+        key = self.key(phone)
+        index = self.stripe(phone)
+        lock = self._locks[index]
+        started = time.perf_counter()
+        deadline = started + (self.timeout if timeout is None else timeout)
+        
+        contended = not lock.acquire(blocking=False)
+        if contended:
+            with self._stats_lock:
+                self._contended_by_stripe[index] += 1
+                self.stats_counters['contended'] += 1
+                if not blocking:
+                    self.stats_counters['try_failed'] += 1
+            if not blocking:
+                return None
+            
+            if not lock.acquire(timeout=max(0, deadline - time.perf_counter())):
+                self._record_wait(started, 'timeouts')
+                return None
+        
+        while not self._acquire_lease(key):
+            # Locked by another process; wait without holding up the stripe's other conversations
+            lock.release()
+            remaining = deadline - time.perf_counter()
+            if not blocking or remaining <= 0:
+                self._record_wait(started if blocking else None, 'lease_busy')
+                return None
+            
+            time.sleep(min(self.lease_poll, remaining))
+            contended = True
+            if not lock.acquire(timeout=max(0, deadline - time.perf_counter())):
+                self._record_wait(started, 'timeouts')
+                return None
+        
+        self._record_wait(started if contended else None, 'acquired')
+        return index
+    
+    def _record_wait(self, started, outcome):
+        with self._stats_lock:
+            if started is not None:
+                waited = time.perf_counter() - started
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+            self.stats_counters[outcome] += 1
+    
+    def release(self, phone):
+        self._release_lease(self.key(phone))
+        self._locks[self.stripe(phone)].release()
+    
+    def _held_leases(self):
+        if not hasattr(self._leases, 'depth'):
+            self._leases.depth = {}
+        return self._leases.depth
+    
+    @staticmethod
+    def _lease_name(key):
+        name = f'conversation:{key}'
+        if len(name) > 50:
+            # service_leases.name is 50 characters; long chat titles are hashed
+            name = f'conversation:{hashlib.sha1(key.encode("utf-8")).hexdigest()[:32]}'
+        return name
+    
+    def _acquire_lease(self, key):
+        """
+        Lease a conversation across processes; True when not shared, already
+        held by this thread, or (in the leader) not held by another process
+        """
+        if not self.shared:
+            return True
+        
+        held = self._held_leases()
+        if key in held:
+            held[key] += 1
+            return True
+        
+        name = self._lease_name(key)
+        if leader_elector.is_leader:
+            return self._lease_free(name)
+        
+        if not self._try_lease(name, self._holder()):
+            return False
+        held[key] = 1
+        return True
+    
+    def _holder(self):
+        return f'{self.identity}:{threading.get_ident()}'
+    
+    def _lease_free(self, name):
+        """
+        Whether no other process holds a lease (a read, no write)
+        """
+        leases = ServiceLease.__table__
+        try:
+            with db.engine.connect() as connection:
+                holder = connection.execute(leases.select().with_only_columns(leases.c.holder).where(
+                    leases.c.name == name,
+                    leases.c.expires_at >= datetime.utcnow()
+                )).scalar()
+            return holder is None or holder.startswith(f'{self.identity}:')
+        except Exception as e:
+            print(f"Error checking conversation lease {name}: {str(e)}")
+            return False
+    
+    def _try_lease(self, name, holder):
+        now = datetime.utcnow()
+        leases = ServiceLease.__table__
+        values = {'holder': holder, 'expires_at': now + timedelta(seconds=self.lease_ttl), 'renewed_at': now}
+        try:
+            # A connection of its own, so the caller's session is not committed.
+            # Rows are deleted on release; one left by a dead process is reused once expired.
+            with db.engine.begin() as connection:
+                if time.monotonic() - self._swept_at > self.lease_ttl:
+                    # Rows of conversations locked by processes that died meanwhile
+                    self._swept_at = time.monotonic()
+                    connection.execute(leases.delete().where(
+                        leases.c.name.like('conversation:%'),
+                        leases.c.expires_at < now
+                    ))
+                taken = connection.execute(leases.update().where(
+                    leases.c.name == name,
+                    or_(leases.c.expires_at < now, leases.c.holder == holder)
+                ).values(**values)).rowcount
+                if not taken:
+                    connection.execute(leases.insert().values(name=name, term=1, **values))
+            return True
+        except IntegrityError:
+            # The row exists and another process holds the lease
+            return False
+        except Exception as e:
+            print(f"Error leasing conversation {name}: {str(e)}")
+            return False
+    
+    def _release_lease(self, key):
+        held = self._held_leases()
+        if key not in held:
+            # Not leased (not shared, or taken in the leader)
+            return
+        if held[key] > 1:
+            held[key] -= 1
+            return
+        del held[key]
+        
+        leases = ServiceLease.__table__
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(leases.delete().where(
+                    leases.c.name == self._lease_name(key),
+                    leases.c.holder == self._holder()
+                ))
+        except Exception as e:
+            # It expires after lease_ttl anyway
+            print(f"Error releasing conversation lease {key}: {str(e)}")
+    
+    @contextmanager
+    def locked(self, phone, blocking=True, timeout=None):
+        """
+        with conversation_locks.locked(phone) as acquired: ...
+        
+        The body runs either way; it should skip or defer its work when
+        acquired is False.
+        """
+        index = self.acquire(phone, blocking, timeout)
+        started = time.perf_counter()
+        try:
+            yield index is not None
+        finally:
+            if index is not None:
+                held = time.perf_counter() - started
+                self.release(phone)
+                with self._stats_lock:
+                    self.hold_max = max(self.hold_max, held)
+    
+    def get_stats(self):
+        with self._stats_lock:
+            counters = dict(self.stats_counters)
+            contended_by_stripe = list(self._contended_by_stripe)
+            attempts = counters['acquired'] + counters['try_failed'] + counters['timeouts'] + counters['lease_busy']
+            waits = counters['contended'] - counters['try_failed']
+            wait_total, wait_max, hold_max = self.wait_total, self.wait_max, self.hold_max
+        
+        busiest = sorted(range(self.stripes), key=lambda index: contended_by_stripe[index], reverse=True)[:5]
+        return {
+            'stripes': self.stripes,
+            'shared': self.shared,
+            'contention_rate': round(counters['contended'] / attempts, 4) if attempts else 0.0,
+            'avg_wait_ms': round(wait_total / waits * 1000, 2) if waits else 0.0,
+            'max_wait_ms': round(wait_max * 1000, 2),
+            'max_hold_ms': round(hold_max * 1000, 2),
+            'busiest_stripes': {index: contended_by_stripe[index] for index in busiest if contended_by_stripe[index]},
+            **counters
+        }
+
+# Global instance
+conversation_locks = ConversationLocks(
+    stripes=int(os.getenv('CONVERSATION_LOCK_STRIPES', '64')),
+    timeout=float(os.getenv('CONVERSATION_LOCK_TIMEOUT', '30')),
+    shared=None if os.getenv('CONVERSATION_LEASES', 'auto').lower() == 'auto'
+    else os.getenv('CONVERSATION_LEASES').lower() not in ('off', '0', 'false'),
+    lease_ttl=float(os.getenv('CONVERSATION_LEASE_TTL', '120'))
+)
@@ -0,0 +1,338 @@
+import os
+import time
+import heapq
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import or_
+from models.whatsapp import db, DeferredTask
+from services.conversation_locks import conversation_locks
+from services.leader import leader_elector
+from services.whatsapp_manager import whatsapp_manager
+
+class DeferredTaskService:
+    """
+    Delayed message sends without a thread per send. Tasks are persisted in
+    the deferred_tasks table and kept in an in-memory heap ordered by due
+    time; one scheduler thread sleeps until the earliest task is due and
+    hands it to a small worker pool. Pending tasks survive a restart and
+    can be cancelled (e.g. when the doctor writes again before an offer
+    goes out).
+    
+    Each kind of task can register a gate, which may hold a due task back
+    for a number of seconds, and an on_sent callback that records the send
+    in the same transaction as the task's status.
+    
+    A task only fires while it holds its doctor's conversation lock; if the
+    conversation is busy (e.g. a reply is going out) it is retried after
+    `busy_retry` seconds instead of tying up a worker.
+    
+    The service runs in the leader process only. Every `poll_interval`
+    seconds it also queues pending rows due soon that it has not seen, so
+    tasks scheduled by other processes (e.g. webhook workers) still fire,
+    at most that much late. A claimed ('running') task is only handed back
+    to 'pending' once its claim is older than `claim_lease` seconds and was
+    made under an earlier leader term, so a failover does not resend what
+    the previous leader may still be sending.
+    """
+    
+    def __init__(self, workers=2, busy_retry=5, poll_interval=15, claim_lease=300):
+        self.workers = workers
+        self.busy_retry = busy_retry
+        self.poll_interval = poll_interval
+        self.claim_lease = claim_lease
+        self.app = None
+        self._heap = []
+        self._condition = threading.Condition()
+        self._pool = None
+        self._thread = None
+        self._running = False
+        self._generation = 0
+        self._hooks = {}
+        self.stats_counters = {'scheduled': 0, 'sent': 0, 'failed': 0, 'cancelled': 0, 'held': 0, 'busy': 0,
+                               'reclaimed': 0}
+    
+    def init_app(self, app):
+        """
+        Bind the Flask app whose context the workers run in
+        """
+        self.app = app
+    
+    def register_hooks(self, kind, gate=None, on_sent=None):
+        """
+        gate(task) returns seconds to hold a due task back (0 to send now);
+        on_sent(task, result) runs after a successful send, before the commit
+        """
+        self._hooks[kind] = {'gate': gate, 'on_sent': on_sent}
+    
+    def start(self):
+        """
+        Load pending tasks from the database and start firing them
+        """
+        if self.app is None:
+            print("Deferred task service not started: call init_app(app) first")
+            return
+        
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+            self._generation += 1
+            generation = self._generation
+        
+        with self._condition:
+            self._heap = []
+        queued = self._load_due()
+        
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='deferred-task')
+        self._thread = threading.Thread(target=self._run, args=(generation,), daemon=True,
+                                        name='deferred-scheduler')
+        self._thread.start()
+        print(f"Deferred task service started ({queued} pending)")
+    
+    def stop(self):
+        """
+        Stop firing tasks; pending ones stay in the database
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        
+        if self._pool:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+    
+    def schedule(self, kind, phone, message, delay, doctor_id=None, whatsapp_number_id=None):
+        """
+        Persist a message send that fires after delay seconds; returns the task id.
+        Must be called inside an app context. Outside the leader the task is
+        only written; the leader's next poll queues it.
+        """
+        task = DeferredTask(
+            kind=kind,
+            doctor_id=doctor_id,
+            whatsapp_number_id=whatsapp_number_id,
+            phone=phone,
+            message=message,
+            run_at=datetime.utcnow() + timedelta(seconds=delay)
+        )
+        db.session.add(task)
+        db.session.commit()
+        
+        with self._condition:
+            running = self._running
+            self.stats_counters['scheduled'] += 1
+        if running:
+            self._push(task.run_at, task.id)
+        
+        return task.id
+    
+    def _push(self, run_at, task_id):
+        with self._condition:
+            heapq.heappush(self._heap, (run_at, task_id))
+            self._condition.notify()
+    
+    def cancel(self, doctor_id=None, kind=None, task_id=None):
+        """
+        Cancel pending tasks by id or by doctor/kind; returns how many were cancelled.
+        Heap entries of cancelled tasks are skipped when they come due.
+        """
+        query = DeferredTask.query.filter_by(status='pending')
+        if task_id is not None:
+            query = query.filter_by(id=task_id)
+        if doctor_id is not None:
+            query = query.filter_by(doctor_id=doctor_id)
+        if kind is not None:
+            query = query.filter_by(kind=kind)
+        
+        cancelled = query.update({'status': 'cancelled', 'completed_at': datetime.utcnow()},
+                                 synchronize_session=False)
+        db.session.commit()
+        
+        with self._condition:
+            self.stats_counters['cancelled'] += cancelled
+        return cancelled
+    
+    def _reclaim_abandoned(self):
+        """
+        Hand tasks whose claim expired under an earlier leader back to 'pending'
+        """
+        stale_before = datetime.utcnow() - timedelta(seconds=self.claim_lease)
+        query = DeferredTask.query.filter(
+            DeferredTask.status == 'running',
+            or_(DeferredTask.claimed_at.is_(None), DeferredTask.claimed_at < stale_before)
+        )
+        if leader_elector.term is not None:
+            query = query.filter(or_(DeferredTask.claimed_term.is_(None),
+                                     DeferredTask.claimed_term < leader_elector.term))
+        
+        reclaimed = query.update({'status': 'pending', 'claimed_at': None}, synchronize_session=False)
+        db.session.commit()
+        if reclaimed:
+            print(f"Reclaimed {reclaimed} abandoned deferred tasks")
+            with self._condition:
+                self.stats_counters['reclaimed'] += reclaimed
+        return reclaimed
+    
+    def _load_due(self, horizon=None):
+        """
+        Queue pending tasks from the database that are not queued yet, due
+        within `horizon` seconds (all of them when None); returns how many
+        """
+        with self.app.app_context():
+            try:
+                self._reclaim_abandoned()
+                query = DeferredTask.query.filter_by(status='pending')
+                if horizon is not None:
+                    query = query.filter(DeferredTask.run_at <= datetime.utcnow() + timedelta(seconds=horizon))
+                due = query.with_entities(DeferredTask.run_at, DeferredTask.id).all()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error loading deferred tasks: {str(e)}")
+                return 0
+        
+        with self._condition:
+            queued_ids = {task_id for _, task_id in self._heap}
+            added = 0
+            for run_at, task_id in due:
+                if task_id not in queued_ids:
+                    heapq.heappush(self._heap, (run_at, task_id))
+                    added += 1
+            if added:
+                self._condition.notify()
+        return added
+    
+    def _run(self, generation):
+        next_poll = time.monotonic() + self.poll_interval
+        while True:
+            if time.monotonic() >= next_poll:
+                self._load_due(horizon=self.poll_interval)
+                next_poll = time.monotonic() + self.poll_interval
+            
+            with self._condition:
+                # A stop() (or a stop()/start() pair) retires this thread
+                if not self._running or generation != self._generation:
+                    return
+                
+                until_poll = max(0, next_poll - time.monotonic())
+                if not self._heap:
+                    self._condition.wait(until_poll)
+                    continue
+                
+                run_at, task_id = self._heap[0]
+                delay = (run_at - datetime.utcnow()).total_seconds()
+                if delay > 0:
+                    self._condition.wait(min(delay, until_poll))
+                    continue
+                
+                heapq.heappop(self._heap)
+                pool = self._pool
+            
+            try:
+                pool.submit(self._fire, task_id)
+            except RuntimeError:
+                # Stopped meanwhile; the task is still pending in the database
+                return
+    
+    def _fire(self, task_id):
+        with self.app.app_context():
+            try:
+                task = DeferredTask.query.get(task_id)
+                if task is None or task.status != 'pending':
+                    return
+                
+                # Claimed and sent under the conversation lock, so a cancel from a
+                # live conversation either lands first or waits for the send
+                with conversation_locks.locked(task.phone, blocking=False) as acquired:
+                    if not acquired:
+                        self._push(datetime.utcnow() + timedelta(seconds=self.busy_retry), task_id)
+                        with self._condition:
+                            self.stats_counters['busy'] += 1
+                        return
+                    self._claim_and_send(task_id)
+            
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error firing deferred task {task_id}: {str(e)}")
+    
+    def _claim_and_send(self, task_id):
+        # Claim the task; a cancelled or already handled task is skipped
+        claimed = DeferredTask.query.filter_by(id=task_id, status='pending').update(
+            {'status': 'running', 'claimed_at': datetime.utcnow(), 'claimed_term': leader_elector.term},
+            synchronize_session=False
+        )
+        db.session.commit()
+        if not claimed:
+            return
+        
+        task = DeferredTask.query.get(task_id)
+        hooks = self._hooks.get(task.kind, {})
+        
+        # Nothing else hands a claimed task back, so it must end up
+        # held, sent or failed even when a hook or the send raises
+        try:
+            hold = hooks['gate'](task) if hooks.get('gate') else 0
+            if hold:
+                task.status = 'pending'
+                task.run_at = datetime.utcnow() + timedelta(seconds=hold)
+                db.session.commit()
+                self._push(task.run_at, task.id)
+                with self._condition:
+                    self.stats_counters['held'] += 1
+                return
+            
+            result = whatsapp_manager.send_message(task.phone, task.message,
+                                                   number_id=task.whatsapp_number_id)
+        except Exception as e:
+            self._finish(task_id, 'failed', str(e))
+            return
+        
+        if 'success' not in result:
+            self._finish(task_id, 'failed', result.get('error'))
+            return
+        
+        try:
+            task.status = 'sent'
+            task.completed_at = datetime.utcnow()
+            if hooks.get('on_sent'):
+                hooks['on_sent'](task, result)
+            db.session.commit()
+        except Exception as e:
+            # The message went out; only the bookkeeping of on_sent is lost
+            print(f"Error recording deferred task {task_id}: {str(e)}")
+            self._finish(task_id, 'sent', f'on_sent: {str(e)}')
+            return
+        
+        with self._condition:
+            self.stats_counters['sent'] += 1
+    
+    def _finish(self, task_id, status, error=None):
+        """
+        Record the outcome of a claimed task on a clean session
+        """
+        db.session.rollback()
+        task = DeferredTask.query.get(task_id)
+        task.status = status
+        task.error = error
+        task.completed_at = datetime.utcnow()
+        db.session.commit()
+        
+        with self._condition:
+            self.stats_counters[status] += 1
+    
+    def get_stats(self):
+        with self._condition:
+            return {
+                'running': self._running,
+                'queued': len(self._heap),
+                'next_due': self._heap[0][0].isoformat() if self._heap else None,
+                'workers': self.workers,
+                **self.stats_counters
+            }
+
+# Global instance
+deferred_tasks = DeferredTaskService(
+    workers=int(os.getenv('DEFERRED_TASK_WORKERS', '2')),
+    poll_interval=float(os.getenv('DEFERRED_TASK_POLL', '15')),
+    claim_lease=float(os.getenv('DEFERRED_TASK_CLAIM_LEASE', '300'))
+)
@@ -0,0 +1,146 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from models.whatsapp import db, Doctor, ChatMessage, WhatsAppNumber
+from services.deferred_tasks import deferred_tasks
+from services.follow_up_queue import follow_up_queue
+
+class FollowUpDispatcher:
+    """
+    Turns a batch of follow-ups into a smoothed send schedule instead of a
+    burst. Sends are spread evenly over `window` seconds and shared out
+    between the active numbers by remaining budget, interleaved so that no
+    number sends faster than its hourly rate allows. Each send is a
+    deferred task; when doctors are actively writing in (at least
+    `busy_threshold` incoming messages in the last `busy_window` seconds)
+    due follow-ups are held back by `pause` seconds so replies go first.
+    """
+    
+    def __init__(self, window=6 * 60 * 60, per_number_hourly=20, busy_threshold=5, busy_window=60, pause=120):
+        self.window = window
+        self.per_number_hourly = per_number_hourly
+        self.busy_threshold = busy_threshold
+        self.busy_window = busy_window
+        self.pause = pause
+        self._lock = threading.Lock()
+        self.stats_counters = {'planned': 0, 'sent': 0, 'paused': 0}
+    
+    def plan(self, count, remaining_by_number):
+        """
+        Send offsets (seconds from now) and numbers for `count` sends, as a
+        list of (offset, number_id); shorter than count if budgets run out
+        """
+        remaining = {number_id: left for number_id, left in remaining_by_number.items() if left > 0}
+        count = min(count, sum(remaining.values()))
+        if count <= 0:
+            return []
+        
+        # Share out the sends, taking from the numbers with the most budget left
+        quotas = {}
+        for _ in range(count):
+            number_id = max(remaining, key=lambda n: remaining[n])
+            remaining[number_id] -= 1
+            quotas[number_id] = quotas.get(number_id, 0) + 1
+        
+        # Evenly over the window, but no faster than the busiest number's hourly rate allows
+        spacing = max(self.window / count, 3600 * max(quotas.values()) / (self.per_number_hourly * count))
+        
+        # Interleave the numbers (smooth weighted round-robin) so each one's sends are evenly
+        # spaced too, and never let two sends from one number come closer than its rate allows
+        min_gap = 3600 / self.per_number_hourly
+        current = dict.fromkeys(quotas, 0)
+        last_send = {}
+        schedule = []
+        for i in range(count):
+            for number_id in quotas:
+                current[number_id] += quotas[number_id]
+            number_id = max(current, key=lambda n: current[n])
+            current[number_id] -= count
+            
+            offset = i * spacing
+            if number_id in last_send:
+                offset = max(offset, last_send[number_id] + min_gap)
+            last_send[number_id] = offset
+            schedule.append((offset, number_id))
+        return schedule
+    
+    def dispatch(self, follow_ups):
+        """
+        Plan (doctor, message) pairs as deferred sends; returns how many were planned
+        """
+        follow_ups = list(follow_ups)
+        schedule = self.plan(len(follow_ups), follow_up_queue.remaining_by_number())
+        
+        for (doctor, message), (offset, number_id) in zip(follow_ups, schedule):
+            deferred_tasks.schedule('follow_up', doctor.phone, message, delay=offset,
+                                    doctor_id=doctor.id, whatsapp_number_id=number_id)
+        
+        with self._lock:
+            self.stats_counters['planned'] += len(schedule)
+        
+        if schedule:
+            print(f"Planned {len(schedule)} follow-ups over {max(offset for offset, n in schedule) / 60:.0f} minutes")
+        return len(schedule)
+    
+    def interactive_load(self):
+        """
+        Incoming doctor messages in the last busy_window seconds
+        """
+        since = datetime.utcnow() - timedelta(seconds=self.busy_window)
+        return ChatMessage.query.filter(
+            ChatMessage.sender == 'doctor',
+            ChatMessage.timestamp >= since
+        ).count()
+    
+    def _gate(self, task):
+        if self.busy_threshold and self.interactive_load() >= self.busy_threshold:
+            with self._lock:
+                self.stats_counters['paused'] += 1
+            return self.pause
+        return 0
+    
+    def _on_sent(self, task, result):
+        doctor = Doctor.query.get(task.doctor_id)
+        if doctor is None:
+            return
+        
+        # The manager falls back to another number if the planned one went offline
+        whatsapp_number = WhatsAppNumber.query.filter_by(number=result.get('via')).first()
+        number_id = whatsapp_number.id if whatsapp_number else task.whatsapp_number_id
+        
+        follow_up_queue.record(doctor, task.message, number_id, follow_up_queue.priority(doctor))
+        
+        if number_id:
+            db.session.add(ChatMessage(
+                doctor_id=doctor.id,
+                whatsapp_number_id=number_id,
+                sender='ai',
+                message=task.message,
+                status='sent'
+            ))
+        
+        # Update last interaction (drops the doctor out of the queue)
+        doctor.last_interaction = datetime.utcnow()
+        
+        with self._lock:
+            self.stats_counters['sent'] += 1
+        print(f"Follow-up sent to {doctor.name}")
+    
+    def get_stats(self):
+        with self._lock:
+            return {
+                'window_seconds': self.window,
+                'per_number_hourly': self.per_number_hourly,
+                'busy_threshold': self.busy_threshold,
+                **self.stats_counters
+            }
+
+# Global instance
+follow_up_dispatcher = FollowUpDispatcher(
+    window=float(os.getenv('FOLLOW_UP_WINDOW_SECONDS', str(6 * 60 * 60))),
+    per_number_hourly=int(os.getenv('FOLLOW_UP_PER_NUMBER_HOURLY', '20')),
+    busy_threshold=int(os.getenv('FOLLOW_UP_BUSY_THRESHOLD', '5')),
+    pause=float(os.getenv('FOLLOW_UP_BUSY_PAUSE', '120'))
+)
+
+deferred_tasks.register_hooks('follow_up', gate=follow_up_dispatcher._gate, on_sent=follow_up_dispatcher._on_sent)
@@ -0,0 +1,166 @@
+import os
+import heapq
+from datetime import datetime, timedelta
+from models.whatsapp import db, Doctor, WhatsAppNumber, FollowUpLog, DeferredTask
+
+class FollowUpQueue:
+    """
+    Ranked queue of leads due for a follow-up. Idle warm/hot leads are read
+    in pages straight off the (tag, last_interaction) index, stalest first,
+    and ranked by score and staleness; a run stops reading once no further
+    row can make the top of the ranking, instead of loading the whole lead
+    table. Sends are capped by a daily budget and
+    a per-number daily budget, and every send is logged in follow_up_log.
+    Follow-ups already planned as deferred tasks count against the budgets
+    and their doctors are not picked again.
+    """
+    
+    def __init__(self, tags=('hot_lead', 'warm_lead'), idle_days=3, batch_size=5,
+                 daily_budget=50, per_number_budget=25, staleness_weight=0.5, max_staleness_days=30):
+        self.tags = tags
+        self.idle_days = idle_days
+        self.batch_size = batch_size
+        self.daily_budget = daily_budget
+        self.per_number_budget = per_number_budget
+        self.staleness_weight = staleness_weight
+        self.max_staleness_days = max_staleness_days
+    
+    def priority(self, doctor, now=None):
+        """
+        Lead score plus a capped bonus per idle day
+        """
+        now = now or datetime.utcnow()
+        idle_days = (now - doctor.last_interaction).days if doctor.last_interaction else self.max_staleness_days
+        return (doctor.score or 0) + self.staleness_weight * min(idle_days, self.max_staleness_days)
+    
+    def _scan(self, tag, cutoff, page_size, after=None):
+        """
+        One page of idle leads with a tag, stalest first (index range scan)
+        """
+        query = Doctor.query.filter(Doctor.tag == tag, Doctor.last_interaction < cutoff)
+        if after is not None:
+            last_interaction, doctor_id = after
+            query = query.filter(db.or_(
+                Doctor.last_interaction > last_interaction,
+                db.and_(Doctor.last_interaction == last_interaction, Doctor.id > doctor_id)
+            ))
+        return query.order_by(Doctor.last_interaction, Doctor.id).limit(page_size).all()
+    
+    def candidates(self, limit=None, exclude=()):
+        """
+        Top `limit` idle leads by priority. Each tag is read in pages of
+        4 x limit, stalest first, until even its best score plus the
+        staleness bonus of the next (fresher) rows cannot beat the current
+        top `limit`, so a high-score lead is found wherever it sits in the index.
+        """
+        limit = limit or self.batch_size
+        page_size = limit * 4
+        now = datetime.utcnow()
+        cutoff = now - timedelta(days=self.idle_days)
+        
+        top = []
+        for tag in self.tags:
+            max_score = db.session.query(db.func.max(Doctor.score)).filter(
+                Doctor.tag == tag, Doctor.last_interaction < cutoff
+            ).scalar()
+            if max_score is None:
+                continue
+            
+            after = None
+            while True:
+                page = self._scan(tag, cutoff, page_size, after)
+                top.extend(doctor for doctor in page if doctor.id not in exclude)
+                top = heapq.nlargest(limit, top, key=lambda doctor: self.priority(doctor, now))
+                if len(page) < page_size:
+                    break
+                
+                after = (page[-1].last_interaction, page[-1].id)
+                # Later rows are no staler than the last one read
+                idle_days = min((now - page[-1].last_interaction).days, self.max_staleness_days)
+                best_remaining = max_score + self.staleness_weight * idle_days
+                if len(top) == limit and best_remaining <= self.priority(top[-1], now):
+                    break
+        
+        return top
+    
+    def _sent_today(self):
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        rows = db.session.query(FollowUpLog.whatsapp_number_id, db.func.count(FollowUpLog.id)).filter(
+            FollowUpLog.sent_at >= today
+        ).group_by(FollowUpLog.whatsapp_number_id).all()
+        return dict(rows)
+    
+    def _planned(self):
+        """
+        Follow-ups scheduled but not sent yet, as (doctor_id, whatsapp_number_id) pairs
+        """
+        return db.session.query(DeferredTask.doctor_id, DeferredTask.whatsapp_number_id).filter(
+            DeferredTask.kind == 'follow_up',
+            DeferredTask.status.in_(('pending', 'running'))
+        ).all()
+    
+    def remaining_by_number(self, planned=None):
+        """
+        Unused per-number budget of each active number, counting planned sends
+        """
+        used = self._sent_today()
+        for doctor_id, number_id in (self._planned() if planned is None else planned):
+            used[number_id] = used.get(number_id, 0) + 1
+        
+        active_numbers = [number_id for number_id, in db.session.query(WhatsAppNumber.id).filter_by(status='active')]
+        return {
+            number_id: max(0, self.per_number_budget - used.get(number_id, 0))
+            for number_id in active_numbers
+        }
+    
+    def remaining_budget(self, planned=None):
+        """
+        How many follow-ups may still go out today: the smaller of what is
+        left of the daily budget and the unused per-number budget of the
+        active numbers
+        """
+        planned = self._planned() if planned is None else planned
+        daily_left = self.daily_budget - sum(self._sent_today().values()) - len(planned)
+        numbers_left = sum(self.remaining_by_number(planned).values())
+        return max(0, min(daily_left, numbers_left))
+    
+    def next_batch(self):
+        """
+        Leads to follow up in this run (within today's budget)
+        """
+        planned = self._planned()
+        limit = min(self.batch_size, self.remaining_budget(planned))
+        if limit <= 0:
+            return []
+        return self.candidates(limit, exclude={doctor_id for doctor_id, number_id in planned})
+    
+    def record(self, doctor, message, whatsapp_number_id=None, priority=None):
+        """
+        Log a sent follow-up; the caller commits
+        """
+        db.session.add(FollowUpLog(
+            doctor_id=doctor.id,
+            whatsapp_number_id=whatsapp_number_id,
+            message=message,
+            priority=priority
+        ))
+    
+    def get_stats(self):
+        sent_by_number = self._sent_today()
+        return {
+            'sent_today': sum(sent_by_number.values()),
+            'sent_today_by_number': sent_by_number,
+            'planned': len(self._planned()),
+            'daily_budget': self.daily_budget,
+            'per_number_budget': self.per_number_budget,
+            'remaining_today': self.remaining_budget(),
+            'batch_size': self.batch_size
+        }
+
+# Global instance
+follow_up_queue = FollowUpQueue(
+    idle_days=int(os.getenv('FOLLOW_UP_IDLE_DAYS', '3')),
+    batch_size=int(os.getenv('FOLLOW_UP_BATCH_SIZE', '5')),
+    daily_budget=int(os.getenv('FOLLOW_UP_DAILY_BUDGET', '50')),
+    per_number_budget=int(os.getenv('FOLLOW_UP_PER_NUMBER_BUDGET', '25'))
+)
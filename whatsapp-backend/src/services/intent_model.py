@@ -0,0 +1,266 @@
+import os
+import re
+import json
+import math
+import zlib
+import random
+import argparse
+
+# NumPy is only needed when the intent model backend is enabled
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+DEFAULT_N_FEATURES = 2 ** 18
+
+def tokenize(text):
+    """
+    Split text into unigram and bigram tokens
+    """
+    words = TOKEN_PATTERN.findall((text or '').lower())
+    return words + [f'{first} {second}' for first, second in zip(words, words[1:])]
+
+def hash_features(text, n_features):
+    """
+    Hash tokens of a message into {feature_index: term_frequency}
+    """
+    counts = {}
+    for token in tokenize(text):
+        index = zlib.crc32(token.encode('utf-8')) % n_features
+        counts[index] = counts.get(index, 0) + 1
+    return counts
+
+def _model_paths(path):
+    """
+    Weight file (.npy) and metadata sidecar (.json) paths for a model path
+    """
+    stem = path[:-4] if path.endswith('.npy') else path
+    return f'{stem}.npy', f'{stem}.json'
+
+class IntentModel:
+    """
+    Hashed bag-of-words TF-IDF linear classifier evaluated with NumPy.
+    
+    The weight file holds a float32 matrix of shape (n_features, n_labels + 1):
+    column 0 is the IDF vector, the remaining columns are the class weights.
+    It is memory-mapped, so loading is cheap and pages are shared between
+    processes.
+    """
+    
+    def __init__(self, weights, labels, bias, min_confidence=0.5):
+        self.weights = weights
+        self.labels = list(labels)
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.n_features = weights.shape[0]
+        self.min_confidence = min_confidence
+    
+    @classmethod
+    def load(cls, path, min_confidence=0.5):
+        """
+        Load a trained model, memory-mapping the weight file
+        """
+        if np is None:
+            raise RuntimeError('numpy is required for the intent model backend')
+        
+        weights_path, meta_path = _model_paths(path)
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+        
+        weights = np.load(weights_path, mmap_mode='r')
+        if weights.shape != (meta['n_features'], len(meta['labels']) + 1):
+            raise ValueError(f'Weight file {weights_path} does not match {meta_path}')
+        
+        return cls(weights, meta['labels'], meta['bias'], min_confidence)
+    
+    def save(self, path):
+        """
+        Save weights and metadata next to each other
+        """
+        weights_path, meta_path = _model_paths(path)
+        np.save(weights_path, np.ascontiguousarray(self.weights, dtype=np.float32))
+        with open(meta_path, 'w') as meta_file:
+            json.dump({
+                'n_features': self.n_features,
+                'labels': self.labels,
+                'bias': [float(value) for value in self.bias]
+            }, meta_file)
+    
+    def vectorize(self, texts):
+        """
+        Build the sparse TF-IDF representation of a batch of messages.
+        Returns (rows, feature_indices, values) with L2-normalized rows.
+        """
+        return _vectorize(texts, self.n_features, self.weights[:, 0])
+    
+    def predict_proba(self, texts):
+        """
+        Class probabilities for a batch of messages, shape (len(texts), n_labels)
+        """
+        rows, indices, values = self.vectorize(texts)
+        n_rows = len(texts)
+        
+        # Gather only the weight rows touched by the batch
+        contributions = np.asarray(self.weights[indices, 1:]) * values[:, None]
+        scores = np.empty((n_rows, len(self.labels)), dtype=np.float32)
+        for label_index in range(len(self.labels)):
+            scores[:, label_index] = np.bincount(
+                rows, weights=contributions[:, label_index], minlength=n_rows
+            )
+        scores += self.bias
+        
+        return _softmax(scores)
+    
+    def classify_batch(self, texts):
+        """
+        Classify a batch of messages into {'category', 'confidence'} dicts
+        """
+        if not texts:
+            return []
+        
+        probabilities = self.predict_proba(texts)
+        best = probabilities.argmax(axis=1)
+        
+        results = []
+        for row, label_index in enumerate(best):
+            confidence = float(probabilities[row, label_index])
+            if confidence < self.min_confidence:
+                results.append({'category': 'general', 'confidence': 0.6})
+            else:
+                results.append({
+                    'category': self.labels[label_index],
+                    'confidence': round(confidence, 4)
+                })
+        
+        return results
+    
+    def classify(self, text):
+        return self.classify_batch([text])[0]
+
+def _vectorize(texts, n_features, idf):
+    rows, indices, values = [], [], []
+    for row, text in enumerate(texts):
+        for index, count in hash_features(text, n_features).items():
+            rows.append(row)
+            indices.append(index)
+            values.append(1.0 + math.log(count))
+    
+    rows = np.asarray(rows, dtype=np.int64)
+    indices = np.asarray(indices, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float32) * np.asarray(idf[indices], dtype=np.float32)
+    
+    norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=len(texts)))
+    norms[norms == 0] = 1.0
+    values = (values / norms[rows]).astype(np.float32)
+    
+    return rows, indices, values
+
+def _softmax(scores):
+    scores = scores - scores.max(axis=1, keepdims=True)
+    exp_scores = np.exp(scores)
+    return exp_scores / exp_scores.sum(axis=1, keepdims=True)
+
+def train_intent_model(examples, n_features=DEFAULT_N_FEATURES, epochs=20,
+                       learning_rate=2.0, l2=1e-4, batch_size=64, seed=42):
+    """
+    Train a softmax regression intent model from (text, label) pairs
+    """
+    if np is None:
+        raise RuntimeError('numpy is required to train the intent model')
+    
+    examples = [(text, label) for text, label in examples if text and label]
+    if not examples:
+        raise ValueError('No labeled examples to train on')
+    
+    labels = sorted({label for _, label in examples})
+    label_index = {label: index for index, label in enumerate(labels)}
+    
+    # Smoothed inverse document frequency over hashed features
+    document_frequency = np.zeros(n_features, dtype=np.float64)
+    for text, _ in examples:
+        for index in hash_features(text, n_features):
+            document_frequency[index] += 1
+    idf = (np.log((1 + len(examples)) / (1 + document_frequency)) + 1).astype(np.float32)
+    
+    weights = np.zeros((n_features, len(labels)), dtype=np.float32)
+    bias = np.zeros(len(labels), dtype=np.float32)
+    
+    rng = random.Random(seed)
+    order = list(range(len(examples)))
+    
+    for _ in range(epochs):
+        rng.shuffle(order)
+        for start in range(0, len(order), batch_size):
+            batch = [examples[i] for i in order[start:start + batch_size]]
+            rows, indices, values = _vectorize([text for text, _ in batch], n_features, idf)
+            
+            targets = np.zeros((len(batch), len(labels)), dtype=np.float32)
+            targets[np.arange(len(batch)), [label_index[label] for _, label in batch]] = 1.0
+            
+            scores = np.zeros((len(batch), len(labels)), dtype=np.float32)
+            np.add.at(scores, rows, weights[indices] * values[:, None])
+            errors = (_softmax(scores + bias) - targets) / len(batch)
+            
+            gradient = errors[rows] * values[:, None]
+            if l2:
+                unique_indices = np.unique(indices)
+                weights[unique_indices] *= (1.0 - learning_rate * l2)
+            np.add.at(weights, indices, -learning_rate * gradient)
+            bias -= learning_rate * errors.sum(axis=0)
+    
+    matrix = np.empty((n_features, len(labels) + 1), dtype=np.float32)
+    matrix[:, 0] = idf
+    matrix[:, 1:] = weights
+    
+    return IntentModel(matrix, labels, bias)
+
+def load_examples_from_file(path):
+    """
+    Read labeled examples from a JSONL file of {"message": ..., "intent": ...}
+    """
+    examples = []
+    with open(path) as data_file:
+        for line in data_file:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                examples.append((record.get('message', ''), record.get('intent', '')))
+    return examples
+
+def load_examples_from_db():
+    """
+    Read labeled doctor messages (ChatMessage rows with a MessageLabel)
+    """
+    from models.whatsapp import db, ChatMessage, MessageLabel
+    
+    rows = db.session.query(ChatMessage.message, MessageLabel.intent).join(
+        MessageLabel, MessageLabel.message_id == ChatMessage.id
+    ).filter(ChatMessage.sender == 'doctor').all()
+    
+    return [(message, intent) for message, intent in rows]
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the intent model reply backend')
+    parser.add_argument('--data', help='JSONL file with "message" and "intent" fields')
+    parser.add_argument('--from-db', action='store_true', help='Train from labeled ChatMessage history')
+    parser.add_argument('--output', default=os.getenv('INTENT_MODEL_PATH', 'intent_model.npy'))
+    parser.add_argument('--n-features', type=int, default=DEFAULT_N_FEATURES)
+    parser.add_argument('--epochs', type=int, default=20)
+    args = parser.parse_args()
+    
+    examples = []
+    if args.data:
+        examples.extend(load_examples_from_file(args.data))
+    if args.from_db:
+        from main import app
+        with app.app_context():
+            examples.extend(load_examples_from_db())
+    
+    model = train_intent_model(examples, n_features=args.n_features, epochs=args.epochs)
+    model.save(args.output)
+    
+    print(f"Trained intent model on {len(examples)} examples ({', '.join(model.labels)}) -> {args.output}")
+
+if __name__ == '__main__':
+    main()
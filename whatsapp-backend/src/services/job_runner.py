@@ -0,0 +1,69 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from models.whatsapp import db
+
+class JobRunner:
+    """
+    Runs callables inside their own Flask app context. Flask-SQLAlchemy
+    scopes db.session to the app context, so every call gets a private
+    session that is removed when it finishes; sub-tasks fanned out with
+    map() can therefore run in parallel with each other and with requests.
+    Pass ids (not ORM objects) to sub-tasks and load rows inside them.
+    """
+    
+    def __init__(self, workers=4):
+        self.workers = workers
+        self.app = None
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job-task')
+    
+    def init_app(self, app):
+        """
+        Bind the Flask app whose context tasks run in
+        """
+        self.app = app
+    
+    def call(self, func, *args):
+        """
+        Run func(*args) in a fresh app context with its own session
+        """
+        if self.app is None:
+            return func(*args)
+        
+        with self.app.app_context():
+            try:
+                return func(*args)
+            except Exception:
+                db.session.rollback()
+                raise
+    
+    def _run_task(self, func, item):
+        try:
+            return self.call(func, item), None
+        except Exception as e:
+            return None, e
+    
+    def map(self, func, items, name='task'):
+        """
+        Run func(item) for every item on the pool; returns the results in
+        order (None for items that raised) and reports failures
+        """
+        items = list(items)
+        if not items:
+            return []
+        
+        started = time.perf_counter()
+        outcomes = list(self._pool.map(lambda item: self._run_task(func, item), items))
+        
+        failures = [(item, error) for item, (result, error) in zip(items, outcomes) if error is not None]
+        for item, error in failures[:5]:
+            print(f"Error in {name} for {item}: {str(error)}")
+        if len(failures) > 5:
+            print(f"... {len(failures) - 5} more {name} failures")
+        
+        print(f"{name}: {len(items)} sub-tasks in {time.perf_counter() - started:.2f}s "
+              f"({len(failures)} failed, {self.workers} workers)")
+        return [result for result, error in outcomes]
+
+# Global instance
+job_runner = JobRunner(workers=int(os.getenv('JOB_RUNNER_WORKERS', '4')))
@@ -0,0 +1,326 @@
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.exc import IntegrityError
+from models.whatsapp import db, ServiceLease, SharedState, ControlCommand
+
+def get_shared_state(key, default=None):
+    """
+    Read a JSON value shared between processes (requires an app context)
+    """
+    row = SharedState.query.get(key)
+    if row is None or row.value is None:
+        return default
+    return json.loads(row.value)
+
+def set_shared_state(key, value):
+    """
+    Write a JSON value shared between processes (requires an app context)
+    """
+    row = SharedState.query.get(key)
+    if row is None:
+        row = SharedState(key=key)
+        db.session.add(row)
+    row.value = json.dumps(value)
+    row.updated_at = datetime.utcnow()
+    db.session.commit()
+
+class LeaderElector:
+    """
+    Elects one process (e.g. one gunicorn worker) to own the background
+    work: scheduled jobs and the WhatsApp Web sessions. The leader holds a
+    lease row that it renews every `heartbeat` seconds; if it stops renewing,
+    another process takes over once the lease expires after `ttl` seconds.
+    
+    Control calls that need the leader's in-process state are run through
+    execute(): on the leader they run directly, elsewhere they are queued in
+    control_commands and the caller gets the command id right away (or, for
+    quick reads, after waiting briefly for the result); get_command() reports
+    the outcome later.
+    """
+    
+    def __init__(self, name='automation', ttl=30, heartbeat=10, command_poll=0.5, command_max_age=300,
+                 enabled=True):
+        self.name = name
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.command_poll = command_poll
+        self.command_max_age = command_max_age
+        self.enabled = enabled
+        self.identity = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.app = None
+        self.term = None
+        self._valid_until = 0
+        self._leader = False
+        self._commands = {}
+        self._elected_callbacks = []
+        self._demoted_callbacks = []
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='leader-command')
+        # Elected/demoted callbacks can be slow (browser start-up); they run in order on
+        # their own thread so lease renewals are never held up by an election
+        # (a demotion waits for them, see _demote)
+        self._lifecycle = ThreadPoolExecutor(max_workers=1, thread_name_prefix='leader-lifecycle')
+    
+    def init_app(self, app):
+        """
+        Bind the Flask app whose context the elector runs in
+        """
+        self.app = app
+    
+    @property
+    def is_leader(self):
+        """
+        True while this process holds an unexpired lease (always when election is disabled)
+        """
+        if not self.enabled:
+            return True
+        return self._leader and time.monotonic() < self._valid_until
+    
+    def on_elected(self, callback):
+        self._elected_callbacks.append(callback)
+    
+    def on_demoted(self, callback):
+        self._demoted_callbacks.append(callback)
+    
+    def register_command(self, name, func):
+        """
+        Register a control command; func(payload) must return a JSON-serializable dict
+        """
+        self._commands[name] = func
+    
+    def start(self):
+        """
+        Start campaigning for the lease in a background thread
+        """
+        if not self.enabled:
+            self._run_callbacks(self._elected_callbacks, 'elected')
+            return
+        
+        if self._thread and self._thread.is_alive():
+            return
+        
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='leader-elector')
+        self._thread.start()
+    
+    def stop(self):
+        """
+        Stop campaigning and hand the lease over right away
+        """
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=self.heartbeat)
+        
+        if self._leader:
+            self._demote()
+            try:
+                with self.app.app_context():
+                    ServiceLease.query.filter_by(name=self.name, holder=self.identity).update(
+                        {'expires_at': datetime.utcnow()}, synchronize_session=False
+                    )
+                    db.session.commit()
+            except Exception as e:
+                print(f"Error releasing leader lease: {str(e)}")
+    
+    def _try_acquire(self):
+        """
+        Renew the lease, or take it over if it expired. Returns True if held.
+        """
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl)
+        
+        renewed = ServiceLease.query.filter_by(name=self.name, holder=self.identity).update(
+            {'expires_at': expires_at, 'renewed_at': now}, synchronize_session=False
+        )
+        if not renewed:
+            renewed = ServiceLease.query.filter(
+                ServiceLease.name == self.name,
+                ServiceLease.expires_at < now
+            ).update({
+                'holder': self.identity,
+                'term': ServiceLease.term + 1,
+                'expires_at': expires_at,
+                'renewed_at': now
+            }, synchronize_session=False)
+        db.session.commit()
+        
+        if not renewed:
+            if ServiceLease.query.filter_by(name=self.name).first() is not None:
+                return False
+            try:
+                db.session.add(ServiceLease(name=self.name, holder=self.identity, term=1,
+                                            expires_at=expires_at, renewed_at=now))
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                return False
+        
+        self.term = ServiceLease.query.filter_by(name=self.name).first().term
+        return True
+    
+    def _run(self):
+        next_heartbeat = 0
+        while not self._stop_event.is_set():
+            try:
+                with self.app.app_context():
+                    if time.monotonic() >= next_heartbeat:
+                        started = time.monotonic()
+                        held = self._try_acquire()
+                        next_heartbeat = started + self.heartbeat
+                        
+                        if held:
+                            # Count validity from before the write, with a margin for clock skew
+                            self._valid_until = started + self.ttl - self.heartbeat
+                            if not self._leader:
+                                self._leader = True
+                                print(f"Became leader ({self.identity}, term {self.term})")
+                                self._lifecycle.submit(self._run_callbacks, self._elected_callbacks, 'elected')
+                        elif self._leader:
+                            self._demote()
+                    
+                    if self.is_leader:
+                        self._claim_commands()
+                    
+                    db.session.remove()
+            
+            except Exception as e:
+                print(f"Error in leader election: {str(e)}")
+                if self._leader and time.monotonic() >= self._valid_until:
+                    self._demote()
+            
+            self._stop_event.wait(self.command_poll)
+    
+    def _demote(self):
+        """
+        Give up the leader role and wait for the demoted callbacks to finish,
+        so this process has stopped its background work (scheduler, sessions)
+        before it campaigns again. They run after any elected callbacks still
+        in progress, which would otherwise restart that work.
+        """
+        self._leader = False
+        self._valid_until = 0
+        print(f"Lost leadership ({self.identity})")
+        self._lifecycle.submit(self._run_callbacks, self._demoted_callbacks, 'demoted').result()
+    
+    def _run_callbacks(self, callbacks, event):
+        for callback in callbacks:
+            try:
+                if self.app is not None:
+                    with self.app.app_context():
+                        callback()
+                else:
+                    callback()
+            except Exception as e:
+                print(f"Error in leader {event} callback: {str(e)}")
+    
+    def _claim_commands(self):
+        # Commands nobody answered for a while (e.g. while there was no leader) are dropped
+        # rather than replayed late
+        stale_before = datetime.utcnow() - timedelta(seconds=self.command_max_age)
+        expired = ControlCommand.query.filter(
+            ControlCommand.status == 'pending',
+            ControlCommand.created_at < stale_before
+        ).update({
+            'status': 'done',
+            'result': json.dumps({'error': 'Command expired before the leader picked it up'}),
+            'completed_at': datetime.utcnow()
+        }, synchronize_session=False)
+        if expired:
+            db.session.commit()
+        
+        pending = ControlCommand.query.filter_by(status='pending').order_by(ControlCommand.id).all()
+        for command in pending:
+            claimed = ControlCommand.query.filter_by(id=command.id, status='pending').update(
+                {'status': 'running'}, synchronize_session=False
+            )
+            db.session.commit()
+            if claimed:
+                self._pool.submit(self._run_command, command.id, command.command, command.payload)
+    
+    def _run_command(self, command_id, name, payload):
+        with self.app.app_context():
+            result = self._dispatch(name, json.loads(payload) if payload else {})
+            try:
+                ControlCommand.query.filter_by(id=command_id).update({
+                    'status': 'done',
+                    'result': json.dumps(result),
+                    'completed_at': datetime.utcnow()
+                }, synchronize_session=False)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error storing result of command {name}: {str(e)}")
+    
+    def _dispatch(self, name, payload):
+        func = self._commands.get(name)
+        if func is None:
+            return {'error': f'Unknown command: {name}'}
+        try:
+            return func(payload)
+        except Exception as e:
+            return {'error': str(e)}
+    
+    def execute(self, name, payload=None, timeout=0):
+        """
+        Run a control command on the leader. Must be called inside an app
+        context. On the leader it runs directly and its result is returned;
+        elsewhere it is queued and {'queued': True, 'command_id': ...} is
+        returned, after waiting up to `timeout` seconds for the result
+        (only for reads: a caller retrying a queued command runs it twice).
+        """
+        payload = payload or {}
+        if self.is_leader:
+            return self._dispatch(name, payload)
+        
+        command = ControlCommand(command=name, payload=json.dumps(payload))
+        db.session.add(command)
+        db.session.commit()
+        command_id = command.id
+        
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.command_poll / 2)
+            db.session.expire_all()
+            command = ControlCommand.query.get(command_id)
+            if command.status == 'done':
+                return json.loads(command.result)
+        
+        return {'queued': True, 'command_id': command_id, 'message': 'Forwarded to the leader process'}
+    
+    def get_command(self, command_id):
+        """
+        Status and, once done, result of a queued command (None if unknown)
+        """
+        command = ControlCommand.query.get(command_id)
+        if command is None:
+            return None
+        return {
+            'command_id': command.id,
+            'command': command.command,
+            'status': command.status,
+            'result': json.loads(command.result) if command.result else None,
+            'created_at': command.created_at.isoformat() if command.created_at else None,
+            'completed_at': command.completed_at.isoformat() if command.completed_at else None
+        }
+    
+    def get_status(self):
+        return {
+            'enabled': self.enabled,
+            'identity': self.identity,
+            'is_leader': self.is_leader,
+            'term': self.term
+        }
+
+# Global instance
+leader_elector = LeaderElector(
+    ttl=float(os.getenv('LEADER_LEASE_TTL', '30')),
+    heartbeat=float(os.getenv('LEADER_HEARTBEAT', '10')),
+    enabled=os.getenv('LEADER_ELECTION', 'on').lower() not in ('off', '0', 'false')
+)
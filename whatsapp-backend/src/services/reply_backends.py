@@ -0,0 +1,293 @@
+import os
+import time
+import json
+import queue
+import argparse
+import threading
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, InvalidStateError, TimeoutError as FutureTimeoutError
+import requests
+from services.ai_agents import smart_reply_agent
+
+# Plain, thread-safe stand-in for a Doctor row (only the name is used for personalization)
+DoctorRef = namedtuple('DoctorRef', ['name'])
+
+ReplyRequest = namedtuple('ReplyRequest', ['message', 'doctor'])
+
+def _resolve(future, result=None, error=None):
+    """
+    Complete a future unless the caller already gave up on it
+    """
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+def _doctor_ref(doctor_context):
+    if doctor_context is None or not getattr(doctor_context, 'name', None):
+        return None
+    return DoctorRef(doctor_context.name)
+
+class RegexReplyBackend:
+    """
+    In-process backend built on the regex SmartReplyAgent
+    """
+    
+    name = 'regex'
+    
+    def __init__(self, agent=None):
+        self.agent = agent or smart_reply_agent
+    
+    def generate_replies(self, batch, timeout=None):
+        # Warm the classification cache for the whole batch in one pass
+        self.agent.classify_batch([item.message for item in batch])
+        return [self.agent.generate_reply(item.message, item.doctor) for item in batch]
+
+class HTTPReplyBackend:
+    """
+    Backend that posts batches to a local model server.
+    
+    Request:  {"messages": [{"message": "...", "doctor_name": "..."}, ...]}
+    Response: {"replies": [{"reply": "...", "category": "...", "confidence": 0.9}, ...]}
+    """
+    
+    name = 'http'
+    
+    def __init__(self, url):
+        self.url = url
+        self.session = requests.Session()
+    
+    def generate_replies(self, batch, timeout=None):
+        payload = {
+            'messages': [{
+                'message': item.message,
+                'doctor_name': item.doctor.name if item.doctor else None
+            } for item in batch]
+        }
+        
+        response = self.session.post(self.url, json=payload, timeout=timeout)
+        response.raise_for_status()
+        
+        replies = response.json().get('replies', [])
+        if len(replies) != len(batch):
+            raise ValueError(f'Expected {len(batch)} replies, got {len(replies)}')
+        
+        return [{
+            'reply': reply['reply'],
+            'category': reply.get('category', 'general'),
+            'confidence': float(reply.get('confidence', 0.0))
+        } for reply in replies]
+
+class MicroBatchingReplyService:
+    """
+    Front door for reply generation. Concurrent requests are grouped into
+    micro-batches (up to max_batch_size items or max_wait seconds), each
+    request has a deadline, and anything that errors or misses its deadline
+    is answered by the fallback backend instead.
+    
+    A backend has a `name` and generate_replies(batch, timeout), which takes
+    a list of ReplyRequest items and returns one reply dict ({'reply',
+    'category', 'confidence'}) per item, in order, giving up once `timeout`
+    seconds have passed. The in-process regex backend is called directly:
+    it answers in microseconds, so batching would only add max_wait.
+    """
+    
+    def __init__(self, backend, fallback=None, max_batch_size=32, max_wait=0.02,
+                 timeout=2.0, max_in_flight=4):
+        self.backend = backend
+        self.fallback = fallback or RegexReplyBackend()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.timeout = timeout
+        
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='reply-batch')
+        self._dispatcher = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'batches': 0,
+            'batched_items': 0,
+            'fallbacks': 0,
+            'timeouts': 0,
+            'errors': 0
+        }
+    
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None:
+            with self._lock:
+                if self._dispatcher is None:
+                    self._dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True)
+                    self._dispatcher.start()
+    
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+    
+    def submit(self, message_text, doctor_context=None, timeout=None):
+        """
+        Queue a reply request; returns (future, deadline)
+        """
+        self._ensure_dispatcher()
+        self._count('requests')
+        
+        deadline = time.monotonic() + (timeout if timeout is not None else self.timeout)
+        future = Future()
+        self._queue.put((ReplyRequest(message_text, _doctor_ref(doctor_context)), deadline, future))
+        
+        return future, deadline
+    
+    def generate_reply(self, message_text, doctor_context=None, timeout=None):
+        """
+        Generate a single reply, falling back to the regex agent on timeout
+        """
+        return self.generate_replies([(message_text, doctor_context)], timeout=timeout)[0]
+    
+    def generate_replies(self, items, timeout=None):
+        """
+        Generate replies for (message_text, doctor_context) pairs, in order
+        """
+        if isinstance(self.backend, RegexReplyBackend):
+            self._count('requests', len(items))
+            return self.backend.generate_replies([
+                ReplyRequest(message_text, _doctor_ref(doctor_context)) for message_text, doctor_context in items
+            ])
+        
+        pending = [self.submit(message_text, doctor_context, timeout) for message_text, doctor_context in items]
+        
+        replies = []
+        for (message_text, doctor_context), (future, deadline) in zip(items, pending):
+            try:
+                replies.append(future.result(timeout=max(deadline - time.monotonic(), 0)))
+            except FutureTimeoutError:
+                future.cancel()
+                self._count('timeouts')
+                replies.append(self._fallback_reply(message_text, doctor_context))
+            except Exception:
+                replies.append(self._fallback_reply(message_text, doctor_context))
+        
+        return replies
+    
+    def _fallback_reply(self, message_text, doctor_context):
+        self._count('fallbacks')
+        item = ReplyRequest(message_text, _doctor_ref(doctor_context))
+        return self.fallback.generate_replies([item])[0]
+    
+    def _dispatch_loop(self):
+        """
+        Collect queued requests into micro-batches and hand them to the backend
+        """
+        while True:
+            batch = [self._queue.get()]
+            batch_deadline = time.monotonic() + self.max_wait
+            
+            while len(batch) < self.max_batch_size:
+                remaining = batch_deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            # Skip requests whose caller already gave up
+            batch = [entry for entry in batch if not entry[2].done()]
+            if batch:
+                self._executor.submit(self._run_batch, batch)
+    
+    def _run_batch(self, batch):
+        items = [item for item, _, _ in batch]
+        futures = [future for _, _, future in batch]
+        
+        # The backend gets the time left before the earliest deadline in the batch
+        timeout = max(min(deadline for _, deadline, _ in batch) - time.monotonic(), 0.001)
+        
+        self._count('batches')
+        self._count('batched_items', len(items))
+        
+        try:
+            replies = self.backend.generate_replies(items, timeout=timeout)
+            for future, reply in zip(futures, replies):
+                _resolve(future, reply)
+        except Exception as e:
+            self._count('errors')
+            print(f"Reply backend '{self.backend.name}' failed: {str(e)}")
+            for future in futures:
+                _resolve(future, error=e)
+    
+    def stats(self):
+        """
+        Get batching statistics
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        
+        stats['backend'] = self.backend.name
+        stats['avg_batch_size'] = round(stats['batched_items'] / stats['batches'], 2) if stats['batches'] else 0.0
+        return stats
+
+def create_reply_service():
+    """
+    Build the reply service from environment configuration
+    """
+    backend_name = os.getenv('REPLY_BACKEND', 'regex')
+    
+    if backend_name == 'http':
+        backend = HTTPReplyBackend(os.getenv('REPLY_BACKEND_URL', 'http://127.0.0.1:8081/generate'))
+    else:
+        backend = RegexReplyBackend()
+    
+    return MicroBatchingReplyService(
+        backend,
+        max_batch_size=int(os.getenv('REPLY_BATCH_SIZE', '32')),
+        max_wait=float(os.getenv('REPLY_BATCH_WAIT_MS', '20')) / 1000.0,
+        timeout=float(os.getenv('REPLY_BACKEND_TIMEOUT', '2.0'))
+    )
+
+def serve_stub(port=8081, delay=0.0):
+    """
+    Local stub model server answering with the regex agent (for testing)
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    backend = RegexReplyBackend()
+    
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            messages = json.loads(self.rfile.read(length) or b'{}').get('messages', [])
+            
+            if delay:
+                time.sleep(delay)
+            
+            batch = [
+                ReplyRequest(item.get('message', ''), DoctorRef(item['doctor_name']) if item.get('doctor_name') else None)
+                for item in messages
+            ]
+            body = json.dumps({'replies': backend.generate_replies(batch)}).encode('utf-8')
+            
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    print(f"Stub reply server listening on http://127.0.0.1:{port}/generate")
+    server.serve_forever()
+
+# Global instance
+reply_service = create_reply_service()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stub reply model server')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--delay', type=float, default=0.0, help='Artificial latency per batch (seconds)')
+    args = parser.parse_args()
+    serve_stub(args.port, args.delay)
@@ -0,0 +1,319 @@
+import os
+import time
+import heapq
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from models.whatsapp import db, JobRun
+
+class Job:
+    """
+    A recurring job: every `interval` seconds or daily at `at` ("HH:MM",
+    local time), delayed by up to `jitter` seconds each run
+    """
+    
+    def __init__(self, name, func, interval=None, at=None, jitter=0, timeout=None):
+        if (interval is None) == (at is None):
+            raise ValueError('A job needs exactly one of interval or at')
+        
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.at = at
+        self.jitter = jitter
+        self.timeout = timeout
+        
+        self.due = None
+        self.next_run = None
+        self.running = False
+        self.started_at = None
+        self.timed_out = False
+        self.last_run = None
+        self.last_duration = None
+        self.last_status = None
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+    
+    def _next_daily(self, now):
+        hour, minute = map(int, self.at.split(':'))
+        due = datetime.fromtimestamp(now).replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if due.timestamp() <= now:
+            due += timedelta(days=1)
+        return due.timestamp()
+    
+    def _set_due(self, due):
+        # Jitter is applied on top of the nominal time so it never accumulates
+        self.due = due
+        self.next_run = due + (random.uniform(0, self.jitter) if self.jitter else 0)
+        return self.next_run
+    
+    def first_run(self, now, last_started=None):
+        """
+        Schedule the first run; interval jobs resume from their last start (epoch)
+        """
+        if self.interval is None:
+            return self._set_due(self._next_daily(now))
+        if last_started is None:
+            return self._set_due(now + self.interval)
+        return self._set_due(max(now, last_started + self.interval))
+    
+    def advance(self, now):
+        """
+        Schedule the run after the one just dispatched
+        """
+        if self.interval is None:
+            return self._set_due(self._next_daily(now))
+        
+        due = self.due + self.interval
+        if due <= now:
+            # Fell behind (e.g. the process was suspended): skip the missed runs
+            due = now + self.interval
+        return self._set_due(due)
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'interval': self.interval,
+            'at': self.at,
+            'timeout': self.timeout,
+            'running': self.running,
+            'overrunning': self.timed_out,
+            'next_run': datetime.fromtimestamp(self.next_run).isoformat() if self.next_run else None,
+            'last_run': self.last_run.isoformat() if self.last_run else None,
+            'last_status': self.last_status,
+            'last_duration': round(self.last_duration, 3) if self.last_duration is not None else None,
+            'avg_duration': round(self.total_duration / self.runs, 3) if self.runs else None,
+            'max_duration': round(self.max_duration, 3),
+            'runs': self.runs,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'skipped_overlaps': self.skipped
+        }
+
+class JobScheduler:
+    """
+    Runs recurring jobs at their due time. Next-run times live in a heap and
+    a single dispatcher thread sleeps exactly until the earliest one; the
+    job itself runs on a worker pool inside the Flask app context, so a
+    slow job never delays the others. A job that is still running when it
+    comes due again is skipped (overlap guard). Last run times are
+    persisted in job_runs so a restart does not re-run every job at once.
+    
+    Python threads cannot be killed, so a job exceeding its timeout is
+    reported (and keeps blocking its own next runs) until it returns.
+    """
+    
+    def __init__(self, workers=4):
+        self.workers = workers
+        self.app = None
+        self.jobs = {}
+        self._heap = []
+        self._condition = threading.Condition()
+        self._pool = None
+        self._running = False
+        self._generation = 0
+    
+    def init_app(self, app):
+        """
+        Bind the Flask app whose context jobs run in
+        """
+        self.app = app
+    
+    def add_job(self, name, func, interval=None, at=None, jitter=0, timeout=None):
+        """
+        Register (or replace) a job by name
+        """
+        job = Job(name, func, interval=interval, at=at, jitter=jitter, timeout=timeout)
+        with self._condition:
+            self.jobs[name] = job
+            if self._running:
+                self._push(job, job.first_run(time.time()))
+        return job
+    
+    def _push(self, job, next_run):
+        job.next_run = next_run
+        heapq.heappush(self._heap, (next_run, job.name))
+        self._condition.notify()
+    
+    def _load_last_runs(self):
+        if self.app is None:
+            return {}
+        
+        try:
+            with self.app.app_context():
+                return {
+                    row.name: row.last_started
+                    for row in JobRun.query.filter(JobRun.name.in_(list(self.jobs))).all()
+                }
+        except Exception as e:
+            print(f"Error loading job history: {str(e)}")
+            return {}
+    
+    def start(self):
+        """
+        Start dispatching; interval jobs resume from their persisted last run
+        """
+        with self._condition:
+            if self._running:
+                return
+        
+        last_runs = self._load_last_runs()
+        
+        with self._condition:
+            self._running = True
+            self._generation += 1
+            generation = self._generation
+            
+            now = time.time()
+            self._heap = []
+            for job in self.jobs.values():
+                last_started = last_runs.get(job.name)
+                if last_started is not None:
+                    job.last_run = last_started
+                    last_started = last_started.replace(tzinfo=timezone.utc).timestamp()
+                self._push(job, job.first_run(now, last_started))
+            
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scheduled-job')
+        
+        thread = threading.Thread(target=self._run, args=(generation,), daemon=True, name='job-scheduler')
+        thread.start()
+    
+    def stop(self):
+        """
+        Stop dispatching; running jobs finish on their own
+        """
+        with self._condition:
+            self._running = False
+            self._heap = []
+            self._condition.notify_all()
+            pool, self._pool = self._pool, None
+        
+        if pool:
+            pool.shutdown(wait=False)
+    
+    def run_now(self, name):
+        """
+        Dispatch a job immediately (respecting the overlap guard)
+        """
+        with self._condition:
+            job = self.jobs[name]
+            return self._dispatch(job)
+    
+    def _check_timeouts(self, now):
+        """
+        Flag running jobs past their timeout; returns the next deadline to watch
+        """
+        next_deadline = None
+        for job in self.jobs.values():
+            if not job.running or not job.timeout or job.timed_out:
+                continue
+            
+            deadline = job.started_at + job.timeout
+            if now >= deadline:
+                job.timed_out = True
+                job.timeouts += 1
+                print(f"Scheduled job {job.name} exceeded its {job.timeout}s timeout")
+            elif next_deadline is None or deadline < next_deadline:
+                next_deadline = deadline
+        return next_deadline
+    
+    def _run(self, generation):
+        while True:
+            with self._condition:
+                # stop() (or a stop()/start() pair) retires this thread
+                if not self._running or generation != self._generation:
+                    return
+                
+                now = time.time()
+                next_deadline = self._check_timeouts(now)
+                
+                while self._heap and self._heap[0][0] <= now:
+                    next_run, name = heapq.heappop(self._heap)
+                    job = self.jobs.get(name)
+                    if job is None or job.next_run != next_run:
+                        continue  # replaced or removed job
+                    
+                    self._dispatch(job)
+                    self._push(job, job.advance(now))
+                
+                wake_times = [t for t in (next_deadline, self._heap[0][0] if self._heap else None) if t]
+                self._condition.wait(max(0, min(wake_times) - now) if wake_times else None)
+    
+    def _dispatch(self, job):
+        if job.running:
+            job.skipped += 1
+            return False
+        if self._pool is None:
+            return False
+        
+        job.running = True
+        job.timed_out = False
+        job.started_at = time.time()
+        self._pool.submit(self._execute, job)
+        return True
+    
+    def _execute(self, job):
+        started = datetime.utcnow()
+        start_time = time.perf_counter()
+        status, error = 'success', None
+        
+        try:
+            if self.app is not None:
+                with self.app.app_context():
+                    job.func()
+            else:
+                job.func()
+        except Exception as e:
+            status, error = 'failed', str(e)
+            print(f"Error in scheduled job {job.name}: {str(e)}")
+        
+        duration = time.perf_counter() - start_time
+        
+        with self._condition:
+            if status == 'success' and job.timed_out:
+                status = 'timeout'
+            job.running = False
+            job.last_run = started
+            job.last_duration = duration
+            job.last_status = status
+            job.runs += 1
+            job.failures += status == 'failed'
+            job.total_duration += duration
+            job.max_duration = max(job.max_duration, duration)
+        
+        self._record_run(job, started, duration, status, error)
+    
+    def _record_run(self, job, started, duration, status, error):
+        if self.app is None:
+            return
+        
+        try:
+            with self.app.app_context():
+                run = JobRun.query.filter_by(name=job.name).first()
+                if run is None:
+                    run = JobRun(name=job.name)
+                    db.session.add(run)
+                run.last_started = started
+                run.last_finished = datetime.utcnow()
+                run.last_duration = duration
+                run.last_status = status
+                run.last_error = error
+                db.session.commit()
+        except Exception as e:
+            print(f"Error recording run of {job.name}: {str(e)}")
+    
+    def get_status(self):
+        with self._condition:
+            return {
+                'running': self._running,
+                'workers': self.workers,
+                'jobs': [job.to_dict() for job in self.jobs.values()]
+            }
+
+# Global instance
+job_scheduler = JobScheduler(workers=int(os.getenv('SCHEDULER_WORKERS', '4')))
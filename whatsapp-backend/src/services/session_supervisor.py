@@ -0,0 +1,192 @@
+import os
+import time
+import threading
+from services.browser_pool import browser_pool
+
+class SessionSupervisor:
+    """
+    Watches the running WhatsApp Web sessions of the browser pool and
+    restarts the ones that broke: a monitor worker that stopped, a
+    chromedriver that exited, or a browser over its memory limit or pegged
+    above its CPU limit for several checks in a row. A restart quits the
+    old browser (killing leftover processes) and starts it again; repeated
+    restarts of one session back off exponentially up to `backoff_max`.
+    Memory and CPU are only watched when psutil is installed.
+    """
+    
+    def __init__(self, check_interval=30, max_rss_mb=1024, max_cpu_percent=90, cpu_strikes=4,
+                 backoff_base=5, backoff_max=300, stable_after=600):
+        self.check_interval = check_interval
+        self.max_rss_mb = max_rss_mb
+        self.max_cpu_percent = max_cpu_percent
+        self.cpu_strikes = cpu_strikes
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        self.app = None
+        self._state = {}
+        self._cpu_samples = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.stats_counters = {'checks': 0, 'restarts': 0, 'restart_failures': 0}
+    
+    def start(self, app):
+        """
+        Start checking sessions every check_interval seconds
+        """
+        self.app = app
+        if self._thread and self._thread.is_alive():
+            return
+        
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='session-supervisor')
+        self._thread.start()
+    
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+    
+    def _run(self):
+        while not self._stop_event.wait(self.check_interval):
+            try:
+                with self.app.app_context():
+                    self.check()
+            except Exception as e:
+                print(f"Error in session supervisor: {str(e)}")
+    
+    def _cpu_percent(self, number_id, processes):
+        """
+        CPU use of a session's processes since the previous check (percent of one core)
+        """
+        previous = self._cpu_samples.get(number_id, {})
+        current = {}
+        total = 0.0
+        for process in processes:
+            # psutil measures CPU between two calls on the same Process object
+            process = previous.get(process.pid, process)
+            current[process.pid] = process
+            try:
+                total += process.cpu_percent(interval=None)
+            except Exception:
+                continue
+        self._cpu_samples[number_id] = current
+        return total if previous else 0.0
+    
+    def _problem(self, number_id, service, state):
+        """
+        Why a running session needs a restart, or None if it is healthy
+        """
+        if not service.driver_alive():
+            return 'chromedriver exited'
+        
+        worker = service._worker_thread
+        if service.is_logged_in and (worker is None or not worker.is_alive()):
+            return 'monitor worker stopped'
+        
+        processes = service.browser_processes()
+        if not processes:
+            return None
+        
+        memory = service.memory_usage_mb()
+        if memory is not None and memory > self.max_rss_mb:
+            return f'using {memory:.0f} MB (limit {self.max_rss_mb} MB)'
+        
+        cpu = self._cpu_percent(number_id, processes)
+        state['cpu_percent'] = round(cpu, 1)
+        state['memory_mb'] = round(memory, 1) if memory is not None else None
+        if cpu > self.max_cpu_percent:
+            state['cpu_strikes'] += 1
+            if state['cpu_strikes'] >= self.cpu_strikes:
+                return f'CPU at {cpu:.0f}% for {state["cpu_strikes"]} checks'
+        else:
+            state['cpu_strikes'] = 0
+        return None
+    
+    def check(self):
+        """
+        Check every running session once and restart broken ones
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.stats_counters['checks'] += 1
+        
+        for number_id, service in list(browser_pool.sessions.items()):
+            state = self._state.setdefault(number_id, {
+                'restarts': 0, 'failures': 0, 'next_restart': 0, 'last_restart': None,
+                'last_reason': None, 'cpu_strikes': 0
+            })
+            
+            # Suspended and not yet started sessions are the pool's business
+            if not service.is_running:
+                self._cpu_samples.pop(number_id, None)
+                continue
+            
+            if state['failures'] and state['last_restart'] and now - state['last_restart'] > self.stable_after:
+                state['failures'] = 0
+            
+            reason = self._problem(number_id, service, state)
+            if reason:
+                self.restart(number_id, reason)
+    
+    def restart(self, number_id, reason):
+        """
+        Recycle a session unless it is still backing off from its last restart
+        """
+        state = self._state[number_id]
+        now = time.monotonic()
+        if now < state['next_restart']:
+            return False
+        
+        print(f"Restarting WhatsApp Web session {number_id}: {reason}")
+        state['restarts'] += 1
+        state['last_restart'] = now
+        state['last_reason'] = reason
+        state['cpu_strikes'] = 0
+        self._cpu_samples.pop(number_id, None)
+        
+        browser_pool.suspend(number_id)
+        service = browser_pool.acquire(number_id)
+        healthy = service is not None and service.driver_alive()
+        
+        with self._lock:
+            self.stats_counters['restarts'] += 1
+            if not healthy:
+                self.stats_counters['restart_failures'] += 1
+        
+        # Each restart in a row waits twice as long before the next one is allowed
+        state['failures'] += 1
+        state['next_restart'] = now + min(self.backoff_max, self.backoff_base * 2 ** (state['failures'] - 1))
+        return healthy
+    
+    def get_status(self):
+        now = time.monotonic()
+        with self._lock:
+            counters = dict(self.stats_counters)
+        
+        sessions = {}
+        for number_id, state in list(self._state.items()):
+            sessions[number_id] = {
+                'restarts': state['restarts'],
+                'last_reason': state['last_reason'],
+                'backoff_seconds': max(0, round(state['next_restart'] - now)),
+                'cpu_percent': state.get('cpu_percent'),
+                'memory_mb': state.get('memory_mb')
+            }
+        
+        return {
+            'running': bool(self._thread and self._thread.is_alive()),
+            'max_rss_mb': self.max_rss_mb,
+            'max_cpu_percent': self.max_cpu_percent,
+            'sessions': sessions,
+            **counters
+        }
+
+# Global instance
+session_supervisor = SessionSupervisor(
+    check_interval=float(os.getenv('WEB_SUPERVISOR_INTERVAL', '30')),
+    max_rss_mb=int(os.getenv('WEB_SESSION_MAX_RSS_MB', '1024')),
+    max_cpu_percent=float(os.getenv('WEB_SESSION_MAX_CPU_PERCENT', '90')),
+    backoff_max=float(os.getenv('WEB_RESTART_BACKOFF_MAX', '300'))
+)
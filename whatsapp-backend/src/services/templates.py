@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import random
+import string
+import threading
+from collections import namedtuple
+
+# Plain per-doctor record that templates render from; cheap to prefetch in bulk
+DoctorContext = namedtuple('DoctorContext', [
+    'doctor_id', 'name', 'full_name', 'phone', 'tag', 'score', 'message_count', 'last_interaction'
+])
+
+CONTEXT_FIELDS = frozenset(DoctorContext._fields)
+
+def doctor_context(doctor, message_count=0):
+    """
+    Build the render context for a Doctor row
+    """
+    return DoctorContext(
+        doctor_id=doctor.id,
+        name=doctor.name.replace('Dr. ', '') if doctor.name else 'Doctor',
+        full_name=doctor.name or '',
+        phone=doctor.phone,
+        tag=doctor.tag,
+        score=doctor.score or 0,
+        message_count=message_count,
+        last_interaction=doctor.last_interaction
+    )
+
+def load_doctor_contexts(doctors):
+    """
+    Build contexts for many doctors with at most one message-count query
+    """
+    from models.whatsapp import db, ChatMessage
+    from services.conversation_context import conversation_store
+    
+    doctors = list(doctors)
+    if not doctors:
+        return []
+    
+    # Doctors with a cached conversation need no query at all
+    counts = {}
+    for doctor in doctors:
+        context = conversation_store.peek(doctor.id)
+        if context is not None:
+            counts[doctor.id] = context.message_count
+    
+    doctor_ids = [doctor.id for doctor in doctors if doctor.id not in counts]
+    if doctor_ids:
+        counts.update(
+            db.session.query(ChatMessage.doctor_id, db.func.count(ChatMessage.id))
+            .filter(ChatMessage.doctor_id.in_(doctor_ids))
+            .group_by(ChatMessage.doctor_id)
+            .all()
+        )
+    
+    return [doctor_context(doctor, counts.get(doctor.id, 0)) for doctor in doctors]
+
+class CompiledTemplate:
+    """
+    A message template parsed once. Fields must be declared variables; they
+    are resolved from the DoctorContext record or from render() keyword
+    params, and rendering is a single str.format call.
+    """
+    
+    def __init__(self, text, variables):
+        self.text = text
+        self.variables = frozenset(variables)
+        self.params = self.variables - CONTEXT_FIELDS
+        
+        pieces = []
+        for literal, field_name, format_spec, conversion in string.Formatter().parse(text):
+            pieces.append(literal.replace('{', '{{').replace('}', '}}'))
+            if field_name is None:
+                continue
+            
+            if not field_name.isidentifier():
+                raise ValueError(f'Unsupported template field {{{field_name}}} in {text!r}')
+            if field_name not in self.variables:
+                raise ValueError(f'Undeclared template variable {{{field_name}}} in {text!r}')
+            
+            source = f'0.{field_name}' if field_name in CONTEXT_FIELDS else f'1[{field_name}]'
+            pieces.append('{' + source + (f'!{conversion}' if conversion else '') +
+                          (f':{format_spec}' if format_spec else '') + '}')
+        
+        self._format = ''.join(pieces).format
+    
+    def render(self, context, **params):
+        return self._format(context, params)
+
+class TemplateRegistry:
+    """
+    Named groups of template variants. Built-in defaults are registered by
+    the agents; a JSON file (TEMPLATES_PATH) can override or add groups and
+    is reloaded automatically when it changes:
+    
+        {"follow_up.interested": {"variables": ["name"], "variants": ["Dr. {name}, ..."]}}
+    """
+    
+    def __init__(self, path=None, check_interval=2.0):
+        self.path = path or os.getenv('TEMPLATES_PATH', 'message_templates.json')
+        self.check_interval = check_interval
+        self._defaults = {}
+        self._templates = {}
+        self._file_mtime = None
+        self._next_check = 0
+        self._lock = threading.Lock()
+    
+    def register_defaults(self, groups):
+        """
+        Register built-in groups: {key: (variables, [variant, ...])}
+        """
+        compiled = {
+            key: [CompiledTemplate(text, variables) for text in variants]
+            for key, (variables, variants) in groups.items()
+        }
+        with self._lock:
+            self._defaults.update(compiled)
+            for key, templates in compiled.items():
+                self._templates.setdefault(key, templates)
+    
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        
+        if mtime != self._file_mtime:
+            self.reload(mtime)
+    
+    def reload(self, mtime=None):
+        """
+        (Re)compile templates from the file on top of the built-in defaults.
+        A broken file is reported and the previous templates stay active.
+        """
+        try:
+            templates = dict(self._defaults)
+            if os.path.exists(self.path):
+                with open(self.path) as templates_file:
+                    for key, group in json.load(templates_file).items():
+                        templates[key] = [
+                            CompiledTemplate(text, group.get('variables', []))
+                            for text in group['variants']
+                        ]
+            
+            with self._lock:
+                self._templates = templates
+                self._file_mtime = mtime if mtime is not None else (
+                    os.path.getmtime(self.path) if os.path.exists(self.path) else None
+                )
+            return True
+        
+        except Exception as e:
+            print(f"Error loading message templates from {self.path}: {str(e)}")
+            self._file_mtime = mtime
+            return False
+    
+    def get(self, key):
+        self._maybe_reload()
+        return self._templates[key]
+    
+    def render(self, key, context, **params):
+        """
+        Render a random variant of a template group
+        """
+        return random.choice(self.get(key)).render(context, **params)
+    
+    def keys(self):
+        self._maybe_reload()
+        return sorted(self._templates)
+
+# Global instance
+template_registry = TemplateRegistry()
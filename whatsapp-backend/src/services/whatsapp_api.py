@@ -3,6 +3,7 @@ import json
 import os
 from datetime import datetime
 from models.whatsapp import db, WhatsAppNumber, ChatMessage, Doctor
+from services.conversation_locks import conversation_locks
 
 class WhatsAppAPIService:
     """
@@ -164,6 +165,24 @@ class WhatsAppAPIService:
             else:
                 message_text = f'[{message_type.title()}]'
             
+            # A doctor's messages are saved (and answered) by one thread at a time
+            with conversation_locks.locked(from_number) as acquired:
+                if not acquired:
+                    return {'error': f'Conversation with {from_number} is busy'}
+                return self._save_incoming_message(from_number, message_id, message_text, message_type, timestamp)
+            
+        except Exception as e:
+            return {'error': str(e)}
+    
+    def _save_incoming_message(self, from_number, message_id, message_text, message_type, timestamp):
+        """
+        Save an incoming message, once per message id
+        """
+        try:
+            # Webhook deliveries are retried; a message is only stored once
+            if message_id and ChatMessage.query.filter_by(external_id=message_id).first():
+                return {'success': True, 'message_id': message_id, 'duplicate': True}
+            
             # Find or create doctor
             doctor = Doctor.query.filter_by(phone=from_number).first()
             if not doctor:
@@ -188,6 +207,7 @@ class WhatsAppAPIService:
             chat_message = ChatMessage(
                 doctor_id=doctor.id,
                 whatsapp_number_id=whatsapp_number.id,
+                external_id=message_id,
                 sender='doctor',
                 message=message_text,
                 message_type=message_type,
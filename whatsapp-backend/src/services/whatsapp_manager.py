@@ -1,9 +1,51 @@
-import threading
+import os
 import time
+import importlib
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
 from models.whatsapp import db, WhatsAppNumber
-from services.whatsapp_api import WhatsAppAPIService
-from services.whatsapp_web import WhatsAppWebService
+from services.browser_pool import browser_pool
+from services.session_supervisor import session_supervisor
+from services.leader import leader_elector
+
+# Connection backends by connection_type, as 'module:Class'. A backend is only
+# imported once a number of its type is used, so API-only deployments and
+# CLI jobs never load Selenium (see requirements-web.txt).
+CONNECTION_BACKENDS = {
+    'API': 'services.whatsapp_api:WhatsAppAPIService',
+    'Web': 'services.whatsapp_web:WhatsAppWebService'
+}
+
+_loaded_backends = {}
+
+def register_connection_backend(connection_type, path):
+    """
+    Add or replace a connection backend ('module:Class')
+    """
+    CONNECTION_BACKENDS[connection_type] = path
+    _loaded_backends.pop(connection_type, None)
+
+def load_connection_backend(connection_type):
+    """
+    Import and return the backend class for a connection type
+    """
+    if connection_type not in _loaded_backends:
+        path = CONNECTION_BACKENDS.get(connection_type)
+        if path is None:
+            raise ValueError(f'Unknown connection type: {connection_type}')
+        
+        module_name, class_name = path.split(':')
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError as e:
+            raise ImportError(
+                f"The {connection_type} connection backend needs extra packages "
+                f"(pip install -r requirements-web.txt): {str(e)}"
+            )
+        _loaded_backends[connection_type] = getattr(module, class_name)
+    
+    return _loaded_backends[connection_type]
 
 class WhatsAppManager:
     """
@@ -11,23 +53,60 @@ class WhatsAppManager:
     """
     
     def __init__(self):
-        self.api_service = WhatsAppAPIService()
+        self._api_service = None
         self.web_services = {}  # Dictionary to store web service instances
         self.active_connections = {}
         self.monitoring_threads = {}
+        self.readiness = {}
+        self._startup_pool = ThreadPoolExecutor(
+            max_workers=int(os.getenv('WEB_STARTUP_WORKERS', '4')), thread_name_prefix='whatsapp-startup'
+        )
         
+    @property
+    def api_service(self):
+        """
+        The shared Business API client, created on first use
+        """
+        if self._api_service is None:
+            self._api_service = load_connection_backend('API')()
+        return self._api_service
+    
     def initialize_connections(self):
         """
-        Initialize all WhatsApp connections from database
+        Initialize all WhatsApp connections from database. API numbers are
+        marked in one transaction; Web sessions start in the background on
+        a bounded pool, as many as the browser pool's memory budget allows,
+        and report readiness per number as they come up (see get_readiness).
         """
         try:
+            started = time.monotonic()
             whatsapp_numbers = WhatsAppNumber.query.all()
             
-            for number in whatsapp_numbers:
-                if number.connection_type == 'API':
-                    self._initialize_api_connection(number)
-                elif number.connection_type == 'Web':
-                    self._initialize_web_connection(number)
+            api_numbers = [number for number in whatsapp_numbers if number.connection_type == 'API']
+            for number in api_numbers:
+                self._initialize_api_connection(number, commit=False)
+            db.session.commit()
+            for number in api_numbers:
+                self._set_readiness(number.id, 'ready' if number.status == 'active' else 'standby', started)
+            
+            # Numbers that were logged in last time start first
+            web_numbers = sorted(
+                (number for number in whatsapp_numbers if number.connection_type == 'Web'),
+                key=lambda number: number.status != 'active'
+            )
+            for number in web_numbers:
+                self._initialize_web_connection(number, start=False, commit=False)
+            db.session.commit()
+            
+            eager = web_numbers[:browser_pool.free_slots()]
+            for number in web_numbers[len(eager):]:
+                self._set_readiness(number.id, 'lazy', started)
+            
+            app = current_app._get_current_object()
+            session_supervisor.start(app)
+            for number in eager:
+                self._set_readiness(number.id, 'starting', started)
+                self._startup_pool.submit(self._start_web_number, app, number.id, started)
             
             return True
             
@@ -35,7 +114,52 @@ class WhatsAppManager:
             print(f"Error initializing connections: {str(e)}")
             return False
     
-    def _initialize_api_connection(self, whatsapp_number):
+    def _start_web_number(self, app, number_id, started):
+        """
+        Start one Web session (runs on the startup pool in its own app context)
+        """
+        with app.app_context():
+            try:
+                whatsapp_number = WhatsAppNumber.query.get(number_id)
+                if whatsapp_number and self._initialize_web_connection(whatsapp_number, start=True):
+                    state = 'ready' if whatsapp_number.status == 'active' else 'standby'
+                else:
+                    state = 'failed'
+            except Exception as e:
+                print(f"Error starting Web connection {number_id}: {str(e)}")
+                state = 'failed'
+            
+            readiness = self._set_readiness(number_id, state, started)
+            print(f"WhatsApp number {number_id} {state} after {readiness['seconds']}s")
+    
+    def _set_readiness(self, number_id, state, started):
+        readiness = {
+            'state': state,
+            'seconds': round(time.monotonic() - started, 1),
+            'updated_at': datetime.utcnow().isoformat()
+        }
+        self.readiness[number_id] = readiness
+        return readiness
+    
+    def get_readiness(self):
+        """
+        Startup state per number: 'starting', 'ready', 'standby' (needs a QR
+        scan or API credentials), 'lazy' (starts on first use) or 'failed';
+        Web sessions report their live state once started
+        """
+        readiness = {}
+        for number_id, entry in list(self.readiness.items()):
+            entry = dict(entry)
+            web_service = self.web_services.get(number_id)
+            if web_service is not None and entry['state'] not in ('starting', 'failed'):
+                if web_service.is_running:
+                    entry['state'] = 'ready' if web_service.is_logged_in else 'standby'
+                elif entry['state'] == 'ready':
+                    entry['state'] = 'suspended'
+            readiness[number_id] = entry
+        return readiness
+    
+    def _initialize_api_connection(self, whatsapp_number, commit=True):
         """
         Initialize API connection (no special setup needed)
         """
@@ -47,7 +171,8 @@ class WhatsAppManager:
             else:
                 whatsapp_number.status = 'standby'
             
-            db.session.commit()
+            if commit:
+                db.session.commit()
             
             self.active_connections[whatsapp_number.id] = {
                 'type': 'API',
@@ -61,51 +186,64 @@ class WhatsAppManager:
             print(f"Error initializing API connection: {str(e)}")
             return False
     
-    def _initialize_web_connection(self, whatsapp_number):
+    def _initialize_web_connection(self, whatsapp_number, start=None, commit=True):
         """
-        Initialize Web WhatsApp connection
+        Initialize Web WhatsApp connection. The session joins the browser
+        pool and its Chrome starts now only if the memory budget has room
+        (or start=True); otherwise it starts on first use.
         """
         try:
-            web_service = WhatsAppWebService(whatsapp_number.id, headless=True)
-            
-            if web_service.initialize_driver():
+            web_service = self.web_services.get(whatsapp_number.id)
+            if web_service is None:
+                web_service = load_connection_backend('Web')(whatsapp_number.id, headless=True)
                 self.web_services[whatsapp_number.id] = web_service
+                browser_pool.register(web_service, callback=self._handle_incoming_message)
+            
+            if start is None:
+                start = browser_pool.has_room()
+            
+            if start:
+                if browser_pool.acquire(whatsapp_number.id) is None:
+                    return False
                 
                 # Check if already logged in
-                if web_service.wait_for_login(timeout=10):
-                    whatsapp_number.status = 'active'
-                    web_service.is_logged_in = True
-                    
-                    # Start monitoring thread
-                    self._start_monitoring_thread(whatsapp_number.id, web_service)
-                else:
-                    whatsapp_number.status = 'standby'
-                
-                self.active_connections[whatsapp_number.id] = {
-                    'type': 'Web',
-                    'service': web_service,
-                    'status': whatsapp_number.status
-                }
-                
-                db.session.commit()
-                return True
+                whatsapp_number.status = 'active' if web_service.is_logged_in else 'standby'
+                if web_service.is_logged_in:
+                    self.monitoring_threads[whatsapp_number.id] = web_service._worker_thread
             
-            return False
+            # A lazy session keeps its last known status; an active profile stays logged in
+            self.active_connections[whatsapp_number.id] = {
+                'type': 'Web',
+                'service': web_service,
+                'status': whatsapp_number.status
+            }
+            
+            if commit:
+                db.session.commit()
+            return True
             
         except Exception as e:
             print(f"Error initializing Web connection: {str(e)}")
             return False
     
-    def _start_monitoring_thread(self, number_id, web_service):
+    def connect_number(self, number_id):
         """
-        Start monitoring thread for Web WhatsApp
+        Open the connection for a (newly added) number
         """
-        def monitor():
-            web_service.monitor_messages(callback=self._handle_incoming_message)
+        try:
+            whatsapp_number = WhatsAppNumber.query.get(number_id)
+            if not whatsapp_number:
+                return {'error': 'WhatsApp number not found'}
+            
+            if whatsapp_number.connection_type == 'API':
+                success = self._initialize_api_connection(whatsapp_number)
+            else:
+                success = self._initialize_web_connection(whatsapp_number, start=True)
+            
+            return {'success': success}
         
-        thread = threading.Thread(target=monitor, daemon=True)
-        thread.start()
-        self.monitoring_threads[number_id] = thread
+        except Exception as e:
+            return {'error': str(e)}
     
     def _handle_incoming_message(self, message_data):
         """
@@ -115,24 +253,28 @@ class WhatsAppManager:
         # Additional processing can be added here
         # e.g., trigger AI response, update lead scoring, etc.
     
-    def send_message(self, to_number, message_text, preferred_type=None):
+    def send_message(self, to_number, message_text, preferred_type=None, number_id=None):
         """
-        Send message using the best available connection
+        Send message using the best available connection, or through
+        number_id when that number is connected and active
         """
         try:
             # Get active connections
             active_numbers = [
-                conn for conn in self.active_connections.values() 
+                (num_id, conn) for num_id, conn in self.active_connections.items()
                 if conn['status'] == 'active'
             ]
             
             if not active_numbers:
                 return {'error': 'No active WhatsApp connections available'}
             
+            requested = [(num_id, conn) for num_id, conn in active_numbers if num_id == number_id]
+            if requested:
+                active_numbers = requested
             # Prefer API over Web if no preference specified
-            if preferred_type:
+            elif preferred_type:
                 preferred_connections = [
-                    conn for conn in active_numbers 
+                    (num_id, conn) for num_id, conn in active_numbers 
                     if conn['type'] == preferred_type
                 ]
                 if preferred_connections:
@@ -140,27 +282,26 @@ class WhatsAppManager:
             else:
                 # Prefer API connections
                 api_connections = [
-                    conn for conn in active_numbers 
+                    (num_id, conn) for num_id, conn in active_numbers 
                     if conn['type'] == 'API'
                 ]
                 if api_connections:
                     active_numbers = api_connections
             
             # Use the first available connection
-            connection = active_numbers[0]
+            number_id, connection = active_numbers[0]
             
             if connection['type'] == 'API':
-                # Find the WhatsApp number ID for this connection
-                number_id = None
-                for num_id, conn in self.active_connections.items():
-                    if conn == connection:
-                        number_id = num_id
-                        break
-                
                 return self.api_service.send_message(to_number, message_text, number_id)
             
             elif connection['type'] == 'Web':
-                return connection['service'].send_message(to_number, message_text)
+                # Resumes the session if the pool suspended it
+                web_service = browser_pool.acquire(number_id)
+                if web_service is None or not web_service.is_logged_in:
+                    return {'error': 'WhatsApp Web session could not be started'}
+                
+                # Queued to the session's worker, which owns the browser
+                return web_service.send_message(to_number, message_text)
             
             return {'error': 'Unknown connection type'}
             
@@ -184,6 +325,10 @@ class WhatsAppManager:
                     'messages_count': whatsapp_number.messages_count,
                     'last_active': whatsapp_number.last_active.isoformat() if whatsapp_number.last_active else None
                 }
+                
+                if connection['type'] == 'Web':
+                    status[number_id]['send_stats'] = connection['service'].get_send_stats()
+                    status[number_id]['session'] = 'running' if connection['service'].is_running else 'suspended'
             
             return status
             
@@ -203,21 +348,19 @@ class WhatsAppManager:
             if number_id in self.active_connections:
                 connection = self.active_connections[number_id]
                 if connection['type'] == 'Web' and number_id in self.web_services:
-                    self.web_services[number_id].close()
+                    browser_pool.unregister(number_id)
                     del self.web_services[number_id]
                 
                 del self.active_connections[number_id]
             
-            # Stop monitoring thread if it exists
-            if number_id in self.monitoring_threads:
-                # Note: We can't easily stop the thread, but it will stop when the service is closed
-                del self.monitoring_threads[number_id]
+            # The monitoring thread was stopped (and joined) when the pool let go of the session
+            self.monitoring_threads.pop(number_id, None)
             
             # Reinitialize connection
             if whatsapp_number.connection_type == 'API':
                 success = self._initialize_api_connection(whatsapp_number)
             else:
-                success = self._initialize_web_connection(whatsapp_number)
+                success = self._initialize_web_connection(whatsapp_number, start=True)
             
             if success:
                 return {'success': True, 'message': 'Connection restarted successfully'}
@@ -250,7 +393,7 @@ class WhatsAppManager:
                 if available_numbers.connection_type == 'API':
                     self._initialize_api_connection(available_numbers)
                 else:
-                    self._initialize_web_connection(available_numbers)
+                    self._initialize_web_connection(available_numbers, start=True)
                 
                 return {
                     'success': True, 
@@ -270,7 +413,9 @@ class WhatsAppManager:
             if number_id not in self.web_services:
                 return {'error': 'Web service not found for this number'}
             
-            web_service = self.web_services[number_id]
+            web_service = browser_pool.acquire(number_id)
+            if web_service is None:
+                return {'error': 'WhatsApp Web session could not be started'}
             qr_code = web_service.get_qr_code()
             
             if qr_code:
@@ -287,8 +432,8 @@ class WhatsAppManager:
         """
         try:
             # Close all web services
-            for web_service in self.web_services.values():
-                web_service.close()
+            session_supervisor.stop()
+            browser_pool.shutdown()
             
             self.web_services.clear()
             self.active_connections.clear()
@@ -300,3 +445,12 @@ class WhatsAppManager:
 # Global instance
 whatsapp_manager = WhatsAppManager()
 
+# Connections live in the leader process; other processes forward these calls
+leader_elector.register_command('numbers.connect', lambda payload: whatsapp_manager.connect_number(payload['number_id']))
+leader_elector.register_command('numbers.restart', lambda payload: whatsapp_manager.restart_connection(payload['number_id']))
+leader_elector.register_command('numbers.readiness', lambda payload: whatsapp_manager.get_readiness())
+leader_elector.register_command('numbers.qr', lambda payload: whatsapp_manager.get_qr_code(payload['number_id']))
+leader_elector.register_command('messages.send', lambda payload: whatsapp_manager.send_message(
+    payload['to_number'], payload['message'], payload.get('preferred_type'), payload.get('number_id')
+))
+
@@ -1,6 +1,10 @@
 import time
 import os
+import threading
 import json
+import queue
+from collections import OrderedDict, deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from datetime import datetime
 from selenium import webdriver
 from selenium.webdriver.common.by import By
@@ -9,7 +13,38 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.keys import Keys
 from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from sqlalchemy.exc import IntegrityError
+from flask import current_app
 from models.whatsapp import db, WhatsAppNumber, ChatMessage, Doctor
+from services.conversation_locks import conversation_locks
+from services.whatsapp_web_scripts import (
+    CAPTURE_SCRIPT,
+    DRAIN_SCRIPT,
+    OPEN_CHAT_SCRIPT,
+    EXTRACT_MESSAGES_SCRIPT,
+    FOCUS_CHAT_SCRIPT,
+    LAST_OUTGOING_ID_SCRIPT,
+    SENT_TICK_SCRIPT
+)
+
+# psutil is optional; without it session memory is estimated, not measured
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Chrome switches that trim per-session memory without affecting WhatsApp Web
+LOW_MEMORY_ARGUMENTS = [
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--mute-audio",
+    "--no-first-run",
+    "--renderer-process-limit=1",
+    "--disk-cache-size=33554432"
+]
 
 class WhatsAppWebService:
     """
@@ -22,6 +57,29 @@ class WhatsAppWebService:
         self.headless = headless
         self.is_logged_in = False
         self.session_path = f"/tmp/whatsapp_session_{whatsapp_number_id}"
+        # Overridden to point sessions at the offline simulator in perf/
+        self.web_url = os.getenv('WHATSAPP_WEB_URL', 'https://web.whatsapp.com').rstrip('/')
+        self.driver_lock = threading.RLock()  # the driver is not thread-safe
+        self.window_size = os.getenv('WEB_WINDOW_SIZE', '1280,800')
+        self.low_memory = os.getenv('WEB_LOW_MEMORY', 'on').lower() not in ('off', '0', 'false')
+        self.stop_event = threading.Event()
+        self.max_errors = int(os.getenv('WEB_MONITOR_MAX_ERRORS', '5'))
+        # How long a caller waits for a send queued to the session worker
+        self.send_timeout = float(os.getenv('WEB_SEND_TIMEOUT', '15'))
+        # Short long-polls keep queued sends waiting at most this long
+        self.poll_timeout = float(os.getenv('WEB_CAPTURE_POLL_SECONDS', '0.5'))
+        self.seen_limit = int(os.getenv('WEB_SEEN_MESSAGE_IDS', '5000'))
+        self.max_save_attempts = int(os.getenv('WEB_MESSAGE_SAVE_ATTEMPTS', '20'))
+        self._seen_ids = OrderedDict()  # recently saved data-ids, oldest first
+        self._chat_titles = {}  # phone -> chat list title, for opening chats in-app
+        self._held_messages = []  # new messages whose conversation was busy or save failed, retried next poll
+        self._save_attempts = {}  # message id -> failed saves so far
+        self._tasks = queue.Queue()
+        self._worker_thread = None
+        self._worker_running = False
+        self._stats_lock = threading.Lock()
+        self.send_durations = deque(maxlen=200)
+        self.send_stats = {'sent': 0, 'failed': 0, 'unconfirmed': 0, 'in_app': 0, 'page_loads': 0}
         
     def initialize_driver(self):
         """
@@ -34,8 +92,11 @@ class WhatsAppWebService:
             chrome_options.add_argument("--no-sandbox")
             chrome_options.add_argument("--disable-dev-shm-usage")
             chrome_options.add_argument("--disable-gpu")
-            chrome_options.add_argument("--window-size=1920,1080")
+            chrome_options.add_argument(f"--window-size={self.window_size}")
             chrome_options.add_argument(f"--user-data-dir={self.session_path}")
+            if self.low_memory:
+                for argument in LOW_MEMORY_ARGUMENTS:
+                    chrome_options.add_argument(argument)
             
             # Disable notifications
             prefs = {
@@ -44,7 +105,7 @@ class WhatsAppWebService:
             chrome_options.add_experimental_option("prefs", prefs)
             
             self.driver = webdriver.Chrome(options=chrome_options)
-            self.driver.get("https://web.whatsapp.com")
+            self.driver.get(self.web_url)
             
             return True
             
@@ -103,10 +164,35 @@ class WhatsAppWebService:
         except Exception as e:
             return None
     
-    def send_message(self, phone_number, message_text):
+    def send_message(self, phone_number, message_text, timeout=None):
         """
-        Send a message to a specific phone number
+        Send a message to a specific phone number. While the session worker
+        (the monitor loop) runs, the send is queued to it so only that
+        thread ever drives the browser; otherwise it runs here. A queued
+        send that has not started within `timeout` seconds (send_timeout by
+        default) is cancelled, so a timed-out send never goes out later.
         """
+        if self._worker_running and threading.current_thread() is not self._worker_thread:
+            future = self.submit(self._send_now, phone_number, message_text)
+            try:
+                return future.result(self.send_timeout if timeout is None else timeout)
+            except FutureTimeoutError:
+                if future.cancel():
+                    return {'error': 'Timed out waiting for the WhatsApp Web session'}
+                return {'error': 'Timed out waiting for the WhatsApp Web send to finish; it may still go out'}
+            except Exception as e:
+                return {'error': str(e)}
+        
+        with self.driver_lock:
+            return self._send_now(phone_number, message_text)
+    
+    def _send_now(self, phone_number, message_text):
+        """
+        Open the chat in the running app when it can be verified (falling
+        back to a /send?phone= page load), type and send, then wait for the
+        sent tick rather than sleeping
+        """
+        started = time.perf_counter()
         try:
             if not self.is_logged_in:
                 return {'error': 'Not logged in to WhatsApp Web'}
@@ -114,47 +200,124 @@ class WhatsAppWebService:
             # Format phone number (remove + and spaces)
             clean_phone = phone_number.replace('+', '').replace(' ', '').replace('-', '')
             
-            # Navigate to chat using phone number
-            chat_url = f"https://web.whatsapp.com/send?phone={clean_phone}"
-            self.driver.get(chat_url)
-            
-            # Wait for chat to load
-            time.sleep(3)
+            title = self._chat_titles.get(clean_phone)
+            in_app = bool(title) and self.driver.execute_async_script(FOCUS_CHAT_SCRIPT, title, f"{clean_phone}@c.us")
+            if not in_app:
+                # Navigate to chat using phone number
+                chat_url = f"{self.web_url}/send?phone={clean_phone}"
+                self.driver.get(chat_url)
+                self.send_stats['page_loads'] += 1
             
             # Check if chat loaded successfully
             try:
                 # Look for the message input box
-                message_box = WebDriverWait(self.driver, 10).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, '[data-testid="conversation-compose-box-input"]'))
+                message_box = WebDriverWait(self.driver, 20, poll_frequency=0.05).until(
+                    EC.element_to_be_clickable((By.CSS_SELECTOR, '[data-testid="conversation-compose-box-input"]'))
                 )
-                
-                # Type the message
-                message_box.click()
-                message_box.send_keys(message_text)
-                
-                # Send the message
-                send_button = self.driver.find_element(By.CSS_SELECTOR, '[data-testid="send"]')
-                send_button.click()
-                
-                # Wait a moment for message to be sent
-                time.sleep(2)
-                
-                # Update database
-                self._save_sent_message(phone_number, message_text)
-                
-                return {
-                    'success': True,
-                    'message': 'Message sent successfully',
-                    'via': self._get_whatsapp_number().number
-                }
-                
             except TimeoutException:
+                self._record_send(started, False)
                 return {'error': 'Could not find message input box'}
-                
+            
+            previous_id = self.driver.execute_script(LAST_OUTGOING_ID_SCRIPT)
+            
+            # Type the message, with Shift+Enter line breaks (a plain Enter would send
+            # each line as its own message), and send it with Enter
+            keys = []
+            for position, line in enumerate(message_text.replace('\r\n', '\n').split('\n')):
+                if position:
+                    # NULL releases Shift again
+                    keys.append(Keys.SHIFT + Keys.ENTER + Keys.NULL)
+                keys.append(line)
+            message_box.click()
+            message_box.send_keys(*keys, Keys.ENTER)
+            
+            # Wait for the sent tick on our (new) message
+            try:
+                external_id = WebDriverWait(self.driver, 10, poll_frequency=0.05).until(
+                    lambda driver: driver.execute_script(SENT_TICK_SCRIPT, message_text, previous_id)
+                )
+                confirmed = True
+            except TimeoutException:
+                # Typed and submitted but still pending; not reported as failed to avoid a resend
+                external_id, confirmed = None, False
+            
+            if external_id:
+                self._chat_titles[clean_phone] = self.driver.execute_script(
+                    'var el = document.querySelector(\'[data-testid="conversation-header"] span[title]\');'
+                    'return el ? el.getAttribute("title") : null;'
+                ) or title
+            
+            # Update database
+            self._save_sent_message(phone_number, message_text, external_id or None)
+            self._record_send(started, True, confirmed, in_app)
+            
+            return {
+                'success': True,
+                'message': 'Message sent successfully' if confirmed else 'Message submitted, not yet confirmed',
+                'confirmed': confirmed,
+                'via': self._get_whatsapp_number().number
+            }
+            
         except Exception as e:
+            self._record_send(started, False)
             return {'error': str(e)}
     
-    def _save_sent_message(self, phone_number, message_text):
+    def _record_send(self, started, success, confirmed=True, in_app=False):
+        with self._stats_lock:
+            if success:
+                self.send_durations.append(time.perf_counter() - started)
+                self.send_stats['sent'] += 1
+                self.send_stats['in_app'] += int(in_app)
+                self.send_stats['unconfirmed'] += int(not confirmed)
+            else:
+                self.send_stats['failed'] += 1
+    
+    def get_send_stats(self):
+        """
+        Send counters and durations (seconds) over the recent sends
+        """
+        with self._stats_lock:
+            durations = sorted(self.send_durations)
+            stats = dict(self.send_stats)
+        
+        stats['queued'] = self._tasks.qsize()
+        if durations:
+            stats['p50'] = round(durations[len(durations) // 2], 3)
+            stats['p95'] = round(durations[min(len(durations) - 1, int(len(durations) * 0.95))], 3)
+            stats['max'] = round(durations[-1], 3)
+        return stats
+    
+    def submit(self, func, *args):
+        """
+        Queue func(*args) for the session worker; returns a Future
+        """
+        future = Future()
+        self._tasks.put((func, args, future))
+        return future
+    
+    def _run_tasks(self, wait=0):
+        """
+        Run queued driver work, waiting up to `wait` seconds for the first task
+        """
+        try:
+            task = self._tasks.get(timeout=wait) if wait else self._tasks.get_nowait()
+        except queue.Empty:
+            return
+        
+        while task is not None:
+            func, args, future = task
+            if future.set_running_or_notify_cancel():
+                try:
+                    with self.driver_lock:
+                        future.set_result(func(*args))
+                except Exception as e:
+                    future.set_exception(e)
+            try:
+                task = self._tasks.get_nowait()
+            except queue.Empty:
+                task = None
+    
+    def _save_sent_message(self, phone_number, message_text, external_id=None):
         """
         Save sent message to database
         """
@@ -177,6 +340,7 @@ class WhatsAppWebService:
             chat_message = ChatMessage(
                 doctor_id=doctor.id,
                 whatsapp_number_id=whatsapp_number.id,
+                external_id=external_id,
                 sender='admin',
                 message=message_text,
                 status='sent'
@@ -209,7 +373,7 @@ class WhatsAppWebService:
                 return []
             
             # Navigate to main chat list
-            self.driver.get("https://web.whatsapp.com")
+            self.driver.get(self.web_url)
             time.sleep(3)
             
             unread_messages = []
@@ -236,93 +400,302 @@ class WhatsAppWebService:
         except Exception as e:
             return []
     
-    def _extract_messages_from_chat(self):
+    def _extract_messages_from_chat(self, limit=10, incoming_only=True):
         """
-        Extract messages from current chat
+        Extract messages from current chat. The DOM is walked in the page
+        by one execute_script call, instead of several WebDriver round trips
+        per message; each message carries its stable data-id.
         """
         try:
-            messages = []
+            return self.driver.execute_script(EXTRACT_MESSAGES_SCRIPT, limit, incoming_only) or []
             
-            # Get chat title (contact name or number)
-            chat_title = self.driver.find_element(By.CSS_SELECTOR, '[data-testid="conversation-header"] span[title]').get_attribute('title')
+        except Exception as e:
+            return []
+    
+    def start_capture(self):
+        """
+        Install the in-page observer that queues new messages (idempotent)
+        """
+        with self.driver_lock:
+            # The drain long-poll must finish well inside the script timeout
+            self.driver.set_script_timeout(self.poll_timeout + 10)
+            return self.driver.execute_script(CAPTURE_SCRIPT)
+    
+    def poll_messages(self, timeout=None):
+        """
+        Wait up to timeout seconds for new incoming messages pushed by the
+        in-page observer. Chats that got an unread badge are opened in the
+        page (no reload) and their unread messages read in the same call.
+        """
+        timeout = self.poll_timeout if timeout is None else timeout
+        
+        with self.driver_lock:
+            events = self.driver.execute_async_script(DRAIN_SCRIPT, int(timeout * 1000))
+            if events is None:
+                # The page was reloaded (e.g. by a send) and lost the observer
+                self.start_capture()
+                return []
             
-            # Get message elements
-            message_elements = self.driver.find_elements(By.CSS_SELECTOR, '[data-testid="msg-container"]')
+            messages = []
+            for event in events:
+                if event['kind'] == 'message':
+                    messages.append(event['data'])
+                elif event['kind'] == 'unread':
+                    chat_messages = self.driver.execute_async_script(OPEN_CHAT_SCRIPT, event['title'], event['count'])
+                    messages.extend(chat_messages or [])
             
-            for msg_element in message_elements[-10:]:  # Get last 10 messages
-                try:
-                    # Check if message is incoming (from contact)
-                    is_incoming = 'message-in' in msg_element.get_attribute('class')
-                    
-                    if is_incoming:
-                        # Extract message text
-                        text_element = msg_element.find_element(By.CSS_SELECTOR, '[data-testid="conversation-text"]')
-                        message_text = text_element.text
-                        
-                        # Extract timestamp
-                        time_element = msg_element.find_element(By.CSS_SELECTOR, '[data-testid="msg-meta"] span')
-                        timestamp = time_element.text
-                        
-                        messages.append({
-                            'from': chat_title,
-                            'message': message_text,
-                            'timestamp': timestamp,
-                            'type': 'incoming'
-                        })
-                        
-                except Exception as e:
-                    continue
+            for message in messages:
+                self._remember_chat(message)
             
             return messages
-            
-        except Exception as e:
+    
+    def _remember_chat(self, message):
+        """
+        Learn the chat list title of a phone number from a message's data-id
+        (e.g. false_919876543210@c.us_3EB0...), so replies can open it in-app
+        """
+        parts = (message.get('id') or '').split('_')
+        if len(parts) >= 2 and parts[1].endswith('@c.us') and message.get('from'):
+            self._chat_titles[parts[1][:-len('@c.us')]] = message['from']
+    
+    @property
+    def is_running(self):
+        return self.driver is not None
+    
+    def start_monitoring(self, callback=None):
+        """
+        Start the monitor loop (the session worker) on its own thread; must be
+        called inside an app context, which the thread inherits
+        """
+        app = current_app._get_current_object()
+        self.stop_event.clear()
+        
+        def monitor():
+            with app.app_context():
+                self.monitor_messages(callback=callback)
+        
+        thread = threading.Thread(target=monitor, daemon=True, name=f'whatsapp-web-{self.whatsapp_number_id}')
+        self._worker_thread = thread
+        thread.start()
+        return thread
+    
+    def suspend(self):
+        """
+        Stop the worker and quit Chrome, keeping the profile on disk so the
+        session resumes logged in. Messages that arrive meanwhile show up as
+        unread badges and are read when the session is resumed.
+        """
+        self.stop_event.set()
+        worker = self._worker_thread
+        if worker and worker is not threading.current_thread():
+            worker.join(timeout=self.poll_timeout + 10)
+        
+        with self.driver_lock:
+            self.close()
+            self.is_logged_in = False
+    
+    def driver_alive(self):
+        """
+        False once the chromedriver process has exited
+        """
+        try:
+            return self.driver is not None and self.driver.service.process.poll() is None
+        except Exception:
+            return self.driver is not None
+    
+    def browser_processes(self):
+        """
+        This session's chromedriver and Chrome processes ([] without psutil)
+        """
+        if psutil is None or self.driver is None:
+            return []
+        try:
+            process = psutil.Process(self.driver.service.process.pid)
+            return [process] + process.children(recursive=True)
+        except Exception:
             return []
     
+    def memory_usage_mb(self):
+        """
+        Resident memory of this session's chromedriver and Chrome processes,
+        or None if it cannot be measured (psutil missing or not running)
+        """
+        processes = self.browser_processes()
+        if not processes:
+            return None
+        total = 0
+        for process in processes:
+            try:
+                total += process.memory_info().rss
+            except Exception:
+                continue
+        return total / (1024 * 1024)
+    
     def monitor_messages(self, callback=None):
         """
-        Monitor for new incoming messages
+        Monitor for new incoming messages. Messages are pushed by an in-page
+        observer and long-polled, so they arrive within a few hundred ms
+        without reloading the page; if the observer cannot be installed this
+        falls back to reloading and scanning the chat list every 5 seconds.
+        
+        This loop is also the session worker: sends queued by other threads
+        run between polls, so the driver is only ever used from here.
         """
         try:
             if not self.is_logged_in:
                 return False
             
-            last_message_count = 0
+            self._worker_thread = threading.current_thread()
+            self._worker_running = True
             
-            while True:
+            try:
+                self.start_capture()
+                push_capture = True
+            except Exception as e:
+                print(f"Message observer unavailable, polling instead: {str(e)}")
+                push_capture = False
+            
+            errors = 0
+            while not self.stop_event.is_set():
                 try:
-                    # Check for new messages
-                    unread_messages = self.get_unread_messages()
+                    self._run_tasks()
+                    
+                    if push_capture:
+                        new_messages = self.poll_messages()
+                    else:
+                        # Check for new messages
+                        with self.driver_lock:
+                            new_messages = self.get_unread_messages()
+                    
+                    # Each message is handled once, however often it is read
+                    pending, self._held_messages = self._held_messages, []
+                    queued = {message.get('id') for message in pending}
+                    for message in new_messages:
+                        message_id = message.get('id')
+                        if message_id and (message_id in queued or self._recently_seen(message_id)):
+                            continue
+                        queued.add(message_id)
+                        pending.append(message)
+                    self._handle_messages(pending, callback)
                     
-                    if len(unread_messages) > last_message_count:
-                        new_messages = unread_messages[last_message_count:]
-                        
-                        for message in new_messages:
-                            # Save to database
-                            self._save_incoming_message(message)
-                            
-                            # Call callback if provided
-                            if callback:
-                                callback(message)
-                        
-                        last_message_count = len(unread_messages)
+                    if not push_capture:
+                        self._run_tasks(wait=5)  # Check every 5 seconds
                     
-                    time.sleep(5)  # Check every 5 seconds
+                    errors = 0
                     
                 except Exception as e:
                     print(f"Error monitoring messages: {str(e)}")
-                    time.sleep(10)
+                    errors += 1
+                    if errors >= self.max_errors or not self.driver_alive():
+                        # Leave it to the session supervisor to restart the browser
+                        print(f"Stopping monitor for WhatsApp number {self.whatsapp_number_id} after {errors} errors")
+                        break
+                    self.stop_event.wait(min(10, 2 ** errors))
                     
         except KeyboardInterrupt:
             print("Stopping message monitoring")
             return True
+        
+        finally:
+            self._worker_running = False
+            self._fail_pending_tasks()
+    
+    def _handle_messages(self, messages, callback=None):
+        """
+        Save new incoming messages and pass them to the callback, each under
+        its conversation lock. The worker never waits for that lock: the
+        thread holding it may itself be waiting on this worker to send, so
+        messages of a busy conversation are held (in order) for the next poll.
+        So are messages that could not be saved (e.g. database locked), and
+        the ones after them in the same conversation. Only saved messages,
+        or ones already saved, are marked as seen.
+        """
+        busy = set()
+        for message in messages:
+            conversation = conversation_locks.key(message.get('from'))
+            if conversation in busy:
+                self._held_messages.append(message)
+                continue
+            
+            with conversation_locks.locked(message.get('from'), blocking=False) as acquired:
+                if not acquired:
+                    busy.add(conversation)
+                    self._held_messages.append(message)
+                    continue
+                
+                # Save to database
+                saved = self._save_incoming_message(message)
+                if saved is None:
+                    if self._retry_later(message):
+                        busy.add(conversation)
+                    continue
+                
+                self._save_attempts.pop(message.get('id'), None)
+                self._mark_seen(message.get('id'))
+                if not saved:
+                    continue
+                
+                # Call callback if provided
+                if callback:
+                    callback(message)
+    
+    def _fail_pending_tasks(self):
+        while True:
+            try:
+                func, args, future = self._tasks.get_nowait()
+            except queue.Empty:
+                return
+            if future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError('WhatsApp Web session worker stopped'))
+    
+    def _retry_later(self, message):
+        """
+        Hold a message whose save failed for the next poll; returns False
+        (and drops it) after max_save_attempts failures
+        """
+        message_id = message.get('id')
+        attempts = self._save_attempts.get(message_id, 0) + 1
+        if attempts >= self.max_save_attempts:
+            self._save_attempts.pop(message_id, None)
+            print(f"Dropping incoming message {message_id} after {attempts} failed saves")
+            return False
+        
+        self._save_attempts[message_id] = attempts
+        self._held_messages.append(message)
+        return True
+    
+    def _recently_seen(self, message_id):
+        """
+        Whether a message id was saved recently. Only the last seen_limit ids
+        are kept, older repeats are caught by the unique index on
+        chat_messages.external_id.
+        """
+        if message_id in self._seen_ids:
+            self._seen_ids.move_to_end(message_id)
+            return True
+        return False
+    
+    def _mark_seen(self, message_id):
+        if not message_id:
+            return
+        
+        self._seen_ids[message_id] = True
+        self._seen_ids.move_to_end(message_id)
+        if len(self._seen_ids) > self.seen_limit:
+            self._seen_ids.popitem(last=False)
     
     def _save_incoming_message(self, message_data):
         """
-        Save incoming message to database
+        Save incoming message to database; returns True if saved, False if it
+        was already saved and None if saving failed (to be retried)
         """
         try:
             phone_number = message_data.get('from', '')
             message_text = message_data.get('message', '')
+            external_id = message_data.get('id')
+            
+            if external_id and ChatMessage.query.filter_by(external_id=external_id).first():
+                return False
             
             # Find or create doctor
             doctor = Doctor.query.filter_by(phone=phone_number).first()
@@ -342,6 +715,7 @@ class WhatsAppWebService:
             chat_message = ChatMessage(
                 doctor_id=doctor.id,
                 whatsapp_number_id=whatsapp_number.id,
+                external_id=external_id,
                 sender='doctor',
                 message=message_text,
                 status='received'
@@ -354,21 +728,39 @@ class WhatsAppWebService:
             whatsapp_number.last_active = datetime.utcnow()
             
             db.session.commit()
+            return True
+            
+        except IntegrityError as e:
+            db.session.rollback()
+            # Saved concurrently by another poll or process
+            if external_id and ChatMessage.query.filter_by(external_id=external_id).first():
+                return False
+            # Another constraint, e.g. the doctor was created concurrently: retry next poll
+            print(f"Error saving incoming message: {str(e)}")
+            return None
             
         except Exception as e:
             db.session.rollback()
             print(f"Error saving incoming message: {str(e)}")
+            return None
     
     def close(self):
         """
-        Close the WebDriver
+        Close the WebDriver. Chrome processes that survive quit() (e.g. when
+        chromedriver already died) are killed so they do not pile up.
         """
         if self.driver:
-            self.driver.quit()
-    
-    def __del__(self):
-        """
-        Cleanup when object is destroyed
-        """
-        self.close()
-
+            processes = self.browser_processes()
+            try:
+                self.driver.quit()
+            except Exception as e:
+                print(f"Error quitting driver: {str(e)}")
+            finally:
+                self.driver = None
+            
+            for process in processes:
+                try:
+                    if process.is_running():
+                        process.kill()
+                except Exception:
+                    continue
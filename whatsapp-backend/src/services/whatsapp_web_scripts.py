@@ -0,0 +1,236 @@
+"""
+JavaScript run inside the WhatsApp Web page by WhatsAppWebService
+"""
+
+# Shared helpers: the open chat's title and the fields of one message
+# container, read in page so a message costs no extra WebDriver round trips.
+MESSAGE_HELPERS = r"""
+function headerTitle() {
+    var el = document.querySelector('[data-testid="conversation-header"] span[title]');
+    return el ? el.getAttribute('title') : null;
+}
+
+function messageData(node, title) {
+    var row = node.closest('[data-id]');
+    var text = node.querySelector('[data-testid="conversation-text"]');
+    var meta = node.querySelector('[data-testid="msg-meta"] span');
+    var pre = node.querySelector('[data-pre-plain-text]');
+    var direction = node.classList.contains('message-in') ? 'incoming' : 'outgoing';
+    title = title === undefined ? headerTitle() : title;
+    return {
+        id: row ? row.getAttribute('data-id') : null,
+        from: title,
+        // Group chats name the author in "[time, date] Name: "
+        sender: pre ? pre.getAttribute('data-pre-plain-text').replace(/^\[[^\]]*\]\s*/, '').replace(/:\s*$/, '') : title,
+        message: text ? text.innerText : '',
+        timestamp: meta ? meta.innerText : '',
+        direction: direction,
+        type: direction
+    };
+}
+"""
+
+# Installs a MutationObserver that queues new incoming messages of the open
+# chat and unread badges appearing in the chat list. The messages on the page
+# when it is installed or when a chat is opened are history and only marked
+# as seen, as are rows inserted above the newest known one (older messages
+# loaded on scrolling up); rows appended after it are new.
+CAPTURE_SCRIPT = MESSAGE_HELPERS + r"""
+if (window.__waCapture) { return false; }
+var capture = window.__waCapture = {queue: [], seen: {}, seenCount: 0, waiter: null, chat: null, last: null};
+
+function markSeen(id) {
+    if (capture.seenCount++ > 5000) { capture.seen = {}; capture.seenCount = 0; }
+    capture.seen[id] = true;
+}
+
+function push(event) {
+    capture.queue.push(event);
+    if (capture.waiter) { var waiter = capture.waiter; capture.waiter = null; waiter(); }
+}
+
+function snapshot() {
+    var nodes = document.querySelectorAll('[data-testid="msg-container"]');
+    nodes.forEach(function (node) {
+        var data = messageData(node);
+        if (data.id) { markSeen(data.id); }
+    });
+    capture.last = nodes.length ? nodes[nodes.length - 1] : null;
+}
+
+function onMessage(node) {
+    var data = messageData(node);
+    if (!data.id || capture.seen[data.id]) { return; }
+    markSeen(data.id);
+    var last = capture.last;
+    if (last && last !== node && last.isConnected && (node.compareDocumentPosition(last) & Node.DOCUMENT_POSITION_FOLLOWING)) { return; }
+    capture.last = node;
+    if (data.direction === 'incoming') { push({kind: 'message', data: data}); }
+}
+
+function onUnread(badge) {
+    var cell = badge.closest('[data-testid="cell-frame-container"]');
+    var title = cell && cell.querySelector('span[title]');
+    if (title) {
+        push({kind: 'unread', title: title.getAttribute('title'), count: parseInt(badge.innerText, 10) || 1});
+    }
+}
+
+function scan(root) {
+    if (root.nodeType !== 1) { return; }
+    if (root.matches('[data-testid="msg-container"]')) { onMessage(root); }
+    root.querySelectorAll('[data-testid="msg-container"]').forEach(onMessage);
+    if (root.matches('[data-testid="unread-count"]')) { onUnread(root); }
+    root.querySelectorAll('[data-testid="unread-count"]').forEach(onUnread);
+}
+
+new MutationObserver(function (mutations) {
+    // A chat was opened: everything it rendered by now is its history
+    var title = headerTitle();
+    if (title !== capture.chat) { capture.chat = title; snapshot(); }
+    mutations.forEach(function (mutation) {
+        if (mutation.type === 'characterData') {
+            var badge = mutation.target.parentElement && mutation.target.parentElement.closest('[data-testid="unread-count"]');
+            if (badge) { onUnread(badge); }
+            return;
+        }
+        mutation.addedNodes.forEach(scan);
+    });
+}).observe(document.body, {childList: true, subtree: true, characterData: true});
+
+capture.headerTitle = headerTitle;
+capture.messageData = messageData;
+capture.markSeen = markSeen;
+capture.chat = headerTitle();
+snapshot();
+document.querySelectorAll('[data-testid="unread-count"]').forEach(onUnread);
+return true;
+"""
+
+# Long-poll: resolves as soon as events are queued, or with [] after
+# arguments[0] ms. Resolves with null if the observer is gone (page reloaded).
+DRAIN_SCRIPT = r"""
+var timeout = arguments[0], done = arguments[arguments.length - 1];
+var capture = window.__waCapture;
+if (!capture) { done(null); return; }
+
+function flush() { var events = capture.queue; capture.queue = []; done(events); }
+if (capture.queue.length) { flush(); return; }
+
+var timer = setTimeout(function () { capture.waiter = null; flush(); }, timeout);
+capture.waiter = function () { clearTimeout(timer); flush(); };
+"""
+
+# Opens the chat titled arguments[0] from the chat list without a page load
+# and resolves with its last arguments[1] incoming messages.
+OPEN_CHAT_SCRIPT = r"""
+var title = arguments[0], count = arguments[1], done = arguments[arguments.length - 1];
+var capture = window.__waCapture;
+if (!capture) { done(null); return; }
+
+var cell = null;
+document.querySelectorAll('[data-testid="cell-frame-container"]').forEach(function (candidate) {
+    var span = candidate.querySelector('span[title]');
+    if (!cell && span && span.getAttribute('title') === title) { cell = candidate; }
+});
+if (!cell) { done([]); return; }
+
+['mousedown', 'mouseup', 'click'].forEach(function (type) {
+    cell.dispatchEvent(new MouseEvent(type, {bubbles: true, cancelable: true, view: window}));
+});
+
+var deadline = Date.now() + 5000;
+(function collect() {
+    var nodes = document.querySelectorAll('[data-testid="msg-container"].message-in');
+    if ((capture.headerTitle() !== title || !nodes.length) && Date.now() < deadline) {
+        setTimeout(collect, 100);
+        return;
+    }
+    var messages = [];
+    Array.prototype.slice.call(nodes, -count).forEach(function (node) {
+        var data = capture.messageData(node);
+        if (data.id) { capture.markSeen(data.id); }
+        messages.push(data);
+    });
+    done(messages);
+})();
+"""
+
+# Reads the last arguments[0] messages of the open chat (incoming only if
+# arguments[1]) in one call and returns them as a list of dicts.
+EXTRACT_MESSAGES_SCRIPT = MESSAGE_HELPERS + r"""
+var limit = arguments[0], incomingOnly = arguments[1];
+var title = headerTitle();
+var nodes = Array.prototype.slice.call(document.querySelectorAll('[data-testid="msg-container"]'), -limit);
+var messages = [];
+nodes.forEach(function (node) {
+    var data = messageData(node, title);
+    if (!incomingOnly || data.direction === 'incoming') { messages.push(data); }
+});
+return messages;
+"""
+
+# Brings the chat titled arguments[0] to the front without a page load and
+# resolves true once it is open and verified to belong to jid arguments[1]
+# (message data-ids embed the chat jid); false if that cannot be confirmed.
+FOCUS_CHAT_SCRIPT = MESSAGE_HELPERS + r"""
+var title = arguments[0], jid = arguments[1], done = arguments[arguments.length - 1];
+
+function isOpen() {
+    if (headerTitle() !== title || !document.querySelector('[data-testid="conversation-compose-box-input"]')) { return false; }
+    var rows = document.querySelectorAll('[data-testid="msg-container"]');
+    for (var i = rows.length - 1; i >= 0; i--) {
+        var row = rows[i].closest('[data-id]');
+        if (row && row.getAttribute('data-id').indexOf('_' + jid + '_') !== -1) { return true; }
+    }
+    return false;
+}
+if (isOpen()) { done(true); return; }
+
+var cell = null;
+document.querySelectorAll('[data-testid="cell-frame-container"]').forEach(function (candidate) {
+    var span = candidate.querySelector('span[title]');
+    if (!cell && span && span.getAttribute('title') === title) { cell = candidate; }
+});
+if (!cell) { done(false); return; }
+
+['mousedown', 'mouseup', 'click'].forEach(function (type) {
+    cell.dispatchEvent(new MouseEvent(type, {bubbles: true, cancelable: true, view: window}));
+});
+
+var deadline = Date.now() + 3000;
+(function wait() {
+    if (isOpen()) { done(true); return; }
+    if (Date.now() > deadline) { done(false); return; }
+    setTimeout(wait, 50);
+})();
+"""
+
+# data-id of the last outgoing message, or null if there is none; read before
+# a send so SENT_TICK_SCRIPT can tell the new message from an older one.
+LAST_OUTGOING_ID_SCRIPT = r"""
+var nodes = document.querySelectorAll('[data-testid="msg-container"].message-out');
+var node = nodes[nodes.length - 1];
+var row = node ? node.closest('[data-id]') : null;
+return row ? row.getAttribute('data-id') : null;
+"""
+
+# data-id of the last outgoing message if it is new (its data-id differs from
+# arguments[1]), reads arguments[0] (whitespace-insensitive, so line breaks
+# match however the page renders them) and shows a sent/delivered/read tick
+# (not the pending clock), else null.
+SENT_TICK_SCRIPT = r"""
+var text = arguments[0];
+var previousId = arguments[1];
+var nodes = document.querySelectorAll('[data-testid="msg-container"].message-out');
+var node = nodes[nodes.length - 1];
+if (!node) { return null; }
+var row = node.closest('[data-id]');
+var id = row ? row.getAttribute('data-id') : '';
+if (id && id === previousId) { return null; }
+var normalize = function (value) { return value.replace(/\s+/g, ' ').trim(); };
+var body = node.querySelector('[data-testid="conversation-text"]');
+if (!body || normalize(body.innerText) !== normalize(text)) { return null; }
+if (!node.querySelector('[data-icon="msg-check"], [data-icon="msg-dblcheck"], [data-icon="msg-dblcheck-ack"]')) { return null; }
+return id;
+"""